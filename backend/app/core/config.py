@@ -6,6 +6,8 @@ class Settings(BaseSettings):
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 30
     UPLOAD_DIR: str = "/app/uploads"
+    # Token untuk endpoint /admin (header X-Admin-Token); kosong = /admin nonaktif
+    ADMIN_TOKEN: str = ""
 
     class Config:
         env_file = ".env"
@@ -1,8 +1,27 @@
 # app/main.py
+import os
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    from app.services import index_delta, index_store, index_versions, intent_classifier, model_registry, rag_engine, lawyer_rec, reranker
+    index_store.print_report()
+    # Pantau file CURRENT di root index berversi dan reload versi baru otomatis
+    index_versions.start_watcher(float(os.getenv("INDEX_WATCH_INTERVAL", "0")))
+    # Kompaksi log dokumen yang di-ingest online (versi index aktif; satu worker saja)
+    index_delta.start_compactor(lambda: [rag_engine.store.current.delta])
+    # Load model embedding sekali per worker sebelum menerima request
+    if os.getenv("EMBED_WARMUP", "1") == "1":
+        await run_in_threadpool(model_registry.warmup, [rag_engine.EMBED_MODEL, lawyer_rec.EMBED_MODEL])
+        await run_in_threadpool(intent_classifier.warmup)
+        await run_in_threadpool(reranker.warmup)
+    yield
 
-app = FastAPI(title="ThemisAI API")
+app = FastAPI(title="ThemisAI API", lifespan=lifespan)
 
 ALLOWED = ["http://localhost:5173","http://127.0.0.1:5173"]
 app.add_middleware(
@@ -20,7 +39,28 @@ app.add_middleware(
 def health():
     return {"status": "ok"}
 
-from app.routers import auth, chat, documents
+from app.routers import admin, auth, chat, documents
+app.include_router(admin.router)
 app.include_router(auth.router)
 app.include_router(chat.router)
 app.include_router(documents.router)
+
+@app.get("/health/encoder", include_in_schema=False)
+def encoder_health():
+    # metrik micro-batching encoder per model (ukuran batch, waktu tunggu antrean)
+    from app.services import model_registry
+    return model_registry.encoder_stats()
+
+
+@app.get("/health/intent", include_in_schema=False)
+def intent_health():
+    # berapa pesan dirutekan classifier lokal vs jatuh ke LLM
+    from app.services import intent_classifier
+    return intent_classifier.stats()
+
+
+@app.get("/health/speculation", include_in_schema=False)
+def speculation_health():
+    # retrieval spekulatif selama routing intent: hit rate dan waktu yang dihemat
+    from app.services import pidana_graph_agent
+    return pidana_graph_agent.speculation_stats()
@@ -0,0 +1,67 @@
+# app/routers/admin.py
+from __future__ import annotations
+
+import hmac
+from typing import Any, Dict, Optional
+
+from fastapi import APIRouter, Body, Depends, Header, HTTPException, Query
+
+from app.core.config import settings
+from app.services import index_versions, rag_engine
+
+router = APIRouter(prefix="/admin", tags=["admin"])
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(404, "admin API disabled")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, settings.ADMIN_TOKEN):
+        raise HTTPException(403, "invalid admin token")
+
+
+@router.get("/indexes", dependencies=[Depends(require_admin)])
+def list_indexes():
+    return [h.info() for h in index_versions.all_indexes()]
+
+
+@router.post("/indexes/{name}/reload", dependencies=[Depends(require_admin)])
+def reload_index(name: str, version: Optional[str] = Query(None)):
+    """
+    Muat versi baru (default: isi file CURRENT) lalu swap. Hanya worker yang
+    menerima request ini yang di-reload; untuk banyak worker pakai watcher
+    (INDEX_WATCH_INTERVAL).
+    """
+    try:
+        handle = index_versions.get(name)
+    except KeyError:
+        raise HTTPException(404, f"unknown index {name}")
+    try:
+        return handle.reload(version)
+    except (FileNotFoundError, ValueError, RuntimeError) as e:
+        raise HTTPException(409, f"reload failed, still serving {handle.version}: {e}")
+
+
+# =========================
+# Dokumen korpus RAG (update online, lihat app/services/index_delta.py)
+# =========================
+
+@router.post("/documents", dependencies=[Depends(require_admin)])
+def upsert_document(doc: Dict[str, Any] = Body(...)):
+    """Tambah atau ganti dokumen berdasarkan `id` (skema sama dengan UU_docs.jsonl)."""
+    try:
+        return rag_engine.ingest_document(doc)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+
+@router.delete("/documents/{doc_id}", dependencies=[Depends(require_admin)])
+def delete_document(doc_id: str):
+    try:
+        return rag_engine.delete_document(doc_id)
+    except KeyError:
+        raise HTTPException(404, f"document {doc_id} not found")
+
+
+@router.post("/documents/compact", dependencies=[Depends(require_admin)])
+def compact_documents():
+    return rag_engine.store.current.delta.compact()
@@ -1,16 +1,23 @@
 from __future__ import annotations
 
+import asyncio
+import json
+import logging
+import time
 from datetime import datetime
 from typing import Optional, List
 from uuid import UUID
 
-from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
-from app.services.pidana_graph_agent import run_pidana_graph
+from app.services.llm_client import LLMDeadlineExceeded
+from app.services.pidana_graph_agent import run_pidana_graph, stream_pidana_graph
 from app.services.doc_utils import extract_text_from_document
 
-from app.db.database import get_db
+from app.db.database import get_db, SessionLocal
 from app.db import models
 from app.routers.auth import get_current_user
 from app.db.models import MessageRoleEnum, SessionStatusEnum, DocTypeEnum, DocumentStore
@@ -35,6 +42,7 @@ class _BaseModel(BaseModel):
 # --------------------------------------------
 
 router = APIRouter(prefix="/chat", tags=["chat"])
+logger = logging.getLogger(__name__)
 
 # =========================
 # Schemas (Outputs)
@@ -147,7 +155,8 @@ def delete_session(
 # Messages
 # =========================
 
-def _build_extra_context_from_docs(docs: List[models.DocumentStore], max_chars: int = 8000) -> Optional[str]:
+def _build_extra_context_from_docs(docs: List[models.DocumentStore]) -> Optional[str]:
+    """Gabungan teks dokumen lampiran; dipotong sesuai budget token di rag_engine.build_payload."""
     parts: List[str] = []
     for doc in docs:
         txt = (doc.extracted_text or "").strip()
@@ -159,10 +168,7 @@ def _build_extra_context_from_docs(docs: List[models.DocumentStore], max_chars:
     if not parts:
         return None
 
-    full = "\n\n---\n\n".join(parts).strip()
-    if len(full) > max_chars:
-        full = full[:max_chars] + "\n\n...[dipotong, dokumen terlalu panjang]"
-    return full
+    return "\n\n---\n\n".join(parts).strip()
 
 
 @router.get("/sessions/{session_id}/messages", response_model=List[ChatMessageOut])
@@ -186,12 +192,15 @@ def list_messages(
         _ = [att.document for att in m.attachments]
     return msgs
 
-@router.post("/messages", status_code=status.HTTP_201_CREATED, response_model=ChatMessageOut)
-def create_message(
+def _save_user_message(
     payload: CreateMessageIn,
-    db: Session = Depends(get_db),
-    current: models.Person = Depends(get_current_user),
-):
+    db: Session,
+    current: models.Person,
+) -> Optional[str]:
+    """
+    Simpan pesan user (+ lampiran dokumen) dan kembalikan extra_context
+    dari dokumen yang dilampirkan. Dipakai oleh endpoint biasa & streaming.
+    """
     sess = db.get(models.ChatSession, payload.session_id)
     if not sess or sess.person_id != current.id:
         raise HTTPException(404, "session not found")
@@ -234,29 +243,153 @@ def create_message(
         db.commit()
 
         # Build extra_context dari extracted_text yang sudah disimpan di DocumentStore
-        extra_context = _build_extra_context_from_docs(docs, max_chars=8000)
+        extra_context = _build_extra_context_from_docs(docs)
+
+    return extra_context
+
+
+DISCONNECT_POLL_SECONDS = 0.5
+
+
+async def _cancel_on_disconnect(request: Request, coro):
+    """
+    Jalankan `coro` sebagai task dan batalkan jika client HTTP memutus koneksi
+    (call vLLM yang sedang berjalan ikut dibatalkan lewat llm_client).
+    """
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                logger.info("client disconnect, agent dibatalkan (%s)", request.url.path)
+                raise HTTPException(499, "client closed request")
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+@router.post("/messages", status_code=status.HTTP_201_CREATED, response_model=ChatMessageOut)
+async def create_message(
+    payload: CreateMessageIn,
+    request: Request,
+    db: Session = Depends(get_db),
+    current: models.Person = Depends(get_current_user),
+):
+    # Route async: hanya query DB (singkat) yang masuk thread pool; menunggu
+    # vLLM (bisa sampai 300 detik) tidak menahan thread pool yang juga
+    # melayani endpoint lain seperti /auth/me.
+    extra_context = await run_in_threadpool(_save_user_message, payload, db, current)
 
     # 3) Panggil PIDANA GRAPH AGENT
+    started = time.perf_counter()
     try:
-        answer = run_pidana_graph(payload.content, current, extra_context=extra_context)
+        answer = await _cancel_on_disconnect(
+            request, run_pidana_graph(payload.content, current, extra_context=extra_context)
+        )
         sources = None
+    except HTTPException:
+        raise
+    except LLMDeadlineExceeded as e:
+        raise HTTPException(504, f"Pidana agent timed out: {e}")
     except Exception as e:
         raise HTTPException(500, f"Pidana agent failed: {e}")
 
-    # 4) Simpan jawaban bot
+    # 4) Simpan jawaban bot (+ latensi agent, sama seperti endpoint streaming)
+    latency_ms = int((time.perf_counter() - started) * 1000)
+    logger.info("chat session=%s latency_ms=%d", payload.session_id, latency_ms)
+    return await run_in_threadpool(_store_bot_answer, db, payload.session_id, answer, sources, latency_ms)
+
+
+def _store_bot_answer(
+    db: Session, session_id: UUID, answer: str, sources, latency_ms: Optional[int] = None
+) -> models.ChatMessage:
     bot_msg = models.ChatMessage(
-        session_id=payload.session_id,
+        session_id=session_id,
         role=MessageRoleEnum.bot,
         content=answer,
         reasoning_context=sources,
+        latency_ms=latency_ms,
     )
     db.add(bot_msg)
     db.commit()
     db.refresh(bot_msg)
-
+    # muat relasi selagi masih di thread pool (response_model membaca attachments)
+    _ = [att.document for att in bot_msg.attachments]
     return bot_msg
 
 
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+def _save_bot_message(session_id: UUID, content: str, latency_ms: int) -> dict:
+    # Session DB dari Depends(get_db) sudah ditutup saat body streaming dikirim,
+    # jadi simpan jawaban akhir dengan session baru.
+    db = SessionLocal()
+    try:
+        bot_msg = models.ChatMessage(
+            session_id=session_id,
+            role=MessageRoleEnum.bot,
+            content=content,
+            latency_ms=latency_ms,
+        )
+        db.add(bot_msg)
+        db.commit()
+        db.refresh(bot_msg)
+        if _PYDANTIC_V2:
+            return ChatMessageOut.model_validate(bot_msg).model_dump(mode="json")
+        return json.loads(ChatMessageOut.from_orm(bot_msg).json())
+    finally:
+        db.close()
+
+
+@router.post("/messages/stream")
+def create_message_stream(
+    payload: CreateMessageIn,
+    db: Session = Depends(get_db),
+    current: models.Person = Depends(get_current_user),
+):
+    """
+    Sama seperti POST /chat/messages, tetapi jawaban dikirim sebagai
+    server-sent events:
+      - event `token`: potongan teks jawaban ({"delta": "..."})
+      - event `done` : pesan bot yang sudah disimpan + ttft_ms & latency_ms
+      - event `error`: jika agent gagal di tengah jalan
+    """
+    extra_context = _save_user_message(payload, db, current)
+    # Muat alamat sekarang: graph berjalan setelah session DB request ini ditutup
+    # (handler LAWYER_REC membaca current.address).
+    _ = current.address
+
+    async def event_stream():
+        started = time.perf_counter()
+        ttft_ms: Optional[int] = None
+        parts: List[str] = []
+        try:
+            async for delta in stream_pidana_graph(payload.content, current, extra_context=extra_context):
+                if ttft_ms is None:
+                    ttft_ms = int((time.perf_counter() - started) * 1000)
+                parts.append(delta)
+                yield _sse("token", {"delta": delta})
+        except Exception as e:
+            yield _sse("error", {"detail": f"Pidana agent failed: {e}"})
+            return
+
+        latency_ms = int((time.perf_counter() - started) * 1000)
+        logger.info("chat/stream session=%s ttft_ms=%s latency_ms=%d", payload.session_id, ttft_ms, latency_ms)
+        bot_msg = await run_in_threadpool(_save_bot_message, payload.session_id, "".join(parts), latency_ms)
+        yield _sse("done", {"message": bot_msg, "ttft_ms": ttft_ms, "latency_ms": latency_ms})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 
 @router.put("/sessions/{session_id}", response_model=ChatSessionOut)
 def update_session(
@@ -0,0 +1,142 @@
+# app/services/batch_encoder.py
+"""
+Micro-batching untuk encode query SentenceTransformer.
+
+Setiap request chat memanggil encode([text]) untuk satu kalimat. Saat trafik
+bersamaan, banyak forward pass 1-baris berebut CPU. BatchingEncoder
+mengumpulkan panggilan encode yang datang bersamaan (maks. `max_batch` item
+atau menunggu paling lama `max_wait_ms`) lalu menjalankan satu forward pass.
+
+Metrik per batch (ukuran batch & waktu tunggu di antrean) tersedia lewat
+stats() untuk tuning p99 latency vs throughput di node CPU-only.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+ENCODER_MAX_BATCH = int(os.getenv("ENCODER_MAX_BATCH", "32"))
+ENCODER_MAX_WAIT_MS = float(os.getenv("ENCODER_MAX_WAIT_MS", "5"))
+
+# Jumlah batch terakhir yang disimpan untuk perhitungan persentil
+_STATS_WINDOW = 1000
+
+
+def _percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    return float(np.percentile(np.fromiter(values, dtype="float64"), q))
+
+
+class BatchingEncoder:
+    def __init__(self, model, max_batch: int = ENCODER_MAX_BATCH, max_wait_ms: float = ENCODER_MAX_WAIT_MS):
+        self.model = model
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000.0
+
+        self._queue: "queue.Queue[Tuple[str, float, Future]]" = queue.Queue()
+        self._worker: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._batch_sizes: deque = deque(maxlen=_STATS_WINDOW)
+        self._queue_wait_ms: deque = deque(maxlen=_STATS_WINDOW)
+        self._encode_ms: deque = deque(maxlen=_STATS_WINDOW)
+
+    # ---------- API ----------
+
+    def submit(self, text: str) -> Future:
+        self._ensure_worker()
+        fut: Future = Future()
+        self._queue.put((text, time.perf_counter(), fut))
+        return fut
+
+    def encode(self, text: str) -> np.ndarray:
+        """Vektor ter-normalisasi L2, shape (1, dim) float32 — siap untuk index.search."""
+        return self.submit(text).result()
+
+    async def aencode(self, text: str) -> np.ndarray:
+        return await asyncio.wrap_future(self.submit(text))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            sizes = list(self._batch_sizes)
+            waits = list(self._queue_wait_ms)
+            enc = list(self._encode_ms)
+            return {
+                "max_batch": self.max_batch,
+                "max_wait_ms": self.max_wait * 1000,
+                "batches": self._batches,
+                "items": self._items,
+                "queue_depth": self._queue.qsize(),
+                "batch_size_mean": float(np.mean(sizes)) if sizes else 0.0,
+                "batch_size_max": max(sizes) if sizes else 0,
+                "queue_wait_ms_p50": _percentile(waits, 50),
+                "queue_wait_ms_p99": _percentile(waits, 99),
+                "encode_ms_p50": _percentile(enc, 50),
+                "encode_ms_p99": _percentile(enc, 99),
+            }
+
+    # ---------- worker ----------
+
+    def _ensure_worker(self) -> None:
+        if self._worker is not None:
+            return
+        with self._start_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="batch-encoder", daemon=True)
+                self._worker.start()
+
+    def _collect(self) -> List[Tuple[str, float, Future]]:
+        first = self._queue.get()
+        batch = [first]
+        deadline = first[1] + self.max_wait
+        while len(batch) < self.max_batch:
+            left = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=left) if left > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            batch = [b for b in batch if b[2].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            try:
+                embs = self.model.encode(
+                    [b[0] for b in batch],
+                    batch_size=len(batch),
+                    normalize_embeddings=True,
+                    convert_to_numpy=True,
+                ).astype("float32")
+            except Exception as e:
+                for _, _, fut in batch:
+                    fut.set_exception(e)
+                continue
+            finished = time.perf_counter()
+
+            for i, (_, _, fut) in enumerate(batch):
+                fut.set_result(embs[i:i + 1])
+
+            with self._stats_lock:
+                self._batches += 1
+                self._items += len(batch)
+                self._batch_sizes.append(len(batch))
+                self._encode_ms.append((finished - started) * 1000)
+                for _, enqueued, _ in batch:
+                    self._queue_wait_ms.append((started - enqueued) * 1000)
@@ -0,0 +1,170 @@
+# app/services/context_packer.py
+"""
+Menyusun konteks prompt RAG berdasarkan jumlah token, bukan karakter.
+
+Token dihitung dengan tokenizer model yang dilayani vLLM (TOKENIZER_NAME,
+default MODEL_NAME), termasuk overhead chat template. Urutan pengisian:
+
+1. chunk hasil retrieval sesuai ranking; overlap dengan chunk lain yang sudah
+   masuk (window 450/80 kata yang bersebelahan) dibuang dulu, chunk yang tidak
+   muat dilewati
+2. sisa budget diisi dokumen pengguna, dipotong tepat di batas token
+
+Total prompt dibatasi PROMPT_TOKEN_BUDGET, lalu max_tokens jawaban diambil dari
+sisa LLM_CONTEXT_WINDOW (maks. batas yang diminta pemanggil), sehingga vLLM
+tidak menolak request karena prompt + max_tokens melebihi max-model-len.
+
+Jika tokenizer tidak bisa di-load (mis. offline), dipakai estimasi
+_CHARS_PER_TOKEN karakter per token.
+"""
+from __future__ import annotations
+
+import os
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from app.services import model_registry
+
+TOKENIZER_NAME = os.getenv("TOKENIZER_NAME", os.getenv("MODEL_NAME", "Qwen/Qwen2.5-3B-Instruct"))
+LLM_CONTEXT_WINDOW = int(os.getenv("LLM_CONTEXT_WINDOW", "8192"))
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6144"))
+MIN_ANSWER_TOKENS = int(os.getenv("MIN_ANSWER_TOKENS", "512"))
+# Overlap antar window chunk di rag_dev/build_faiss_index.py (chunk_text overlap=80)
+CHUNK_OVERLAP_WORDS = int(os.getenv("CHUNK_OVERLAP_WORDS", "80"))
+
+TRUNCATION_NOTE = "\n\n...[dipotong, dokumen terlalu panjang]"
+
+# Overlap lebih pendek dari ini dianggap kebetulan (frasa umum), bukan window bertumpuk
+_MIN_OVERLAP_WORDS = 8
+_CHARS_PER_TOKEN = 3
+# Perkiraan token untuk penomoran "[n] (doc_type)" + baris sumber per chunk
+_HIT_OVERHEAD_TOKENS = 16
+
+_tokenizer = None
+_tokenizer_failed = False
+
+
+# ============================
+# Hitung token
+# ============================
+
+def _get_tokenizer():
+    global _tokenizer, _tokenizer_failed
+    if _tokenizer is None and not _tokenizer_failed:
+        try:
+            _tokenizer = model_registry.get_tokenizer(TOKENIZER_NAME)
+        except Exception as e:
+            _tokenizer_failed = True
+            print(f"[context_packer] tokenizer {TOKENIZER_NAME} tidak tersedia ({e}); "
+                  f"estimasi {_CHARS_PER_TOKEN} karakter/token")
+    return _tokenizer
+
+
+def count_tokens(text: str) -> int:
+    tok = _get_tokenizer()
+    if tok is None:
+        return -(-len(text) // _CHARS_PER_TOKEN)
+    return len(tok.encode(text, add_special_tokens=False))
+
+
+def count_chat_tokens(messages: Sequence[Dict[str, str]]) -> int:
+    """Jumlah token prompt seperti yang dihitung vLLM (chat template + generation prompt)."""
+    tok = _get_tokenizer()
+    if tok is not None and getattr(tok, "chat_template", None):
+        return len(tok.apply_chat_template(list(messages), tokenize=True, add_generation_prompt=True))
+    # tanpa template: perkiraan penanda role/pemisah per pesan
+    return sum(count_tokens(m["content"]) + 8 for m in messages) + 8
+
+
+def truncate_tokens(text: str, n_tokens: int) -> str:
+    """Potong `text` menjadi paling banyak `n_tokens` token."""
+    if n_tokens <= 0:
+        return ""
+    # cegah tokenisasi dokumen berukuran MB hanya untuk dibuang sebagian besar
+    text = text[:n_tokens * 8]
+    tok = _get_tokenizer()
+    if tok is None:
+        return text[:n_tokens * _CHARS_PER_TOKEN]
+    ids = tok.encode(text, add_special_tokens=False)
+    if len(ids) <= n_tokens:
+        return text
+    return tok.decode(ids[:n_tokens])
+
+
+# ============================
+# Overlap antar chunk
+# ============================
+
+def _overlap(head: List[str], tail: List[str]) -> int:
+    """Panjang overlap terbesar: akhir `head` == awal `tail` (dalam kata)."""
+    for n in range(min(CHUNK_OVERLAP_WORDS, len(head), len(tail)), _MIN_OVERLAP_WORDS - 1, -1):
+        if head[-n:] == tail[:n]:
+            return n
+    return 0
+
+
+def strip_overlap(text: str, kept: Sequence[str]) -> str:
+    """Buang bagian `text` yang sudah ada di awal/akhir chunk lain di `kept`."""
+    words = text.split()
+    trimmed = False
+    for other in kept:
+        other_words = other.split()
+        n = _overlap(other_words, words)
+        if n:
+            words, trimmed = words[n:], True
+        n = _overlap(words, other_words)
+        if n:
+            words, trimmed = words[:-n], True
+        if not words:
+            return ""
+    return " ".join(words) if trimmed else text
+
+
+# ============================
+# Packing
+# ============================
+
+def prompt_budget() -> int:
+    """Budget prompt efektif: selalu menyisakan MIN_ANSWER_TOKENS untuk jawaban."""
+    return min(PROMPT_TOKEN_BUDGET, LLM_CONTEXT_WINDOW - MIN_ANSWER_TOKENS)
+
+
+def pack_context(
+    hits: List[Dict[str, Any]],
+    extra_context: Optional[str],
+    budget: int,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Pilih chunk (urut relevansi) dan potong dokumen pengguna agar muat di
+    `budget` token. Mengembalikan (hits terpilih dengan text tanpa overlap,
+    extra_context terpotong atau None).
+    """
+    packed: List[Dict[str, Any]] = []
+    kept_texts: List[str] = []
+    left = budget
+    for h in hits:
+        text = strip_overlap(h["text"], kept_texts)
+        if not text:
+            continue
+        cost = count_tokens(text) + _HIT_OVERHEAD_TOKENS
+        if cost > left:
+            if packed:
+                continue
+            # chunk teratas selalu ikut, dipotong jika perlu
+            text = truncate_tokens(text, left - _HIT_OVERHEAD_TOKENS)
+            if not text:
+                continue
+            cost = left
+        packed.append({**h, "text": text})
+        kept_texts.append(text)
+        left -= cost
+
+    if extra_context:
+        if len(extra_context) > left * 8 or count_tokens(extra_context) > left:
+            extra_context = truncate_tokens(extra_context, left - count_tokens(TRUNCATION_NOTE))
+            extra_context = extra_context + TRUNCATION_NOTE if extra_context else None
+    return packed, extra_context
+
+
+def answer_tokens(prompt_tokens: int, max_answer_tokens: int) -> int:
+    """max_tokens untuk vLLM: sisa context window, dibatasi `max_answer_tokens`."""
+    return max(1, min(max_answer_tokens, LLM_CONTEXT_WINDOW - prompt_tokens))
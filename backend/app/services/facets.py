@@ -0,0 +1,150 @@
+# app/services/facets.py
+"""
+Filter metadata (doc_type, level, court, title, tahun) untuk retrieval.
+
+Saat index dimuat, setiap facet diubah menjadi daftar row id terurut per nilai
+(dan untuk tahun: row id yang diurutkan menurut tahun, sehingga rentang tahun
+cukup dua searchsorted). Hasil filter dijadikan bitmap dan diteruskan ke FAISS
+sebagai IDSelectorBitmap, jadi FAISS sendiri yang melewati row di luar filter;
+tidak perlu over-fetch lalu buang hasil.
+
+Contoh filter:
+    {"title": "KUHAP"}
+    {"doc_type": ["putusan"], "year_min": 2020}
+    {"level": "UU", "court": "Mahkamah Agung", "year_max": 2015}
+"""
+from __future__ import annotations
+
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional
+
+import faiss
+import numpy as np
+
+CATEGORICAL_FACETS = ("doc_type", "level", "court", "title")
+YEAR_KEYS = ("year_min", "year_max")
+_SELECTOR_CACHE_SIZE = 64
+
+
+def _norm(value: Any) -> str:
+    return str(value).strip().lower() if value is not None else ""
+
+
+def _year(value: Any) -> int:
+    m = re.search(r"\b(1[89]\d\d|20\d\d)\b", str(value or ""))
+    return int(m.group(1)) if m else -1
+
+
+class RowFilter:
+    """Hasil filter: bitmap untuk FAISS + mask boolean untuk BM25/lookup pasal."""
+
+    def __init__(self, mask: np.ndarray):
+        self.mask = mask
+        self.count = int(mask.sum())
+        # `bits` harus tetap hidup selama selector dipakai (FAISS hanya menyimpan pointer)
+        self.bits = np.packbits(mask, bitorder="little")
+        self.selector = faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(self.bits))
+
+    def allows(self, row: int) -> bool:
+        return 0 <= row < len(self.mask) and bool(self.mask[row])
+
+
+class FacetIndex:
+    def __init__(self, meta):
+        self.n = len(meta)
+        self._values: Dict[str, Dict[str, np.ndarray]] = {}
+        for facet in CATEGORICAL_FACETS:
+            groups: Dict[str, list] = {}
+            for row, value in enumerate(meta.column(facet)):
+                groups.setdefault(_norm(value), []).append(row)
+            self._values[facet] = {v: np.asarray(rows, dtype="int64") for v, rows in groups.items()}
+
+        # tahun dokumen; untuk putusan tanpa `year` dipakai tahun decision_date
+        years = np.array(
+            [_year(y) if _year(y) > 0 else _year(d)
+             for y, d in zip(meta.column("year"), meta.column("decision_date"))],
+            dtype="int64",
+        )
+        order = np.argsort(years, kind="stable")
+        self._years_sorted = years[order]
+        self._rows_by_year = order.astype("int64")
+
+        self._cache: "OrderedDict[tuple, RowFilter]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def values(self, facet: str) -> Iterable[str]:
+        return self._values.get(facet, {}).keys()
+
+    def _rows(self, filters: Dict[str, Any]) -> np.ndarray:
+        mask = np.ones(self.n, dtype=bool)
+        for facet in CATEGORICAL_FACETS:
+            wanted = filters.get(facet)
+            if wanted is None:
+                continue
+            if isinstance(wanted, (str, int)):
+                wanted = [wanted]
+            facet_mask = np.zeros(self.n, dtype=bool)
+            for v in wanted:
+                rows = self._values[facet].get(_norm(v))
+                if rows is not None:
+                    facet_mask[rows] = True
+            mask &= facet_mask
+
+        lo_year, hi_year = filters.get("year_min"), filters.get("year_max")
+        if lo_year is not None or hi_year is not None:
+            # batas bawah minimal 0 -> row tanpa tahun (-1) tidak ikut
+            lo = np.searchsorted(self._years_sorted, int(lo_year) if lo_year is not None else 0, side="left")
+            hi = np.searchsorted(self._years_sorted, int(hi_year) if hi_year is not None else 10**9, side="right")
+            year_mask = np.zeros(self.n, dtype=bool)
+            year_mask[self._rows_by_year[lo:hi]] = True
+            mask &= year_mask
+        return mask
+
+    @staticmethod
+    def matches(rec: Dict[str, Any], filters: Optional[Dict[str, Any]]) -> bool:
+        """Versi per-record dari _rows() untuk row di luar index (dokumen ingest online)."""
+        if not filters:
+            return True
+        for facet in CATEGORICAL_FACETS:
+            wanted = filters.get(facet)
+            if wanted is None:
+                continue
+            if isinstance(wanted, (str, int)):
+                wanted = [wanted]
+            if _norm(rec.get(facet)) not in {_norm(v) for v in wanted}:
+                return False
+        lo_year, hi_year = filters.get("year_min"), filters.get("year_max")
+        if lo_year is not None or hi_year is not None:
+            year = _year(rec.get("year"))
+            if year <= 0:
+                year = _year(rec.get("decision_date"))
+            if year < (int(lo_year) if lo_year is not None else 0):
+                return False
+            if hi_year is not None and year > int(hi_year):
+                return False
+        return True
+
+    def select(self, filters: Optional[Dict[str, Any]]) -> Optional[RowFilter]:
+        """RowFilter untuk filter yang diberikan, atau None jika tidak ada filter."""
+        if not filters:
+            return None
+        unknown = set(filters) - set(CATEGORICAL_FACETS) - set(YEAR_KEYS)
+        if unknown:
+            raise ValueError(f"Unknown search filter(s): {sorted(unknown)}")
+
+        key = tuple(sorted(
+            (k, tuple(v) if isinstance(v, (list, tuple)) else v) for k, v in filters.items()
+        ))
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                return cached
+        row_filter = RowFilter(self._rows(filters))
+        with self._lock:
+            self._cache[key] = row_filter
+            if len(self._cache) > _SELECTOR_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return row_filter
@@ -0,0 +1,442 @@
+# app/services/index_delta.py
+"""
+Update index online: tambah / ganti / hapus dokumen tanpa full rebuild.
+
+Index utama (index.faiss + meta/ + sparse/ + pasal_index.json) di-mmap
+read-only dan tidak pernah diubah. Perubahan ditulis ke log append-only
+per versi index:
+
+    INDEX_DELTA_DIR/<versi>/log.jsonl
+      {"op": "upsert", "id": ..., "doc": {...}, "rows": [chunk...], "vectors": "<base64 float32>",
+       "parents": [teks window...]}   (chunker token; row["parent"] = indeks di "parents")
+      {"op": "delete", "id": ...}
+
+Setiap worker me-replay log ke DeltaState di memori:
+- faiss.IndexIDMap2(IndexFlatIP) untuk vektor chunk baru; row id-nya
+  melanjutkan row id index utama (n_base, n_base+1, ...) dan tidak dipakai ulang
+- tombstone: row index utama milik dokumen yang diganti/dihapus, dikeluarkan
+  dari pencarian lewat bitmap (sama seperti filter facet)
+- statistik BM25 dan kunci pasal untuk chunk baru
+
+DeltaState bersifat copy-on-write: setiap perubahan membuat state baru lalu
+referensinya ditukar, jadi request yang sedang mencari tidak perlu lock.
+Index FAISS delta tidak ikut disalin: semua state memakai index yang sama
+secara append-only (vektor chunk yang diganti/dihapus tetap di sana), dan
+state hanya melihat row yang ada di `rows`-nya sendiri. Index dibangun ulang
+saat log di-replay dari awal (setelah kompaksi). Worker lain melihat
+perubahan saat snapshot() berikutnya (cek ukuran log, paling sering
+DELTA_REFRESH_INTERVAL detik).
+
+Kompaksi (background, INDEX_COMPACT_INTERVAL, hanya di worker pemegang
+INDEX_DELTA_DIR/.compactor.lock) menulis ulang log hanya dengan entri yang
+masih berlaku. Untuk melebur delta ke index utama, jalankan builder dengan
+--delta-log lalu publish versi baru (app/services/index_versions.py). Log
+versi baru mulai kosong, jadi manifest mencatat log yang dilebur
+("delta_log") dan reload menolak versi yang tidak memuat semua entri log
+versi aktif.
+"""
+from __future__ import annotations
+
+import base64
+import fcntl
+import json
+import os
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import faiss
+import numpy as np
+
+from app.services import legal_chunker, model_registry
+from app.services.facets import FacetIndex, RowFilter
+
+INDEX_DELTA_DIR = os.getenv("INDEX_DELTA_DIR", "/app/app/db/index_delta")
+DELTA_REFRESH_INTERVAL = float(os.getenv("DELTA_REFRESH_INTERVAL", "1"))
+INDEX_COMPACT_INTERVAL = float(os.getenv("INDEX_COMPACT_INTERVAL", "600"))
+# Kompaksi hanya jika porsi entri log yang sudah tidak berlaku >= nilai ini
+INDEX_COMPACT_MIN_DEAD = float(os.getenv("INDEX_COMPACT_MIN_DEAD", "0.3"))
+
+LOG_NAME = "log.jsonl"
+COMPACTOR_LOCK = ".compactor.lock"
+
+
+def _encode_vectors(vecs: np.ndarray) -> str:
+    return base64.b64encode(np.ascontiguousarray(vecs, dtype="<f4").tobytes()).decode("ascii")
+
+
+def _decode_vectors(data: str, dim: int) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(data), dtype="<f4").reshape(-1, dim).astype("float32")
+
+
+class DeltaState:
+    """Snapshot delta yang tidak diubah setelah dipublikasikan."""
+
+    def __init__(self, dim: int, n_base: int):
+        self.dim = dim
+        self.n_base = n_base
+        # dipakai bersama semua state turunan (append-only); add/search lewat index_lock
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+        self.index_lock = threading.Lock()
+        self.rows: Dict[int, Dict[str, Any]] = {}
+        self.tokens: Dict[int, Tuple[Counter, int]] = {}
+        self.doc_rows: Dict[str, List[int]] = {}
+        self.pasal: Dict[str, List[int]] = {}
+        self.tombstones: Dict[str, np.ndarray] = {}
+        self.alive: Optional[np.ndarray] = None
+        # doc id -> entri log terakhir yang masih berlaku (untuk kompaksi)
+        self.live: Dict[str, str] = {}
+        self.entries = 0
+        self.next_row = n_base
+        self._alive_filter: Optional[RowFilter] = None
+
+    def copy(self) -> "DeltaState":
+        new = DeltaState.__new__(DeltaState)
+        new.__dict__.update(self.__dict__)
+        for name in ("rows", "tokens", "doc_rows", "tombstones", "live"):
+            setattr(new, name, dict(getattr(self, name)))
+        new.pasal = {k: list(v) for k, v in self.pasal.items()}
+        new._alive_filter = None
+        return new
+
+    # ---------- query ----------
+
+    def allows(self, row: int) -> bool:
+        """Row index utama yang tidak di-tombstone."""
+        return self.alive is None or bool(self.alive[row])
+
+    def base_filter(self, row_filter: Optional[RowFilter]) -> Optional[RowFilter]:
+        """Filter facet index utama dikurangi row yang di-tombstone."""
+        if self.alive is None:
+            return row_filter
+        if row_filter is not None:
+            return RowFilter(row_filter.mask & self.alive)
+        if self._alive_filter is None:
+            self._alive_filter = RowFilter(self.alive)
+        return self._alive_filter
+
+    def record(self, row: int, fields: Sequence[str]) -> Optional[Dict[str, Any]]:
+        rec = self.rows.get(row)
+        return None if rec is None else {f: rec.get(f) for f in fields}
+
+    def search(self, qv: np.ndarray, k: int, filters=None) -> Tuple[List[int], List[float]]:
+        if not self.rows:
+            return [], []
+        # delta kecil: cari semua lalu saring facet di Python
+        with self.index_lock:
+            D, I = self.index.search(qv, int(self.index.ntotal))
+        ids, scores = [], []
+        for row, score in zip(I[0], D[0]):
+            # row di luar `rows`: chunk yang sudah diganti/dihapus, atau ditambah setelah snapshot ini
+            rec = self.rows.get(int(row))
+            if rec is not None and FacetIndex.matches(rec, filters):
+                ids.append(int(row))
+                scores.append(float(score))
+                if len(ids) >= k:
+                    break
+        return ids, scores
+
+    def lexical(self, query: str, k: int, sparse, filters=None) -> Tuple[List[int], List[float]]:
+        """BM25 atas chunk delta memakai tokenizer, IDF dan avgdl index utama."""
+        if not self.tokens or sparse is None:
+            return [], []
+        terms = {t: sparse.idf_of(t) for t in set(sparse.tokenize(query))}
+        avgdl = max(sparse.avgdl, 1e-9)
+        scored = []
+        for row, (tf, dl) in self.tokens.items():
+            score = 0.0
+            for term, idf in terms.items():
+                f = tf.get(term)
+                if f:
+                    score += idf * f * (sparse.k1 + 1) / (f + sparse.k1 * (1 - sparse.b + sparse.b * dl / avgdl))
+            if score > 0 and FacetIndex.matches(self.rows[row], filters):
+                scored.append((score, row))
+        scored.sort(reverse=True)
+        return [r for _, r in scored[:k]], [s for s, _ in scored[:k]]
+
+    def pasal_lookup(self, cites, filters=None) -> List[int]:
+        ids: List[int] = []
+        for statute, pasal, ayat in cites:
+            rows = self.pasal.get(f"{statute}|{pasal}|{ayat}") if ayat else None
+            if not rows:
+                rows = self.pasal.get(f"{statute}|{pasal}") or []
+            for r in rows:
+                if r not in ids and FacetIndex.matches(self.rows[r], filters):
+                    ids.append(r)
+        return ids
+
+
+class DeltaIndex:
+    def __init__(self, log_dir: str | Path, dim: int, n_base: int, base_ids: Callable[[], Sequence[Any]],
+                 sparse=None, pasal_index=None, chunking: Optional[Dict[str, Any]] = None):
+        """
+        `base_ids()` -> kolom `id` index utama; dipanggil lazy saat tombstone pertama.
+        `chunking` = blok "chunking" manifest versi index (lihat legal_chunker.to_records).
+        """
+        self.dir = Path(log_dir)
+        self.chunking = chunking
+        self.path = self.dir / LOG_NAME
+        self._base_ids_fn = base_ids
+        self._base_rows: Optional[Dict[str, List[int]]] = None
+        self.sparse = sparse
+        self.pasal_index = pasal_index
+        self._lock = threading.Lock()
+        self._pos = 0
+        self._ino: Optional[int] = None
+        self._checked = 0.0
+        self.state = DeltaState(dim, n_base)
+        self._refresh()
+
+    # ---------- replay log ----------
+
+    def _base_doc_rows(self) -> Dict[str, List[int]]:
+        """doc id -> row index utama (dibangun saat pertama dibutuhkan)."""
+        if self._base_rows is None:
+            rows: Dict[str, List[int]] = {}
+            for row, doc_id in enumerate(self._base_ids_fn()):
+                rows.setdefault(str(doc_id), []).append(row)
+            self._base_rows = rows
+        return self._base_rows
+
+    def _apply(self, state: DeltaState, entry: Dict[str, Any], line: str) -> None:
+        doc_id = str(entry["id"])
+        old = state.doc_rows.pop(doc_id, [])
+        if old:
+            # vektornya tetap di index bersama; tanpa entri `rows` tidak lagi terlihat
+            for r in old:
+                state.rows.pop(r, None)
+                state.tokens.pop(r, None)
+            for key, rows in list(state.pasal.items()):
+                kept = [r for r in rows if r not in old]
+                if kept:
+                    state.pasal[key] = kept
+                else:
+                    del state.pasal[key]
+
+        base_rows = self._base_doc_rows().get(doc_id)
+        if base_rows and doc_id not in state.tombstones:
+            state.tombstones[doc_id] = np.asarray(base_rows, dtype="int64")
+            alive = np.ones(state.n_base, dtype=bool) if state.alive is None else state.alive.copy()
+            alive[state.tombstones[doc_id]] = False
+            state.alive = alive
+
+        state.entries += 1
+        if entry["op"] == "delete":
+            # delete tetap dicatat selama dokumen masih ada di index utama
+            if base_rows:
+                state.live[doc_id] = line
+            else:
+                state.live.pop(doc_id, None)
+            return
+
+        records = entry["rows"]
+        vecs = _decode_vectors(entry["vectors"], state.dim)
+        ids = np.arange(state.next_row, state.next_row + len(records), dtype="int64")
+        state.next_row += len(records)
+        with state.index_lock:
+            state.index.add_with_ids(vecs, ids)
+        parents = entry.get("parents") or []
+        for row, rec in zip(ids.tolist(), records):
+            if rec.get("parent") is not None:
+                rec["parent_text"] = parents[rec["parent"]]
+            state.rows[row] = rec
+            if self.sparse is not None:
+                toks = self.sparse.tokenize(rec["text"])
+                state.tokens[row] = (Counter(toks), len(toks))
+            statute = self.pasal_index.statute_of(rec.get("title", "")) if self.pasal_index else None
+            if statute and rec.get("pasal"):
+                base = f"{statute}|{rec['pasal'].lower()}"
+                state.pasal.setdefault(base, []).append(row)
+                for ayat in legal_chunker.chunk_ayats(rec["text"]):
+                    state.pasal.setdefault(f"{base}|{ayat}", []).append(row)
+        state.doc_rows[doc_id] = ids.tolist()
+        state.live[doc_id] = line
+
+    def _refresh(self) -> None:
+        """Terapkan entri log baru (atau replay ulang jika log sudah dikompaksi)."""
+        with self._lock:
+            try:
+                st = self.path.stat()
+            except FileNotFoundError:
+                return
+            if st.st_ino == self._ino and st.st_size == self._pos:
+                return
+            replay = st.st_ino != self._ino or st.st_size < self._pos
+            if replay:
+                state = DeltaState(self.state.dim, self.state.n_base)
+                # row id tidak dipakai ulang, jadi row lama di request yang sedang jalan tidak tertukar
+                state.next_row = self.state.next_row
+                pos = 0
+            else:
+                state, pos = self.state.copy(), self._pos
+            with self.path.open("rb") as f:
+                f.seek(pos)
+                data = f.read()
+            # hanya baris lengkap; baris yang sedang ditulis proses lain dibaca berikutnya
+            end = data.rfind(b"\n") + 1
+            for raw in data[:end].splitlines():
+                if raw.strip():
+                    line = raw.decode("utf-8")
+                    self._apply(state, json.loads(line), line)
+            self.state, self._pos, self._ino = state, pos + end, st.st_ino
+
+    def snapshot(self) -> DeltaState:
+        now = time.monotonic()
+        if now - self._checked >= DELTA_REFRESH_INTERVAL:
+            self._checked = now
+            self._refresh()
+        return self.state
+
+    # ---------- tulis ----------
+
+    def _append(self, entry: Dict[str, Any]) -> None:
+        self.dir.mkdir(parents=True, exist_ok=True)
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        while True:
+            with self.path.open("a", encoding="utf-8") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    # log bisa sudah diganti kompaksi selagi menunggu lock -> buka ulang
+                    if os.fstat(f.fileno()).st_ino != self.path.stat().st_ino:
+                        continue
+                    f.write(line)
+                    f.flush()
+                    os.fsync(f.fileno())
+                    break
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+        self._refresh()
+
+    def _tokenizer(self):
+        """Tokenizer encoder untuk chunker token (None untuk window kata)."""
+        if (self.chunking or {}).get("chunker") != "tokens":
+            return None
+        return model_registry.get_model(self.chunking["tokenizer"]).tokenizer
+
+    def upsert(self, doc: Dict[str, Any], encode: Callable[[List[str]], np.ndarray]) -> Dict[str, Any]:
+        """Tambah atau ganti dokumen (berdasarkan `id`); chunk + embedding dihitung di sini."""
+        records = legal_chunker.to_records(doc, self.chunking, self._tokenizer())
+        if not records:
+            raise ValueError("document has no text")
+        doc_id = records[0]["id"]
+        vecs = np.asarray(encode([r["text"] for r in records]), dtype="float32")
+        if vecs.shape != (len(records), self.state.dim):
+            raise ValueError(f"embedding shape {vecs.shape} != ({len(records)}, {self.state.dim})")
+        replaced = doc_id in self.state.doc_rows or doc_id in self._base_doc_rows()
+        # teks parent disimpan sekali per window, bukan di setiap chunk
+        parents: List[str] = []
+        for rec in records:
+            parent_text = rec.pop("parent_text", None)
+            if parent_text is not None:
+                if not parents or parents[-1] is not parent_text:
+                    parents.append(parent_text)
+                rec["parent"] = len(parents) - 1
+        entry = {"op": "upsert", "id": doc_id, "ts": time.time(), "doc": {**doc, "id": doc_id},
+                 "rows": records, "vectors": _encode_vectors(vecs)}
+        if parents:
+            entry["parents"] = parents
+        self._append(entry)
+        return {"id": doc_id, "chunks": len(records), "replaced": replaced}
+
+    def delete(self, doc_id: str) -> Dict[str, Any]:
+        state = self.snapshot()
+        known = doc_id in state.doc_rows or (doc_id in self._base_doc_rows() and doc_id not in state.tombstones)
+        if not known:
+            raise KeyError(doc_id)
+        self._append({"op": "delete", "id": doc_id, "ts": time.time()})
+        return {"id": doc_id, "deleted": True}
+
+    def pending(self, merged: Optional[Dict[str, Any]]) -> int:
+        """
+        Jumlah entri log berlaku yang tidak ikut dilebur ke versi lain.
+        `merged` = blok "delta_log" manifest versi itu (log versi mana, sampai ts berapa).
+        """
+        self._refresh()
+        live = list(self.state.live.values())
+        if not merged or merged.get("version") != self.dir.name:
+            return len(live)
+        return sum(1 for line in live if json.loads(line).get("ts", 0) > merged.get("ts", 0))
+
+    # ---------- kompaksi ----------
+
+    def stats(self) -> Dict[str, Any]:
+        state = self.state
+        return {
+            "log": str(self.path),
+            "log_bytes": self._pos,
+            "entries": state.entries,
+            "live_entries": len(state.live),
+            "delta_docs": len(state.doc_rows),
+            "delta_chunks": len(state.rows),
+            "tombstoned_docs": len(state.tombstones),
+        }
+
+    def compact(self) -> Dict[str, Any]:
+        """Tulis ulang log hanya dengan entri yang berlaku (rename atomik)."""
+        if not self.path.exists():
+            return self.stats()
+        with self.path.open("a", encoding="utf-8") as lock_f:
+            fcntl.flock(lock_f, fcntl.LOCK_EX)
+            try:
+                self._refresh()
+                state = self.state
+                before = self._pos
+                tmp = self.dir / f".{LOG_NAME}.{os.getpid()}"
+                with tmp.open("w", encoding="utf-8") as f:
+                    for line in state.live.values():
+                        f.write(line + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, self.path)
+            finally:
+                fcntl.flock(lock_f, fcntl.LOCK_UN)
+        self._refresh()
+        print(f"[index_delta] compacted {self.path}: {before} -> {self._pos} bytes")
+        return self.stats()
+
+    def maybe_compact(self) -> Optional[Dict[str, Any]]:
+        state = self.snapshot()
+        if not state.entries:
+            return None
+        dead = 1 - len(state.live) / state.entries
+        if dead < INDEX_COMPACT_MIN_DEAD:
+            return None
+        return self.compact()
+
+
+def _compactor_leader(lock_path: Path):
+    """Lock file non-blocking; dipegang sampai proses mati, lalu worker lain mengambil alih."""
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    f = lock_path.open("a")
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.close()
+        return None
+    return f
+
+
+def start_compactor(deltas: Callable[[], List[DeltaIndex]], interval: float = INDEX_COMPACT_INTERVAL):
+    """Dipanggil setiap uvicorn worker; hanya pemegang COMPACTOR_LOCK yang mengompaksi."""
+    if interval <= 0:
+        return None
+
+    def _run():
+        leader = None
+        while True:
+            time.sleep(interval)
+            if leader is None:
+                leader = _compactor_leader(Path(INDEX_DELTA_DIR) / COMPACTOR_LOCK)
+                if leader is None:
+                    continue
+            for delta in deltas():
+                try:
+                    delta.maybe_compact()
+                except Exception as e:
+                    print(f"[index_delta] kompaksi gagal: {e}")
+
+    t = threading.Thread(target=_run, name="index-compactor", daemon=True)
+    t.start()
+    return t
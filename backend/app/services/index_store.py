@@ -0,0 +1,90 @@
+# app/services/index_store.py
+"""
+Membuka index FAISS secara memory-mapped + read-only.
+
+Dengan mmap, vektor index tidak disalin ke heap tiap proses: semua uvicorn
+worker berbagi page cache file index yang sama, sehingga jumlah worker tidak
+lagi mengalikan RAM untuk index.
+"""
+from __future__ import annotations
+
+import json
+import os
+from typing import Any, Dict, List
+
+import faiss
+
+# IO_FLAG_MMAP_IFC (faiss >= 1.9) me-mmap storage IndexFlatCodes/IVF/HNSW.
+# Versi lama hanya punya IO_FLAG_MMAP (khusus inverted list on-disk).
+_MMAP_FLAG = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+
+# nama -> info index yang terakhir dibuka (reload versi baru menimpa entri lama)
+_opened: Dict[str, Dict[str, Any]] = {}
+
+
+def open_index(path: str, name: str | None = None) -> faiss.Index:
+    path = str(path)
+    size_mb = os.path.getsize(path) / (1024 * 1024)
+    try:
+        index = faiss.read_index(path, _MMAP_FLAG | faiss.IO_FLAG_READ_ONLY)
+        mmapped = True
+    except RuntimeError as e:
+        print(f"[index_store] mmap tidak didukung untuk {path}, fallback ke read biasa: {e}")
+        index = faiss.read_index(path)
+        mmapped = False
+
+    name = name or os.path.basename(path)
+    _opened[name] = {
+        "name": name,
+        "path": path,
+        "ntotal": int(index.ntotal),
+        "size_mb": round(size_mb, 2),
+        "mmap": mmapped,
+    }
+    return index
+
+
+def apply_search_params(index: faiss.Index, index_dir: str) -> Dict[str, Any]:
+    """
+    Terapkan parameter query (nprobe untuk IVF, efSearch untuk HNSW) yang
+    disimpan builder di index_params.json. Index flat tidak punya parameter.
+    """
+    path = os.path.join(str(index_dir), "index_params.json")
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        params = json.load(f).get("search") or {}
+    ps = faiss.ParameterSpace()
+    for name, value in params.items():
+        ps.set_index_parameter(index, name, value)
+    return params
+
+
+def search_parameters(index: faiss.Index, selector, params: Dict[str, Any]):
+    """
+    SearchParameters per-query dengan ID selector. Parameter per-query
+    menggantikan setelan di index, jadi nprobe/efSearch ikut diisi ulang.
+    """
+    if faiss.try_extract_index_ivf(index) is not None:
+        sp = faiss.SearchParametersIVF(sel=selector)
+        if "nprobe" in params:
+            sp.nprobe = int(params["nprobe"])
+        return sp
+    # index dengan PCA (IndexPreTransform): parameter diteruskan ke index di dalamnya
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexPreTransform) else index
+    if hasattr(inner, "hnsw"):
+        sp = faiss.SearchParametersHNSW(sel=selector)
+        if "efSearch" in params:
+            sp.efSearch = int(params["efSearch"])
+        return sp
+    return faiss.SearchParameters(sel=selector)
+
+
+def report() -> List[Dict[str, Any]]:
+    return list(_opened.values())
+
+
+def print_report() -> None:
+    for r in _opened.values():
+        mode = "mmap" if r["mmap"] else "heap"
+        print(f"[index_store] {r['name']}: {r['ntotal']} vectors, {r['size_mb']} MB ({mode}) — {r['path']}")
@@ -0,0 +1,207 @@
+# app/services/index_versions.py
+"""
+Direktori index berversi + hot reload tanpa restart container.
+
+Layout (ditulis builder dengan --index-root / LAWYER_INDEX_ROOT):
+
+    <root>/CURRENT                  nama versi aktif (satu baris, ditulis atomik)
+    <root>/<versi>/manifest.json    model embedding, parameter chunk, jumlah row,
+                                    ukuran + sha256 setiap file
+    <root>/<versi>/index.faiss ...
+
+Direktori lama tanpa CURRENT tetap bisa dipakai langsung sebagai satu versi.
+
+VersionedIndex memegang satu bundle (index FAISS + metadata + index pendukung)
+yang sedang aktif. reload() memuat versi baru di thread pemanggil, memvalidasi
+manifest & isinya, menjalankan query pemanasan, menanyakan bundle baru apakah
+boleh menggantikan bundle aktif (check_replace, opsional), lalu menukar
+referensi. Request
+yang sedang berjalan sudah memegang bundle lama dan selesai di versi itu;
+bundle lama dibebaskan setelah referensi terakhirnya hilang.
+
+Reload dipicu lewat endpoint admin (per worker) atau watcher yang memantau
+CURRENT (INDEX_WATCH_INTERVAL detik) — watcher yang dipakai jika ada banyak
+uvicorn worker, karena setiap worker memantau sendiri.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+MANIFEST_NAME = "manifest.json"
+CURRENT_NAME = "CURRENT"
+MANIFEST_FORMAT = 1
+
+
+# ============================
+# Manifest
+# ============================
+
+def current_version(root: str | Path) -> Optional[str]:
+    p = Path(root) / CURRENT_NAME
+    if not p.exists():
+        return None
+    return p.read_text(encoding="utf-8").strip() or None
+
+
+def resolve(root: str | Path, version: Optional[str] = None) -> Tuple[Path, str]:
+    """(direktori versi, nama versi). Tanpa CURRENT, root dipakai apa adanya."""
+    root = Path(root)
+    version = version or current_version(root)
+    if version is None:
+        return root, read_manifest(root).get("version") or "legacy"
+    if "/" in version or version.startswith("."):
+        raise ValueError(f"Invalid index version {version!r}")
+    d = root / version
+    if not d.is_dir():
+        raise FileNotFoundError(f"Index version {version} not found in {root}")
+    return d, version
+
+
+def read_manifest(index_dir: str | Path) -> Dict[str, Any]:
+    p = Path(index_dir) / MANIFEST_NAME
+    if not p.exists():
+        return {}
+    manifest = json.loads(p.read_text(encoding="utf-8"))
+    if manifest.get("format") != MANIFEST_FORMAT:
+        raise RuntimeError(f"Unsupported manifest format {manifest.get('format')} in {index_dir}")
+    return manifest
+
+
+def _sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def verify_files(index_dir: str | Path, manifest: Dict[str, Any], checksums: bool = True) -> None:
+    """Cek setiap file di manifest: ada, ukuran sama, dan (opsional) sha256 sama."""
+    index_dir = Path(index_dir)
+    for rel, info in (manifest.get("files") or {}).items():
+        p = index_dir / rel
+        if not p.exists():
+            raise ValueError(f"{rel} listed in manifest but missing from {index_dir}")
+        if p.stat().st_size != info["size"]:
+            raise ValueError(f"{rel}: size {p.stat().st_size} != manifest {info['size']}")
+        if checksums and _sha256(p) != info["sha256"]:
+            raise ValueError(f"{rel}: sha256 mismatch")
+
+
+# ============================
+# Bundle aktif + reload
+# ============================
+
+class VersionedIndex:
+    """
+    `loader(index_dir, version, manifest)` membuat bundle baru dan raise jika
+    tidak valid; bundle boleh punya method warmup() yang dipanggil sebelum swap
+    dan check_replace(old) yang raise jika bundle aktif `old` tidak boleh diganti.
+    """
+
+    def __init__(self, name: str, root: str | Path, loader: Callable[[Path, str, Dict[str, Any]], Any]):
+        self.name = name
+        self.root = Path(root)
+        self._loader = loader
+        self._reload_lock = threading.Lock()
+        self.loaded_at = 0.0
+        self.last_error: Optional[str] = None
+        self._failed_version: Optional[str] = None
+        # saat startup: cek ukuran saja, pemanasan model lewat EMBED_WARMUP di lifespan
+        self.current = self._load(None, checksums=False, warm=False)
+        self.loaded_at = time.time()
+
+    def _load(self, version: Optional[str], checksums: bool, warm: bool = True):
+        index_dir, version = resolve(self.root, version)
+        manifest = read_manifest(index_dir)
+        verify_files(index_dir, manifest, checksums=checksums)
+        bundle = self._loader(index_dir, version, manifest)
+        warmup = getattr(bundle, "warmup", None)
+        if warm and warmup is not None:
+            warmup()
+        return bundle
+
+    @property
+    def version(self) -> str:
+        return self.current.version
+
+    def reload(self, version: Optional[str] = None) -> Dict[str, Any]:
+        """Muat `version` (default: isi CURRENT) lalu swap. Error -> versi lama tetap aktif."""
+        with self._reload_lock:
+            started = time.perf_counter()
+            old = self.current.version
+            try:
+                bundle = self._load(version, checksums=True)
+                check = getattr(bundle, "check_replace", None)
+                if check is not None:
+                    check(self.current)
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                self._failed_version = version or current_version(self.root)
+                print(f"[index_versions] {self.name}: reload gagal, tetap di {old}: {self.last_error}")
+                raise
+            self.current = bundle
+            self.loaded_at = time.time()
+            self.last_error = None
+            self._failed_version = None
+            took = time.perf_counter() - started
+            print(f"[index_versions] {self.name}: {old} -> {bundle.version} ({took:.1f}s)")
+            return {"name": self.name, "previous": old, "version": bundle.version, "load_s": round(took, 2)}
+
+    def poll(self) -> Optional[Dict[str, Any]]:
+        """Reload jika CURRENT menunjuk versi lain dari yang aktif."""
+        wanted = current_version(self.root)
+        if wanted in (None, self.current.version, self._failed_version) or self._reload_lock.locked():
+            return None
+        return self.reload(wanted)
+
+    def info(self) -> Dict[str, Any]:
+        stats = getattr(self.current, "stats", None)
+        return {
+            **(stats() if stats is not None else {}),
+            "name": self.name,
+            "root": str(self.root),
+            "version": self.current.version,
+            "current_file": current_version(self.root),
+            "loaded_at": self.loaded_at,
+            "last_error": self.last_error,
+        }
+
+
+_registry: Dict[str, VersionedIndex] = {}
+
+
+def register(handle: VersionedIndex) -> VersionedIndex:
+    _registry[handle.name] = handle
+    return handle
+
+
+def get(name: str) -> VersionedIndex:
+    return _registry[name]
+
+
+def all_indexes() -> List[VersionedIndex]:
+    return list(_registry.values())
+
+
+def start_watcher(interval: float) -> Optional[threading.Thread]:
+    if interval <= 0:
+        return None
+
+    def _run():
+        while True:
+            time.sleep(interval)
+            for handle in all_indexes():
+                try:
+                    handle.poll()
+                except Exception:
+                    pass  # sudah dicatat di last_error; versi yang gagal tidak dicoba ulang
+
+    t = threading.Thread(target=_run, name="index-watcher", daemon=True)
+    t.start()
+    return t
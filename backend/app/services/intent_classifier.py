@@ -0,0 +1,164 @@
+# app/services/intent_classifier.py
+"""
+Classifier intent lokal berbasis embedding (nearest centroid).
+
+Router di pidana_graph_agent sebelumnya selalu memanggil vLLM untuk pesan yang
+tidak kena keyword pengacara. Modul ini memakai embedding MiniLM yang sama
+dengan retrieval (model_registry.encode_query, di-cache per teks) sehingga
+vektor pertanyaan dihitung sekali untuk routing dan retrieval.
+
+- Contoh berlabel dibaca dari INTENT_EXAMPLES (jsonl: {"text", "label"}),
+  di-encode sekali saat pertama dipakai, lalu dirata-rata per label menjadi
+  centroid ter-normalisasi.
+- Label diterima jika similarity centroid terbaik >= INTENT_MIN_SIMILARITY dan
+  selisihnya dengan label kedua >= INTENT_MIN_MARGIN. Di bawah itu classify()
+  mengembalikan None dan router memakai LLM seperti sebelumnya.
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.services import model_registry
+
+# Model yang sama dengan retrieval (rag_engine.EMBED_MODEL), dibaca langsung dari
+# env supaya import modul ini tidak ikut me-load index FAISS rag_engine.
+EMBED_MODEL = os.getenv("EMBED_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+
+INTENT_LABELS = ("PIDANA_QA", "LAWYER_REC", "SAPA", "NON_PIDANA")
+
+INTENT_LOCAL = os.getenv("INTENT_LOCAL", "1") == "1"
+INTENT_EXAMPLES = os.getenv(
+    "INTENT_EXAMPLES",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "db", "intent_examples.jsonl"),
+)
+INTENT_MIN_SIMILARITY = float(os.getenv("INTENT_MIN_SIMILARITY", "0.35"))
+INTENT_MIN_MARGIN = float(os.getenv("INTENT_MIN_MARGIN", "0.05"))
+
+_labels: List[str] = []
+_centroids: Optional[np.ndarray] = None
+_load_lock = threading.Lock()
+_loaded = False
+
+_stats_lock = threading.Lock()
+_stats = {"local": 0, "fallback": 0, "local_ms": 0.0}
+
+
+def load_examples(path: str = INTENT_EXAMPLES) -> List[Tuple[str, str]]:
+    examples = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            rec = json.loads(line)
+            if rec.get("label") in INTENT_LABELS and rec.get("text"):
+                examples.append((rec["text"], rec["label"]))
+    return examples
+
+
+def _ensure_loaded() -> Optional[np.ndarray]:
+    global _centroids, _labels, _loaded
+    if _loaded:
+        return _centroids
+    with _load_lock:
+        if _loaded:
+            return _centroids
+        try:
+            examples = load_examples()
+        except FileNotFoundError:
+            print(f"[intent_classifier] {INTENT_EXAMPLES} tidak ada, routing lokal nonaktif")
+            examples = []
+        by_label: Dict[str, List[str]] = {}
+        for text, label in examples:
+            by_label.setdefault(label, []).append(text)
+        if len(by_label) >= 2:
+            started = time.perf_counter()
+            model = model_registry.get_model(EMBED_MODEL)
+            labels, rows = [], []
+            for label in INTENT_LABELS:
+                texts = by_label.get(label)
+                if not texts:
+                    continue
+                emb = np.asarray(model.encode(texts, normalize_embeddings=True), dtype="float32")
+                centroid = emb.mean(axis=0)
+                centroid /= max(float(np.linalg.norm(centroid)), 1e-12)
+                labels.append(label)
+                rows.append(centroid)
+            _labels, _centroids = labels, np.stack(rows).astype("float32")
+            print(
+                f"[intent_classifier] {len(examples)} contoh, {len(labels)} label "
+                f"({time.perf_counter() - started:.1f}s)"
+            )
+        _loaded = True
+    return _centroids
+
+
+def warmup() -> None:
+    """Encode contoh berlabel saat startup supaya request pertama tidak menanggungnya."""
+    if INTENT_LOCAL:
+        _ensure_loaded()
+
+
+def scores(question: str) -> Dict[str, float]:
+    """Cosine similarity pertanyaan ke centroid setiap label ({} jika classifier nonaktif)."""
+    if not INTENT_LOCAL:
+        return {}
+    centroids = _ensure_loaded()
+    if centroids is None:
+        return {}
+    qv = model_registry.encode_query(EMBED_MODEL, question)
+    sims = (centroids @ np.asarray(qv, dtype="float32").reshape(-1)).tolist()
+    return dict(zip(_labels, sims))
+
+
+def classify(question: str) -> Tuple[Optional[str], Dict[str, Any]]:
+    """
+    (label, info) jika classifier lokal cukup yakin, (None, info) jika tidak
+    sehingga pemanggil harus memakai LLM. `info` berisi skor per label.
+    """
+    started = time.perf_counter()
+    by_label = scores(question)
+    if not by_label:
+        return None, {}
+
+    labels, sims = list(by_label), list(by_label.values())
+    order = sorted(range(len(sims)), key=lambda i: sims[i], reverse=True)
+    best = sims[order[0]]
+    margin = best - sims[order[1]] if len(order) > 1 else best
+    confident = best >= INTENT_MIN_SIMILARITY and margin >= INTENT_MIN_MARGIN
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    info = {
+        "scores": {label: round(s, 4) for label, s in by_label.items()},
+        "margin": round(margin, 4),
+        "ms": round(elapsed_ms, 2),
+    }
+    with _stats_lock:
+        if confident:
+            _stats["local"] += 1
+            _stats["local_ms"] += elapsed_ms
+        else:
+            _stats["fallback"] += 1
+    return (labels[order[0]] if confident else None), info
+
+
+def stats() -> Dict[str, Any]:
+    with _stats_lock:
+        local, fallback = _stats["local"], _stats["fallback"]
+        total = local + fallback
+        return {
+            "enabled": INTENT_LOCAL,
+            "labels": list(_labels),
+            "local": local,
+            "llm_fallback": fallback,
+            "local_rate": round(local / total, 4) if total else None,
+            "avg_local_ms": round(_stats["local_ms"] / local, 2) if local else None,
+            "min_similarity": INTENT_MIN_SIMILARITY,
+            "min_margin": INTENT_MIN_MARGIN,
+        }
@@ -1,16 +1,16 @@
 # app/services/lawyer_rec.py
 
 import os
-import json
 from math import radians, sin, cos, sqrt, atan2
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import Dict, Any, Optional
 
-import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
 import requests
 
+from app.services import index_versions, model_registry
+from app.services.index_store import open_index
+from app.services.meta_store import has_meta, open_meta_store
 
 # ============================
 # Nominatim Geocode (lokasi user)
@@ -23,7 +23,7 @@ HEADERS = {
 }
 
 
-def geocode_user_location(address: str) -> Optional[Dict[str, Any]]:
+def geocode_user_location(address: str, timeout: float = 10) -> Optional[Dict[str, Any]]:
     """
     Geocode lokasi user menggunakan Nominatim (free-form address).
     Mengembalikan dict {lat, lon, display_name} atau None jika gagal.
@@ -43,7 +43,7 @@ def geocode_user_location(address: str) -> Optional[Dict[str, Any]]:
             f"{NOMINATIM_BASE}/search",
             params=params,
             headers=HEADERS,
-            timeout=10,
+            timeout=timeout,
         )
         resp.raise_for_status()
         data = resp.json()
@@ -67,13 +67,14 @@ def geocode_user_location(address: str) -> Optional[Dict[str, Any]]:
 
 BASE_DIR = Path(__file__).resolve().parent
 
-# Bisa di-override dari ENV, default ke /app/app/db/lawyers (mount di docker-compose)
+# Bisa di-override dari ENV, default ke /app/app/db/lawyers (mount di docker-compose).
+# Boleh berupa root berversi dengan file CURRENT (lihat app/services/index_versions.py)
 LAWYER_INDEX_DIR = Path(
     os.getenv("LAWYER_INDEX_DIR", "/app/app/db/lawyers")
 )
 
-LAWYER_INDEX_PATH = LAWYER_INDEX_DIR / "index_lawyers.faiss"
-LAWYER_META_PATH = LAWYER_INDEX_DIR / "lawyers_meta.jsonl"
+LAWYER_INDEX_NAME = "index_lawyers.faiss"
+LAWYER_META_JSONL = "lawyers_meta.jsonl"
 
 EMBED_MODEL = os.getenv(
     "LAWYER_EMBED_MODEL",
@@ -88,31 +89,49 @@ ALPHA_SEMANTIC = float(os.getenv("LAWYER_ALPHA_SEMANTIC", "0.6"))
 # LOAD INDEX & METADATA
 # ============================
 
-if not LAWYER_INDEX_PATH.exists():
-    raise RuntimeError(f"Lawyer index not found: {LAWYER_INDEX_PATH}")
+# Kolom yang dibaca untuk hasil rekomendasi
+LAWYER_FIELDS = ("name", "alamat_kantor", "alamat", "specialitas", "spesialisasi")
 
-if not LAWYER_META_PATH.exists():
-    raise RuntimeError(f"Lawyer metadata not found: {LAWYER_META_PATH}")
 
-_index = faiss.read_index(str(LAWYER_INDEX_PATH))
-_encoder = SentenceTransformer(EMBED_MODEL)
+class LawyerIndex:
+    """Satu versi index pengacara: FAISS + metadata + lat/lon."""
 
-_lawyers: List[Dict[str, Any]] = []
-with LAWYER_META_PATH.open("r", encoding="utf-8") as f:
-    for line in f:
-        _lawyers.append(json.loads(line))
+    def __init__(self, index_dir: Path, version: str, manifest: Dict[str, Any]):
+        self.dir = index_dir
+        self.version = version
+        self.manifest = manifest
+        embed_model = manifest.get("embed_model")
+        if embed_model and embed_model != EMBED_MODEL:
+            raise ValueError(f"lawyer index {version} built with {embed_model}, server uses {EMBED_MODEL}")
+
+        index_path = index_dir / LAWYER_INDEX_NAME
+        if not index_path.exists():
+            raise RuntimeError(f"Lawyer index not found: {index_path}")
+        if not has_meta(index_dir, LAWYER_META_JSONL):
+            raise RuntimeError(f"Lawyer metadata not found in: {index_dir}")
+
+        self.index = open_index(index_path, name="lawyers")
+        self.lawyers = open_meta_store(index_dir, LAWYER_META_JSONL)
+        if self.index.ntotal != len(self.lawyers):
+            raise ValueError(f"lawyer index {version}: {self.index.ntotal} vectors vs {len(self.lawyers)} rows")
+
+        # Ambil lat/lon pengacara (dtype=object karena bisa None)
+        latlon = []
+        for lat, lon in zip(self.lawyers.column("latitude"), self.lawyers.column("longitude")):
+            if lat is None or lon is None:
+                latlon.append((None, None))
+            else:
+                latlon.append((float(lat), float(lon)))
+        self.latlon = np.array(latlon, dtype=object)
+
+    def warmup(self):
+        q = embed_case("advokat pidana")
+        if q.shape[1] != self.index.d:
+            raise ValueError(f"lawyer index {self.version}: dim {self.index.d} != encoder dim {q.shape[1]}")
+        self.index.search(q, 1)
 
-# Ambil lat/lon pengacara (dtype=object karena bisa None)
-_lawyer_latlon = []
-for rec in _lawyers:
-    lat = rec.get("latitude")
-    lon = rec.get("longitude")
-    if lat is None or lon is None:
-        _lawyer_latlon.append((None, None))
-    else:
-        _lawyer_latlon.append((float(lat), float(lon)))
 
-_lawyer_latlon = np.array(_lawyer_latlon, dtype=object)
+store = index_versions.register(index_versions.VersionedIndex("lawyers", LAWYER_INDEX_DIR, LawyerIndex))
 
 
 # ============================
@@ -132,14 +151,13 @@ def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
 
 
 def embed_case(text: str) -> np.ndarray:
-    emb = _encoder.encode([text], convert_to_numpy=True)
-    faiss.normalize_L2(emb)
-    return emb.astype("float32")
+    # sudah ter-normalisasi L2 oleh BatchingEncoder
+    return model_registry.encode_query(EMBED_MODEL, text)
 
 
-def _semantic_search(query: str, top_k: int = 50):
+def _semantic_search(state: LawyerIndex, query: str, top_k: int = 50):
     q = embed_case(query)
-    D, I = _index.search(q, top_k)
+    D, I = state.index.search(q, top_k)
     return I[0], D[0]
 
 
@@ -152,24 +170,30 @@ def recommend_lawyers(
     case_description: str,
     top_k: int = 3,
     search_pool_k: int = 50,
+    geocode_timeout: float = 10,
 ) -> Any:
     """
     Rekomendasi pengacara (versi core):
     - geocode lokasi user (Nominatim)
     - semantic search kasus vs spesialisasi pengacara
     - gabungkan skor semantik + jarak (Haversine)
+
+    geocode_timeout <= 0 (sisa deadline request tidak cukup): geocoding
+    dilewati dan peringkat hanya berdasarkan skor semantik.
     """
 
     # 1) Geocode lokasi user
-    geo = geocode_user_location(user_location)
-    if not geo:
-        return {"error": "Failed to geocode user location"}
-
-    user_lat = geo["lat"]
-    user_lon = geo["lon"]
+    if geocode_timeout > 0:
+        geo = geocode_user_location(user_location, timeout=geocode_timeout)
+        if not geo:
+            return {"error": "Failed to geocode user location"}
+        user_lat, user_lon = geo["lat"], geo["lon"]
+    else:
+        user_lat = user_lon = None
 
-    # 2) Semantic ranking
-    idxs, sims = _semantic_search(case_description, top_k=search_pool_k)
+    # 2) Semantic ranking (satu snapshot versi index untuk seluruh request)
+    state = store.current
+    idxs, sims = _semantic_search(state, case_description, top_k=search_pool_k)
 
     # 3) Combine semantic + distance
     results = []
@@ -177,23 +201,26 @@ def recommend_lawyers(
         if idx < 0:
             continue
 
-        rec = _lawyers[idx]
-        lawyer_lat, lawyer_lon = _lawyer_latlon[idx]
+        rec = state.lawyers.get(int(idx), LAWYER_FIELDS)
+        lawyer_lat, lawyer_lon = state.latlon[idx]
 
         # convert inner-product [-1,1] → [0,1]
         semantic_score = (float(sim) + 1) / 2
 
-        if lawyer_lat is None or lawyer_lon is None:
+        if user_lat is None or lawyer_lat is None or lawyer_lon is None:
             distance_km = None
             distance_score = 0.0
         else:
             distance_km = haversine_km(user_lat, user_lon, lawyer_lat, lawyer_lon)
             distance_score = 1 / (1 + distance_km)
 
-        final_score = (
-            ALPHA_SEMANTIC * semantic_score +
-            (1 - ALPHA_SEMANTIC) * distance_score
-        )
+        if user_lat is None:
+            final_score = semantic_score
+        else:
+            final_score = (
+                ALPHA_SEMANTIC * semantic_score +
+                (1 - ALPHA_SEMANTIC) * distance_score
+            )
 
         results.append({
             "name": rec.get("name"),
@@ -244,6 +271,7 @@ def recommend_lawyers_for_user(
     case_description: str,
     top_k: int = 3,
     search_pool_k: int = 50,
+    geocode_timeout: float = 10,
 ) -> Any:
     """
     Wrapper utama yang dipakai oleh agent / endpoint:
@@ -261,6 +289,7 @@ def recommend_lawyers_for_user(
         case_description=case_description,
         top_k=top_k,
         search_pool_k=search_pool_k,
+        geocode_timeout=geocode_timeout,
     )
 
 
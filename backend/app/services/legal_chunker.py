@@ -0,0 +1,206 @@
+# app/services/legal_chunker.py
+"""
+Chunking dokumen hukum: satu-satunya implementasi, dipakai oleh full rebuild
+(rag_dev/build_faiss_index.py) dan ingest online (app/services/index_delta.py)
+sehingga chunk yang masuk lewat API identik dengan hasil rebuild.
+
+Split per "Pasal N", window kata dengan overlap atau chunk sepanjang batas
+token encoder, penanda pasal per chunk. Parameter chunking = blok "chunking"
+manifest versi index; index lama tanpa "chunker" memakai window kata 450/80.
+
+Hanya memakai stdlib (tokenizer diberikan pemanggil) supaya builder bisa
+meng-import modul ini tanpa dependensi backend.
+"""
+from __future__ import annotations
+
+import bisect
+import hashlib
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+CHUNK_MAX_WORDS = 450
+CHUNK_OVERLAP_WORDS = 80
+
+# Kolom metadata dokumen yang disalin ke setiap chunk (sama dengan META_COLUMNS builder)
+DOC_FIELDS = ("title", "url", "doc_type", "number", "year", "level", "case_number",
+              "decision_date", "court", "subject", "source")
+
+# Kata sebelum "Pasal N" yang menandakan rujukan, bukan judul pasal baru
+PASAL_REF_WORDS = {"dalam", "dimaksud", "bagi", "berdasarkan", "menurut", "pada", "oleh",
+                   "dan", "atau", "jo", "jo.", "pasal-", "penjatuhan", "ketentuan", "menyerahkan"}
+
+
+def clean_text(s: str) -> str:
+    return re.sub(r"\s+", " ", s.replace("\x00", " ")).strip()
+
+
+def chunk_text(text: str, max_words: int = CHUNK_MAX_WORDS, overlap: int = CHUNK_OVERLAP_WORDS) -> List[str]:
+    words = text.split()
+    if not words:
+        return []
+    step = max_words - overlap
+    chunks = []
+    for i in range(0, len(words), step):
+        chunk = words[i:i + max_words]
+        if len(chunk) < 50:
+            break
+        chunks.append(" ".join(chunk))
+    return chunks
+
+
+def split_legal_blocks(text: str) -> List[str]:
+    # Prefer split by "Pasal" for UU/PP/Perma etc.
+    parts = re.split(r"(?=Pasal\s+\d+[A-Za-z]?)", text, flags=re.I)
+    return parts if len(parts) > 1 else [text]
+
+
+def pasal_heading(block: str, prev_block: str) -> Optional[str]:
+    """Nomor pasal jika block diawali judul "Pasal N" (bukan rujukan ke pasal lain)."""
+    m = re.match(r"Pasal\s+(\d+)([A-Za-z]?)\b\s*(\S*)", block)
+    if not m:
+        return None
+    num, suffix, nxt = m.group(1), m.group(2), m.group(3).lower()
+    if suffix == "O":  # OCR: "1O" -> "10"
+        num, suffix = num + "0", ""
+    elif not suffix.islower():
+        suffix = ""
+    if nxt.startswith((",", "ayat", "huruf", "dan", "jo", "s.d", "sampai", "-")):
+        return None
+    if nxt in ("bis", "ter", "quater"):  # "Pasal 187 bis" adalah pasal tersendiri
+        suffix += nxt
+    if nxt in ("(1)", "(l)"):  # "Pasal N (1) ..." hampir selalu judul pasal
+        return num + suffix
+    prev_words = prev_block.split()
+    if prev_words and prev_words[-1].lower() in PASAL_REF_WORDS:
+        return None
+    return num + suffix
+
+
+def pasal_sections(text: str) -> List[Tuple[str, str]]:
+    """[(pasal, teks)] per judul pasal; block rujukan ("... dalam Pasal 5") digabung ke block sebelumnya."""
+    sections: List[List[str]] = []
+    prev = ""
+    for b in split_legal_blocks(text):
+        head = pasal_heading(b, prev)
+        prev = b
+        if head or not sections:
+            sections.append([head or "", b])
+        else:
+            sections[-1][1] += b
+    return [(pasal, b.strip()) for pasal, b in sections if b.strip()]
+
+
+def word_windows(text: str, max_words: int = CHUNK_MAX_WORDS) -> List[str]:
+    """Window <= max_words kata berukuran rata, tanpa overlap dan tanpa membuang sisa."""
+    words = text.split()
+    n = -(-len(words) // max_words)
+    size = -(-len(words) // n) if n else 0
+    return [" ".join(words[i:i + size]) for i in range(0, len(words), size)] if size else []
+
+
+# Batas chunk token, urut prioritas: awal ayat "(n)", akhir kalimat, spasi
+AYAT_START = re.compile(r"(?<!ayat )\((?:\d+|l)\)")
+SENTENCE_END = re.compile(r"[.;:](?=\s)")
+
+
+def _last_between(points: List[int], lo: int, hi: int) -> Optional[int]:
+    i = bisect.bisect_right(points, hi)
+    return points[i - 1] if i and points[i - 1] >= lo else None
+
+
+def chunk_tokens(text: str, tokenizer, max_tokens: int, overlap: int = 0) -> List[str]:
+    """
+    Potong `text` menjadi chunk <= max_tokens token tokenizer encoder (tanpa token
+    spesial). Potongan dipilih di awal ayat, lalu akhir kalimat, lalu spasi
+    terakhir sebelum batas; chunk berikutnya mulai `overlap` token lebih awal
+    (di awal kata).
+    """
+    offsets = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+    if len(offsets) <= max_tokens:
+        return [text]
+    starts = [o[0] for o in offsets]
+    ayats = [m.start() for m in AYAT_START.finditer(text)]
+    sentences = [m.end() for m in SENTENCE_END.finditer(text)]
+    spaces = [m.start() for m in re.finditer(r"\s", text)]
+    chunks, tok = [], 0
+    while tok < len(offsets):
+        start = starts[tok]
+        if tok + max_tokens >= len(offsets):
+            chunks.append(text[start:].strip())
+            break
+        limit = starts[tok + max_tokens]
+        # potongan di ayat/kalimat hanya jika chunk minimal setengah penuh
+        half = starts[tok + max_tokens // 2]
+        cut = (_last_between(ayats, half, limit) or _last_between(sentences, half, limit)
+               or _last_between(spaces, start + 1, limit) or limit)
+        chunks.append(text[start:cut].strip())
+        nxt = bisect.bisect_left(starts, cut)
+        back = max(nxt - overlap, tok + 1)
+        while back < nxt and back > 0 and not text[starts[back] - 1].isspace():
+            back += 1
+        tok = back
+    return [c for c in chunks if c]
+
+
+def chunk_ayats(text: str) -> List[str]:
+    """Nomor ayat "(n)" di chunk, kecuali rujukan "ayat (n)". OCR "(l)" dibaca (1)."""
+    out = []
+    for m in re.finditer(r"(?<!ayat )\((\d+|l)\)", text):
+        n = "1" if m.group(1) == "l" else m.group(1)
+        if n not in out:
+            out.append(n)
+    return out
+
+
+def document_id(doc: Dict[str, Any]) -> str:
+    """`id` dokumen, atau hash judul+url+awal teks jika tidak ada."""
+    text = clean_text(str(doc.get("text") or doc.get("content") or ""))
+    return doc.get("id") or hashlib.sha1(
+        (doc.get("title", "") + doc.get("url", "") + text[:200]).encode()
+    ).hexdigest()
+
+
+def to_records(doc: Dict[str, Any], chunking: Optional[Dict[str, Any]] = None,
+               tokenizer=None) -> List[Dict[str, Any]]:
+    """
+    Dokumen (skema UU_docs.jsonl) -> record per chunk dengan kolom metadata index.
+    `chunking` = blok "chunking" manifest. Chunker token butuh `tokenizer`
+    (tokenizer HF milik encoder chunking["tokenizer"]); chunk dari window yang
+    terpotong membawa "parent_text" (window utuh untuk konteks LLM).
+    """
+    chunking = chunking or {}
+    text = clean_text(str(doc.get("text") or doc.get("content") or ""))
+    if not text:
+        return []
+    base_meta = {f: doc.get(f, "") for f in DOC_FIELDS}
+    base_id = document_id(doc)
+    max_words = int(chunking.get("max_tokens") or CHUNK_MAX_WORDS)
+
+    chunks: List[Tuple[str, str, Optional[str]]] = []
+    if chunking.get("no_chunk"):
+        chunks.append((text, "", None))
+    elif chunking.get("chunker") == "tokens":
+        if tokenizer is None:
+            raise ValueError(f"chunker token butuh tokenizer {chunking.get('tokenizer')}")
+        for pasal, section in pasal_sections(text):
+            for parent in word_windows(section, max_words):
+                children = chunk_tokens(parent, tokenizer, int(chunking["chunk_tokens"]),
+                                        int(chunking.get("overlap_tokens") or 0))
+                parent_text = parent if chunking.get("parents") and len(children) > 1 else None
+                chunks.extend((ch, pasal, parent_text) for ch in children)
+    else:
+        # legal-aware split; pasal berjalan dibawa ke block lanjutan/rujukan
+        overlap = int(chunking.get("overlap") if chunking.get("overlap") is not None else CHUNK_OVERLAP_WORDS)
+        pasal, prev = "", ""
+        for b in split_legal_blocks(text):
+            pasal = pasal_heading(b, prev) or pasal
+            prev = b
+            chunks.extend((ch, pasal, None) for ch in chunk_text(b, max_words, overlap))
+
+    records = []
+    for i, (ch, pasal, parent_text) in enumerate(chunks, 1):
+        rec = {"id": base_id, "chunk_id": f"{i:04d}", "text": ch, "pasal": pasal, **base_meta}
+        if parent_text is not None:
+            rec["parent_text"] = parent_text
+        records.append(rec)
+    return records
@@ -0,0 +1,204 @@
+# app/services/llm_client.py
+"""
+Client bersama untuk API OpenAI-compatible vLLM (/v1/chat/completions).
+
+Semua pemanggilan LLM (router intent, jawaban RAG, streaming) lewat modul ini:
+- satu httpx.AsyncClient dengan keep-alive pool (tidak buka koneksi TCP baru per call)
+- batas jumlah request in-flight (LLM_MAX_CONCURRENCY)
+- retry dengan jitter untuk error koneksi & 5xx
+- deadline per call (mencakup antre semaphore + semua percobaan retry)
+
+Client dan semaphore hidup di satu event loop latar belakang, sehingga bisa
+dipakai dari kode sync (thread pool FastAPI / LangGraph) maupun async.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import random
+import threading
+from typing import Any, AsyncIterator, Dict, Optional
+
+import httpx
+
+VLLM_BASE = os.getenv("VLLM_BASE")
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+LLM_DEFAULT_TIMEOUT = float(os.getenv("LLM_DEFAULT_TIMEOUT", "300"))
+
+RETRY_STATUS = {500, 502, 503, 504}
+CHAT_PATH = "/v1/chat/completions"
+
+
+class LLMDeadlineExceeded(TimeoutError):
+    pass
+
+
+# ============================
+# Event loop latar belakang
+# ============================
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_client: Optional[httpx.AsyncClient] = None
+_semaphore: Optional[asyncio.Semaphore] = None
+_lock = threading.Lock()
+
+
+def _ensure_loop() -> asyncio.AbstractEventLoop:
+    global _loop, _client, _semaphore
+    if _loop is not None:
+        return _loop
+    with _lock:
+        if _loop is not None:
+            return _loop
+        loop = asyncio.new_event_loop()
+        threading.Thread(target=loop.run_forever, name="llm-client", daemon=True).start()
+
+        async def _init():
+            client = httpx.AsyncClient(
+                base_url=VLLM_BASE or "",
+                timeout=httpx.Timeout(LLM_DEFAULT_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=LLM_MAX_CONCURRENCY,
+                    max_keepalive_connections=LLM_MAX_CONCURRENCY,
+                    keepalive_expiry=30.0,
+                ),
+            )
+            return client, asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+
+        _client, _semaphore = asyncio.run_coroutine_threadsafe(_init(), loop).result()
+        _loop = loop
+        return _loop
+
+
+def _backoff(attempt: int) -> float:
+    # "full jitter": acak di [0, base * 2^attempt]
+    return random.uniform(0, LLM_BACKOFF_BASE * (2 ** attempt))
+
+
+def _retryable(exc: Exception) -> bool:
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in RETRY_STATUS
+    # Hanya error yang terjadi sebelum vLLM mulai memproses request;
+    # ReadTimeout pada generasi panjang tidak di-retry.
+    return isinstance(exc, (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError))
+
+
+def _remaining(deadline: float) -> float:
+    left = deadline - asyncio.get_running_loop().time()
+    if left <= 0:
+        raise LLMDeadlineExceeded("LLM call deadline exceeded")
+    return left
+
+
+# ============================
+# Implementasi (berjalan di loop latar belakang)
+# ============================
+
+async def _post(payload: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+    deadline = asyncio.get_running_loop().time() + timeout
+    attempt = 0
+    while True:
+        try:
+            async with asyncio.timeout(_remaining(deadline)):
+                async with _semaphore:
+                    r = await _client.post(CHAT_PATH, json=payload)
+                    r.raise_for_status()
+                    return r.json()
+        except TimeoutError:
+            raise LLMDeadlineExceeded("LLM call deadline exceeded")
+        except Exception as e:
+            if attempt >= LLM_MAX_RETRIES or not _retryable(e):
+                raise
+        await asyncio.sleep(min(_backoff(attempt), _remaining(deadline)))
+        attempt += 1
+
+
+async def _stream(payload: Dict[str, Any], timeout: float, emit) -> None:
+    """Kirim setiap delta teks ke `emit`; retry hanya sebelum token pertama."""
+    deadline = asyncio.get_running_loop().time() + timeout
+    attempt = 0
+    while True:
+        started = False
+        try:
+            async with asyncio.timeout(_remaining(deadline)):
+                async with _semaphore:
+                    async with _client.stream("POST", CHAT_PATH, json={**payload, "stream": True}) as r:
+                        r.raise_for_status()
+                        async for line in r.aiter_lines():
+                            if not line.startswith("data:"):
+                                continue
+                            data = line[len("data:"):].strip()
+                            if data == "[DONE]":
+                                return
+                            choices = json.loads(data).get("choices") or []
+                            if not choices:
+                                continue
+                            delta = choices[0].get("delta", {}).get("content")
+                            if delta:
+                                started = True
+                                emit(delta)
+                    return
+        except TimeoutError:
+            raise LLMDeadlineExceeded("LLM stream deadline exceeded")
+        except Exception as e:
+            if started or attempt >= LLM_MAX_RETRIES or not _retryable(e):
+                raise
+        await asyncio.sleep(min(_backoff(attempt), _remaining(deadline)))
+        attempt += 1
+
+
+# ============================
+# API publik
+# ============================
+
+def chat_completion(payload: Dict[str, Any], timeout: float = LLM_DEFAULT_TIMEOUT) -> Dict[str, Any]:
+    """Versi sync: blok sampai respons JSON lengkap diterima."""
+    loop = _ensure_loop()
+    return asyncio.run_coroutine_threadsafe(_post(payload, timeout), loop).result()
+
+
+async def achat_completion(payload: Dict[str, Any], timeout: float = LLM_DEFAULT_TIMEOUT) -> Dict[str, Any]:
+    loop = _ensure_loop()
+    fut = asyncio.run_coroutine_threadsafe(_post(payload, timeout), loop)
+    try:
+        return await asyncio.wrap_future(fut)
+    except asyncio.CancelledError:
+        fut.cancel()
+        raise
+
+
+async def astream_chat_completion(
+    payload: Dict[str, Any], timeout: float = LLM_DEFAULT_TIMEOUT
+) -> AsyncIterator[str]:
+    """Yield potongan teks (delta) dari vLLM dengan stream=True."""
+    loop = _ensure_loop()
+    caller = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    done = object()
+
+    def emit(item):
+        try:
+            caller.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:
+            pass  # loop pemanggil sudah ditutup (client disconnect)
+
+    fut = asyncio.run_coroutine_threadsafe(_stream(payload, timeout, emit), loop)
+    fut.add_done_callback(lambda f: emit(done))
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            yield item
+        fut.result()  # propagasikan error dari vLLM (jika ada)
+    finally:
+        if not fut.done():
+            fut.cancel()
+
+
+def message_content(resp: Dict[str, Any]) -> str:
+    return resp["choices"][0]["message"]["content"]
@@ -0,0 +1,123 @@
+# app/services/meta_store.py
+"""
+Metadata chunk/pengacara yang dibaca secara lazy per row id.
+
+Format kolom (ditulis oleh rag_dev/build_faiss_index.py dan
+haversine_dev/build_lawyer_index.py) berada di subfolder `meta/`:
+
+    meta/columns.json   {"format": 1, "rows": N, "columns": [...]}
+    meta/<kolom>.off    offset uint64 little-endian, N+1 entri
+    meta/<kolom>.heap   nilai tiap baris (JSON, UTF-8) disambung tanpa pemisah
+
+Nilai baris i kolom c = json.loads(heap[off[i]:off[i+1]]). Kedua file di-mmap,
+jadi hanya sel yang benar-benar dibaca (mis. text/title/doc_type/url untuk k
+hasil search) yang menjadi objek Python.
+
+Kalau index lama belum punya `meta/`, dipakai fallback JsonlMetaStore yang
+memuat seluruh metadata.jsonl ke memori seperti sebelumnya.
+"""
+from __future__ import annotations
+
+import json
+import mmap
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+META_SUBDIR = "meta"
+# Teks window parent (chunker token builder); kolom meta "parent" = row di sini
+PARENTS_SUBDIR = "parents"
+META_FORMAT = 1
+
+
+class ColumnarMetaStore:
+    def __init__(self, meta_dir: str | Path):
+        self.dir = Path(meta_dir)
+        spec = json.loads((self.dir / "columns.json").read_text(encoding="utf-8"))
+        if spec.get("format") != META_FORMAT:
+            raise RuntimeError(f"Unsupported metadata format {spec.get('format')} in {self.dir}")
+        self.columns: List[str] = list(spec["columns"])
+        self._rows = int(spec["rows"])
+        self._cols: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._rows
+
+    def _column(self, name: str):
+        col = self._cols.get(name)
+        if col is not None:
+            return col
+        with self._lock:
+            col = self._cols.get(name)
+            if col is None:
+                off = np.memmap(self.dir / f"{name}.off", dtype="<u8", mode="r")
+                heap_path = self.dir / f"{name}.heap"
+                if heap_path.stat().st_size:
+                    with heap_path.open("rb") as f:
+                        heap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                else:
+                    heap = b""
+                col = (off, heap)
+                self._cols[name] = col
+        return col
+
+    def value(self, i: int, name: str) -> Any:
+        if name not in self.columns:
+            return None
+        off, heap = self._column(name)
+        return json.loads(heap[int(off[i]):int(off[i + 1])])
+
+    def get(self, i: int, fields: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+        return {name: self.value(i, name) for name in (fields or self.columns)}
+
+    def column(self, name: str) -> List[Any]:
+        """Seluruh nilai satu kolom (untuk data kecil/agregat, bukan hot path)."""
+        return [self.value(i, name) for i in range(self._rows)]
+
+
+class JsonlMetaStore:
+    """Fallback untuk index lama: satu dict per baris, dimuat penuh di memori."""
+
+    def __init__(self, path: str | Path):
+        with open(path, "r", encoding="utf-8") as f:
+            self._rows = [json.loads(line) for line in f if line.strip()]
+        self.columns = list(dict.fromkeys(k for r in self._rows for k in r))
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def value(self, i: int, name: str) -> Any:
+        return self._rows[i].get(name)
+
+    def get(self, i: int, fields: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+        rec = self._rows[i]
+        if fields is None:
+            return dict(rec)
+        return {name: rec.get(name) for name in fields}
+
+    def column(self, name: str) -> List[Any]:
+        return [r.get(name) for r in self._rows]
+
+
+def has_meta(index_dir: str | Path, jsonl_name: str) -> bool:
+    index_dir = Path(index_dir)
+    return (index_dir / META_SUBDIR / "columns.json").exists() or (index_dir / jsonl_name).exists()
+
+
+def open_meta_store(index_dir: str | Path, jsonl_name: str = "metadata.jsonl"):
+    index_dir = Path(index_dir)
+    meta_dir = index_dir / META_SUBDIR
+    if (meta_dir / "columns.json").exists():
+        return ColumnarMetaStore(meta_dir)
+    print(f"[meta_store] {meta_dir} tidak ada, fallback ke {jsonl_name} (dimuat penuh)")
+    return JsonlMetaStore(index_dir / jsonl_name)
+
+
+def open_parent_store(index_dir: str | Path) -> Optional[ColumnarMetaStore]:
+    parents_dir = Path(index_dir) / PARENTS_SUBDIR
+    if not (parents_dir / "columns.json").exists():
+        return None
+    return ColumnarMetaStore(parents_dir)
@@ -0,0 +1,121 @@
+# app/services/model_registry.py
+"""
+Registry model embedding untuk satu proses (per uvicorn worker).
+
+rag_engine dan lawyer_rec memakai model SentenceTransformer yang sama; registry
+ini memastikan setiap nama model hanya di-load sekali dan dipakai bersama,
+termasuk BatchingEncoder-nya (query dari kedua service ikut satu batch).
+
+Model di-load secara lazy saat pertama dipakai, atau lebih awal lewat warmup()
+saat startup aplikasi.
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Tuple
+
+import numpy as np
+
+from sentence_transformers import CrossEncoder, SentenceTransformer
+
+from app.services.batch_encoder import BatchingEncoder
+
+_models: Dict[str, SentenceTransformer] = {}
+_encoders: Dict[str, BatchingEncoder] = {}
+_cross_encoders: Dict[str, CrossEncoder] = {}
+_tokenizers: Dict[str, Any] = {}
+_lock = threading.Lock()
+
+# Cache embedding query: pertanyaan yang sama di-encode sekali untuk router
+# intent, retrieval, dan rekomendasi pengacara
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+_query_cache: "OrderedDict[Tuple[str, str], np.ndarray]" = OrderedDict()
+_query_lock = threading.Lock()
+
+
+def get_model(name: str) -> SentenceTransformer:
+    model = _models.get(name)
+    if model is not None:
+        return model
+    with _lock:
+        model = _models.get(name)
+        if model is None:
+            started = time.perf_counter()
+            model = SentenceTransformer(name)
+            _models[name] = model
+            print(f"[model_registry] loaded {name} in {time.perf_counter() - started:.1f}s")
+    return model
+
+
+def get_encoder(name: str) -> BatchingEncoder:
+    enc = _encoders.get(name)
+    if enc is not None:
+        return enc
+    model = get_model(name)
+    with _lock:
+        enc = _encoders.get(name)
+        if enc is None:
+            enc = BatchingEncoder(model)
+            _encoders[name] = enc
+    return enc
+
+
+def encode_query(name: str, text: str) -> np.ndarray:
+    """Vektor query (1, dim) ter-normalisasi lewat BatchingEncoder, di-cache LRU per (model, teks)."""
+    key = (name, text)
+    with _query_lock:
+        vec = _query_cache.get(key)
+        if vec is not None:
+            _query_cache.move_to_end(key)
+            return vec
+    vec = get_encoder(name).encode(text)
+    vec.flags.writeable = False  # dipakai bersama antar pemanggil
+    if QUERY_CACHE_SIZE > 0:
+        with _query_lock:
+            _query_cache[key] = vec
+            while len(_query_cache) > QUERY_CACHE_SIZE:
+                _query_cache.popitem(last=False)
+    return vec
+
+
+def get_cross_encoder(name: str) -> CrossEncoder:
+    model = _cross_encoders.get(name)
+    if model is not None:
+        return model
+    with _lock:
+        model = _cross_encoders.get(name)
+        if model is None:
+            started = time.perf_counter()
+            model = CrossEncoder(name)
+            _cross_encoders[name] = model
+            print(f"[model_registry] loaded cross-encoder {name} in {time.perf_counter() - started:.1f}s")
+    return model
+
+
+def get_tokenizer(name: str):
+    """Tokenizer HF (mis. milik model chat di vLLM) untuk menghitung token prompt."""
+    tok = _tokenizers.get(name)
+    if tok is not None:
+        return tok
+    with _lock:
+        tok = _tokenizers.get(name)
+        if tok is None:
+            from transformers import AutoTokenizer
+
+            tok = AutoTokenizer.from_pretrained(name)
+            _tokenizers[name] = tok
+            print(f"[model_registry] loaded tokenizer {name}")
+    return tok
+
+
+def warmup(names: Iterable[str]) -> None:
+    """Load model lebih awal + satu forward pass supaya request pertama tidak cold-start."""
+    for name in dict.fromkeys(names):
+        get_encoder(name).encode("pemanasan")
+
+
+def encoder_stats() -> Dict[str, Any]:
+    return {name: enc.stats() for name, enc in _encoders.items()}
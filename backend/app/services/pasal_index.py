@@ -0,0 +1,93 @@
+# app/services/pasal_index.py
+"""
+Lookup langsung (statuta, pasal, ayat) -> chunk, tanpa pencarian vektor.
+
+Banyak pertanyaan menyebut pasal secara eksplisit ("Apa bunyi Pasal 187 KUHP?").
+rag_dev/build_faiss_index.py menyimpan pasal_index.json berisi kunci
+"kuhp|187" / "kuhap|21|1" -> row id chunk; modul ini mem-parse rujukan di
+pertanyaan lalu me-resolve-nya dengan lookup dict O(1).
+"""
+from __future__ import annotations
+
+import json
+import re
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+PASAL_INDEX_FILE = "pasal_index.json"
+
+# "Pasal 187", "pasal 21 ayat (1)", "Pasal 187 bis", "Pasal 14a ayat 2"
+_CITATION = re.compile(
+    r"\bpasal\s+(\d+[a-z]?)(?:\s+(bis|ter|quater)\b)?(?:\s+ayat\s*\(?(\d+)\)?)?",
+    re.I,
+)
+# Jarak maksimum (karakter) antara nomor pasal dan penyebutan statutanya
+_STATUTE_WINDOW = 80
+
+
+class PasalIndex:
+    def __init__(self, path: str | Path):
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+        if data.get("format") != 1:
+            raise RuntimeError(f"Unsupported pasal index format {data.get('format')} in {path}")
+        self._statute = re.compile(data["statute_pattern"])
+        self._aliases = data.get("aliases") or {}
+        self._entries = data.get("entries") or {}
+
+    def _statute_key(self, tail: str) -> Optional[str]:
+        """Statuta pertama yang disebut setelah nomor pasal (UU/PP nomor-tahun atau singkatan)."""
+        tail = tail.lower()
+        found = []
+        m = self._statute.search(tail)
+        if m:
+            kind = {"undang-undang": "uu", "perppu": "perpu"}.get(m.group(1), m.group(1))
+            found.append((m.start(), f"{kind}-{int(m.group(2))}-{m.group(3)}"))
+        for w in re.finditer(r"[a-z]+", tail):
+            if w.group(0) in self._aliases:
+                found.append((w.start(), self._aliases[w.group(0)]))
+                break
+        return min(found)[1] if found else None
+
+    def statute_of(self, title: str) -> Optional[str]:
+        """Kunci statuta dari judul dokumen (dipakai untuk dokumen yang di-ingest online)."""
+        return self._statute_key(title or "")
+
+    def parse(self, question: str) -> List[Tuple[str, str, Optional[str]]]:
+        """Rujukan eksplisit di pertanyaan: [(statuta, pasal, ayat|None), ...]."""
+        out = []
+        for m in _CITATION.finditer(question):
+            tail = question[m.end():m.end() + _STATUTE_WINDOW]
+            # "Pasal 1 dan Pasal 2 KUHP": statuta terdekat setelahnya berlaku untuk keduanya
+            statute = self._statute_key(tail)
+            if statute is None:
+                continue
+            pasal = (m.group(1) + (m.group(2) or "")).lower()
+            cite = (statute, pasal, m.group(3))
+            if cite not in out:
+                out.append(cite)
+        return out
+
+    def lookup(self, question: str) -> List[int]:
+        """Row id chunk untuk semua rujukan yang dikenali (urut kemunculan, tanpa duplikat)."""
+        return self.resolve(self.parse(question))
+
+    def resolve(self, cites: List[Tuple[str, str, Optional[str]]]) -> List[int]:
+        ids: List[int] = []
+        for statute, pasal, ayat in cites:
+            rows = None
+            if ayat:
+                rows = self._entries.get(f"{statute}|{pasal}|{ayat}")
+            if not rows:
+                rows = self._entries.get(f"{statute}|{pasal}") or []
+            for r in rows:
+                if r not in ids:
+                    ids.append(r)
+        return ids
+
+
+def open_pasal_index(index_dir: str | Path) -> PasalIndex | None:
+    path = Path(index_dir) / PASAL_INDEX_FILE
+    if not path.exists():
+        print(f"[pasal_index] {path} tidak ada, lookup pasal langsung nonaktif")
+        return None
+    return PasalIndex(path)
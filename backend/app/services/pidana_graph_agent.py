@@ -1,34 +1,102 @@
 # app/services/pidana_graph_agent.py
 
 from __future__ import annotations
-from typing import TypedDict, Literal, Optional, Any
+from typing import TypedDict, Literal, Optional, Any, AsyncIterator, Dict, List, Annotated
 
+import asyncio
+import logging
 import os
-import requests
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from starlette.concurrency import run_in_threadpool
 
 from langgraph.graph import StateGraph, END
 
-from app.services.rag_engine import ask_vllm
+from app.services import intent_classifier, llm_client, reranker
+from app.services.rag_engine import MAX_TOKENS, TOP_K, aask_vllm, build_payload, search, stream_vllm
 from app.services.lawyer_rec import recommend_lawyers_for_user, format_lawyer_recommendation_text, build_user_address_from_db
 
+logger = logging.getLogger(__name__)
+
 
 # ============================
 # 1. STATE UNTUK LANGGRAPH
 # ============================
 
+def _merge_answers(a: Optional[Dict[str, str]], b: Optional[Dict[str, str]]) -> Dict[str, str]:
+    # reducer: handler yang berjalan paralel masing-masing menulis jawabannya sendiri
+    return {**(a or {}), **(b or {})}
+
+
 class AgentState(TypedDict):
     question: str
     intent: Optional[str]
+    intents: List[str]  # >1 label untuk pesan campuran (mis. PIDANA_QA + LAWYER_REC)
+    answers: Annotated[Dict[str, str], _merge_answers]  # jawaban per label
     answer: Optional[str]
     user: Any
     extra_context: Optional[str]  
+    speculation: Optional["Speculation"]
+    deadline: Optional[float]  # time.monotonic() batas akhir request
+
+
+# Deadline per request: satu batas waktu untuk seluruh request (bukan
+# 60 s + 300 s + 10 s per call). Setiap node memakai sisa waktunya untuk
+# timeout call keluar, dan menurunkan kualitas jika waktunya menipis:
+# max_tokens dikecilkan, rerank dan geocoding dilewati.
+
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "300"))
+INTENT_TIMEOUT = float(os.getenv("INTENT_TIMEOUT", "60"))
+INTENT_LLM_MIN_SECONDS = float(os.getenv("INTENT_LLM_MIN_SECONDS", "10"))
+# estimasi kecepatan decode vLLM (token/detik) untuk memotong max_tokens
+ANSWER_TOKENS_PER_SEC = float(os.getenv("ANSWER_TOKENS_PER_SEC", "25"))
+# batas bawah max_tokens saat deadline menipis (beda dengan context_packer.MIN_ANSWER_TOKENS)
+DEADLINE_MIN_ANSWER_TOKENS = int(os.getenv("DEADLINE_MIN_ANSWER_TOKENS", "64"))
+RERANK_MIN_SECONDS = float(os.getenv("RERANK_MIN_SECONDS", "20"))
+GEOCODE_TIMEOUT = float(os.getenv("GEOCODE_TIMEOUT", "10"))
+GEOCODE_MIN_SECONDS = float(os.getenv("GEOCODE_MIN_SECONDS", "3"))
+
+
+def new_deadline(timeout: Optional[float] = None) -> float:
+    return time.monotonic() + (REQUEST_TIMEOUT if timeout is None else timeout)
+
+
+def _loop_deadline(deadline: float) -> float:
+    # deadline time.monotonic() → waktu event loop (untuk asyncio.timeout_at)
+    return asyncio.get_running_loop().time() + (deadline - time.monotonic())
+
+
+def remaining(state: AgentState) -> float:
+    """Sisa waktu request dalam detik; LLMDeadlineExceeded jika sudah habis."""
+    deadline = state.get("deadline")
+    if deadline is None:
+        return REQUEST_TIMEOUT
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise llm_client.LLMDeadlineExceeded("request deadline exceeded")
+    return left
+
+
+def rerank_allowed(left: float) -> bool:
+    return reranker.RERANK_ENABLED and left >= RERANK_MIN_SECONDS
+
+
+def answer_budget(state: AgentState) -> Dict[str, Any]:
+    """Parameter generasi PIDANA_QA dari sisa deadline (timeout, max_tokens, rerank)."""
+    left = remaining(state)
+    return {
+        "timeout": left,
+        "max_tokens": max(DEADLINE_MIN_ANSWER_TOKENS, min(MAX_TOKENS, int(left * ANSWER_TOKENS_PER_SEC))),
+        "rerank": rerank_allowed(left),
+    }
 
 
 # ============================
 # 2. INTENT CLASSIFIER (ROUTER)
 # ============================
 
-VLLM_BASE = os.getenv("VLLM_BASE")
 INTENT_MODEL = os.getenv("INTENT_MODEL", os.getenv("MODEL_NAME", "Qwen/Qwen2.5-3B-Instruct"))
 
 INTENT_SYSTEM_PROMPT = """
@@ -59,16 +127,70 @@ Batasan:
 - Jangan menambahkan penjelasan lain.
 """
 
-def classify_intent(state: AgentState) -> AgentState:
-    question = state["question"]
+LAWYER_KEYWORDS = ["pengacara", "advokat", "lawyer", "kuasa hukum"]
+
+# Pesan campuran ("saya ditipu, pasal apa yang berlaku dan siapa pengacara di
+# Jakarta Selatan?"): PIDANA_QA dan LAWYER_REC dijalankan paralel lalu jawabannya
+# digabung, sehingga latensi = cabang terlama, bukan jumlah keduanya.
+MULTI_INTENT = os.getenv("MULTI_INTENT", "1") == "1"
+PIDANA_CUES = [
+    "pasal", "kuhp", "kuhap", "undang-undang", "ancaman", "hukuman",
+    "dipidana", "dipenjara", "delik", "dilaporkan",
+]
+ANSWER_SEPARATOR = "\n\n---\n\n"
+
+
+def is_lawyer_request(question: str) -> bool:
+    q_lower = question.lower()
+    return any(kw in q_lower for kw in LAWYER_KEYWORDS)
+
+
+def has_pidana_cue(question: str) -> bool:
     q_lower = question.lower()
+    return any(cue in q_lower for cue in PIDANA_CUES)
+
+
+async def _also_asks_pidana(question: str) -> bool:
+    """Apakah pesan yang meminta pengacara juga bertanya soal hukum pidana."""
+    if has_pidana_cue(question):
+        return True
+    scores = await run_in_threadpool(intent_classifier.scores, question)
+    if not scores:
+        return False
+    # label terkuat selain LAWYER_REC harus PIDANA_QA dan cukup mirip
+    others = {label: s for label, s in scores.items() if label != "LAWYER_REC"}
+    best = max(others, key=others.get)
+    return best == "PIDANA_QA" and others[best] >= intent_classifier.INTENT_MIN_SIMILARITY
+
+
+def _routed(state: AgentState, *intents: str) -> Dict[str, Any]:
+    # retrieval spekulatif hanya berguna jika ada cabang PIDANA_QA
+    if "PIDANA_QA" not in intents:
+        _discard_speculation(state)
+    return {"intent": intents[0], "intents": list(intents)}
+
+
+async def classify_intent(state: AgentState) -> Dict[str, Any]:
+    question = state["question"]
+
+    # 1) RULE-BASED: hard keyword untuk LAWYER_REC (+ PIDANA_QA jika pesan campuran)
+    if is_lawyer_request(question):
+        if MULTI_INTENT and await _also_asks_pidana(question):
+            return _routed(state, "PIDANA_QA", "LAWYER_REC")
+        return _routed(state, "LAWYER_REC")
 
-    # 1) RULE-BASED: hard keyword untuk LAWYER_REC
-    lawyer_keywords = ["pengacara", "advokat", "lawyer", "kuasa hukum"]
-    if any(kw in q_lower for kw in lawyer_keywords):
-        return {**state, "intent": "LAWYER_REC"}
+    # 2) Classifier lokal berbasis embedding (vektor dipakai ulang oleh retrieval)
+    label, info = await run_in_threadpool(intent_classifier.classify, question)
+    if label is not None:
+        return _routed(state, label)
 
-    # 2) Kalau tidak kena rule, baru pakai LLM
+    # Sisa waktu tidak cukup untuk router LLM: pakai tebakan terbaik classifier lokal
+    left = remaining(state)
+    scores = info.get("scores")
+    if scores and left < INTENT_LLM_MIN_SECONDS:
+        return _routed(state, max(scores, key=scores.get))
+
+    # 3) Kalau classifier lokal kurang yakin, baru pakai LLM
     payload = {
         "model": INTENT_MODEL,
         "messages": [
@@ -79,22 +201,155 @@ def classify_intent(state: AgentState) -> AgentState:
         "max_tokens": 4,
     }
 
-    resp = requests.post(f"{VLLM_BASE}/v1/chat/completions", json=payload, timeout=60)
-    resp.raise_for_status()
-    label = resp.json()["choices"][0]["message"]["content"].strip().upper()
+    resp = await llm_client.achat_completion(payload, timeout=min(INTENT_TIMEOUT, left))
+    label = llm_client.message_content(resp).strip().upper()
 
     # Safety net: kalau LLM ngaco, paksa NON_PIDANA
     if label not in {"PIDANA_QA", "LAWYER_REC", "SAPA", "NON_PIDANA"}:
         label = "NON_PIDANA"
 
-    return {**state, "intent": label}
+    return _routed(state, label)
+
+
+# ============================
+# 3. RETRIEVAL SPEKULATIF
+# ============================
+# Embedding query + search FAISS dijalankan di thread terpisah selama
+# classify_intent berjalan. Jika intent PIDANA_QA, hasilnya dipakai
+# handle_pidana_qa; selain itu dibatalkan (jika belum mulai) atau dibuang.
+
+SPECULATIVE_RETRIEVAL = os.getenv("SPECULATIVE_RETRIEVAL", "1") == "1"
+SPECULATIVE_WORKERS = int(os.getenv("SPECULATIVE_WORKERS", "4"))
+
+_spec_executor: Optional[ThreadPoolExecutor] = None
+_spec_lock = threading.Lock()
+_spec_stats = {"started": 0, "hit": 0, "miss": 0, "saved_ms": 0.0, "wasted_ms": 0.0}
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _spec_executor
+    if _spec_executor is None:
+        with _spec_lock:
+            if _spec_executor is None:
+                _spec_executor = ThreadPoolExecutor(
+                    max_workers=SPECULATIVE_WORKERS, thread_name_prefix="spec-retrieval"
+                )
+    return _spec_executor
+
+
+class Speculation:
+    """
+    Satu retrieval spekulatif per request; hasil/biayanya dicatat di
+    speculation_stats(). `rerank` dan `k` sama dengan jalur non-spekulatif
+    (rerank diputuskan dari sisa deadline saat spekulasi dimulai).
+    """
+
+    def __init__(self, question: str, rerank: bool, k: int = TOP_K):
+        self.rerank, self.k = rerank, k
+        self.search_ms: Optional[float] = None
+        self.outcome: Optional[str] = None
+        self.saved_ms = 0.0
+        self.future: Future = _executor().submit(self._run, question)
+        with _spec_lock:
+            _spec_stats["started"] += 1
+
+    def _run(self, question: str):
+        started = time.perf_counter()
+        try:
+            return search(question, k=self.k, rerank=self.rerank)
+        finally:
+            self.search_ms = (time.perf_counter() - started) * 1000
+
+    async def take(self, rerank: bool, k: int = TOP_K):
+        """
+        Hasil search untuk PIDANA_QA; waktu yang dihemat = durasi search - waktu
+        menunggu. None jika search spekulatif gagal atau tidak cocok dengan
+        parameter yang diminta (pemanggil search ulang). Hasil yang sudah
+        di-rerank tetap dipakai walau rerank kini dilewati: biayanya sudah dibayar.
+        """
+        if k != self.k or (rerank and not self.rerank):
+            self.discard()
+            return None
+        started = time.perf_counter()
+        try:
+            # shield: request yang dibatalkan tidak membatalkan future (discard() yang mencatatnya)
+            hits = await asyncio.shield(asyncio.wrap_future(self.future))
+        except Exception as e:
+            logger.warning("speculative search gagal: %r", e)
+            self._finish("miss", 0.0)
+            return None
+        waited_ms = (time.perf_counter() - started) * 1000
+        self._finish("hit", max(0.0, (self.search_ms or 0.0) - waited_ms))
+        return hits
+
+    def discard(self) -> None:
+        if self.outcome is None and not self.future.cancel():
+            # sudah berjalan: biarkan selesai di background, hasilnya dibuang
+            self.future.add_done_callback(lambda _f: self._record_waste())
+        self._finish("miss", 0.0)
+
+    def _record_waste(self) -> None:
+        with _spec_lock:
+            _spec_stats["wasted_ms"] += self.search_ms or 0.0
+
+    def _finish(self, outcome: str, saved_ms: float) -> None:
+        if self.outcome is not None:
+            return
+        self.outcome, self.saved_ms = outcome, saved_ms
+        with _spec_lock:
+            _spec_stats[outcome] += 1
+            _spec_stats["saved_ms"] += saved_ms
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "outcome": self.outcome,
+            "search_ms": round(self.search_ms, 2) if self.search_ms is not None else None,
+            "saved_ms": round(self.saved_ms, 2),
+        }
+
+
+def start_speculation(question: str, deadline: float) -> Optional[Speculation]:
+    # pesan dengan keyword pengacara langsung ke LAWYER_REC, tidak perlu retrieval
+    # (kecuali pesan campuran yang juga bertanya soal pidana)
+    if not SPECULATIVE_RETRIEVAL:
+        return None
+    if is_lawyer_request(question) and not (MULTI_INTENT and has_pidana_cue(question)):
+        return None
+    return Speculation(question, rerank=rerank_allowed(deadline - time.monotonic()))
+
+
+def speculation_stats() -> Dict[str, Any]:
+    with _spec_lock:
+        hit, miss = _spec_stats["hit"], _spec_stats["miss"]
+        decided = hit + miss
+        return {
+            "enabled": SPECULATIVE_RETRIEVAL,
+            "started": _spec_stats["started"],
+            "hit": hit,
+            "miss": miss,
+            "hit_rate": round(hit / decided, 4) if decided else None,
+            "saved_ms_total": round(_spec_stats["saved_ms"], 1),
+            "avg_saved_ms": round(_spec_stats["saved_ms"] / hit, 2) if hit else None,
+            "wasted_ms_total": round(_spec_stats["wasted_ms"], 1),
+        }
+
+
+async def _speculative_hits(state: AgentState, rerank: bool):
+    spec = state.get("speculation")
+    return await spec.take(rerank) if spec is not None else None
+
+
+def _discard_speculation(state: AgentState) -> None:
+    spec = state.get("speculation")
+    if spec is not None:
+        spec.discard()
 
 
 # ============================
-# 3. HANDLER NODE
+# 4. HANDLER NODE
 # ============================
 
-def handle_sapa(state: AgentState) -> AgentState:
+async def handle_sapa(state: AgentState) -> Dict[str, Any]:
     ans = (
         "Halo, saya ThemisAI, asisten hukum pidana Indonesia.\n\n"
         "Saya dirancang untuk menjawab pertanyaan seputar hukum pidana "
@@ -102,34 +357,41 @@ def handle_sapa(state: AgentState) -> AgentState:
         "dan dapat membantu memberikan rekomendasi pengacara pidana.\n\n"
         "Silakan ajukan pertanyaan terkait hukum pidana yang ingin Anda ketahui."
     )
-    return {**state, "answer": ans}
+    return {"answers": {"SAPA": ans}}
 
 
-def handle_non_pidana(state: AgentState) -> AgentState:
+async def handle_non_pidana(state: AgentState) -> Dict[str, Any]:
     ans = (
         "Maaf, saya hanya dapat membantu menjawab pertanyaan terkait hukum pidana di Indonesia.\n\n"
         "Topik seperti hukum perdata, pajak, bisnis, waris, pernikahan, maupun "
         "pertanyaan non-hukum tidak termasuk dalam cakupan saya.\n\n"
         "Silakan ajukan pertanyaan lain yang secara jelas berkaitan dengan hukum pidana "
     )
-    return {**state, "answer": ans}
+    return {"answers": {"NON_PIDANA": ans}}
 
 
-def handle_pidana_qa(state: AgentState) -> AgentState:
+async def handle_pidana_qa(state: AgentState) -> Dict[str, Any]:
     question = state["question"]
     extra_context = state.get("extra_context")
 
-    
-    answer, sources = ask_vllm(question, extra_context=extra_context)
-    return {**state, "answer": answer}
+    budget = answer_budget(state)
+    hits = await _speculative_hits(state, budget["rerank"])
+    answer, sources = await aask_vllm(question, extra_context=extra_context, hits=hits, **budget)
+    return {"answers": {"PIDANA_QA": answer}}
 
 
-def handle_lawyer_rec(state: AgentState) -> AgentState:
+async def handle_lawyer_rec(state: AgentState) -> Dict[str, Any]:
     """
     Handler rekomendasi pengacara PIDANA berbasis:
     - deskripsi kasus = pertanyaan user (state["question"])
     - lokasi = alamat user di DB (tabel Address via models.Person.address)
+    Geocoding, query DB, dan search FAISS bersifat blocking → thread pool.
     """
+    ans = await run_in_threadpool(_lawyer_rec_answer, state)
+    return {"answers": {"LAWYER_REC": ans}}
+
+
+def _lawyer_rec_answer(state: AgentState) -> str:
     q = state["question"]
     user = state.get("user")
 
@@ -141,17 +403,20 @@ def handle_lawyer_rec(state: AgentState) -> AgentState:
             "Saat ini data profil belum terdeteksi. Silakan pastikan Anda sudah login dan "
             "mengisi alamat lengkap di menu profil."
         )
-        return {**state, "answer": ans}
+        return ans
     
     addr_str = build_user_address_from_db(user)
     print("DEBUG user address for geocode:", addr_str)
 
-    # 1) panggil core rekomendasi berbasis alamat user di DB
+    # 1) panggil core rekomendasi berbasis alamat user di DB; geocoding dilewati
+    #    (ranking semantik saja) jika sisa deadline terlalu sedikit
+    left = remaining(state)
     results = recommend_lawyers_for_user(
         user=user,
         case_description=q,
         top_k=3,
         search_pool_k=50,
+        geocode_timeout=min(GEOCODE_TIMEOUT, left) if left >= GEOCODE_MIN_SECONDS else 0,
     )
 
     # 2) format alamat user sebagai teks lokasi (untuk ditampilkan)
@@ -164,73 +429,163 @@ def handle_lawyer_rec(state: AgentState) -> AgentState:
         results=results,
     )
 
-    return {**state, "answer": formatted}
+    return formatted
+
+
+async def merge_answers(state: AgentState) -> Dict[str, Any]:
+    """Gabungkan jawaban cabang-cabang handler sesuai urutan label di `intents`."""
+    answers = state.get("answers") or {}
+    parts = [answers[label] for label in state.get("intents") or [] if answers.get(label)]
+    return {"answer": ANSWER_SEPARATOR.join(parts)}
 
 
 # ============================
-# 4. ROUTER UNTUK GRAPH
+# 5. ROUTER UNTUK GRAPH
 # ============================
 
-def route_from_intent(state: AgentState) -> str:
-    intent = state.get("intent", "NON_PIDANA")
-    if intent == "PIDANA_QA":
-        return "handle_pidana_qa"
-    if intent == "LAWYER_REC":
-        return "handle_lawyer_rec"
-    if intent == "SAPA":
-        return "handle_sapa"
-    return "handle_non_pidana"
+INTENT_NODES = {
+    "PIDANA_QA": "handle_pidana_qa",
+    "LAWYER_REC": "handle_lawyer_rec",
+    "SAPA": "handle_sapa",
+    "NON_PIDANA": "handle_non_pidana",
+}
+
+
+def route_from_intent(state: AgentState) -> List[str]:
+    """Node handler untuk setiap label; lebih dari satu → dijalankan paralel oleh LangGraph."""
+    intents = state.get("intents") or [state.get("intent") or "NON_PIDANA"]
+    return [INTENT_NODES.get(intent, "handle_non_pidana") for intent in intents]
 
 
 # ============================
-# 5. BANGUN GRAPH
+# 6. BANGUN GRAPH
 # ============================
 
+HANDLERS = {
+    "handle_sapa": handle_sapa,
+    "handle_non_pidana": handle_non_pidana,
+    "handle_pidana_qa": handle_pidana_qa,
+    "handle_lawyer_rec": handle_lawyer_rec,
+}
+
 builder = StateGraph(AgentState)
 
 builder.add_node("classify_intent", classify_intent)
-builder.add_node("handle_sapa", handle_sapa)
-builder.add_node("handle_non_pidana", handle_non_pidana)
-builder.add_node("handle_pidana_qa", handle_pidana_qa)
-builder.add_node("handle_lawyer_rec", handle_lawyer_rec)
+for name, handler in HANDLERS.items():
+    builder.add_node(name, handler)
+builder.add_node("merge_answers", merge_answers)
 
 builder.set_entry_point("classify_intent")
 
 builder.add_conditional_edges(
     "classify_intent",
     route_from_intent,
-    {
-        "handle_sapa": "handle_sapa",
-        "handle_non_pidana": "handle_non_pidana",
-        "handle_pidana_qa": "handle_pidana_qa",
-        "handle_lawyer_rec": "handle_lawyer_rec",
-    },
+    {name: name for name in HANDLERS},
 )
 
-# Semua handler → END
-builder.add_edge("handle_sapa", END)
-builder.add_edge("handle_non_pidana", END)
-builder.add_edge("handle_pidana_qa", END)
-builder.add_edge("handle_lawyer_rec", END)
+# Semua handler → merge_answers → END (cabang paralel ditunggu semuanya)
+for name in HANDLERS:
+    builder.add_edge(name, "merge_answers")
+builder.add_edge("merge_answers", END)
 
 pidana_graph_app = builder.compile()
 
 
 # ============================
-# 6. FUNGSI ENTRYPOINT UNTUK FASTAPI
+# 7. FUNGSI ENTRYPOINT UNTUK FASTAPI
 # ============================
 
-def run_pidana_graph(question: str, user, extra_context: Optional[str] = None) -> str:
+async def run_pidana_graph(
+    question: str, user, extra_context: Optional[str] = None, timeout: Optional[float] = None
+) -> str:
     """
     Fungsi pembungkus yang dipanggil dari router /chat.
     `user` = instance models.Person (current user dari FastAPI)
+    Semua node async (ainvoke): menunggu vLLM tidak memakai thread pool.
+    `timeout` = deadline seluruh request (default REQUEST_TIMEOUT); jika task
+    dibatalkan (client disconnect), call vLLM yang sedang berjalan ikut batal.
+    """
+    deadline = new_deadline(timeout)
+    spec = start_speculation(question, deadline)
+    try:
+        async with asyncio.timeout_at(_loop_deadline(deadline)):
+            result = await pidana_graph_app.ainvoke({
+                "question": question,
+                "intent": None,
+                "intents": [],
+                "answers": {},
+                "answer": None,
+                "user": user,
+                "extra_context": extra_context,
+                "speculation": spec,
+                "deadline": deadline,
+            })
+    except TimeoutError:
+        raise llm_client.LLMDeadlineExceeded("request deadline exceeded")
+    finally:
+        if spec is not None:
+            spec.discard()  # no-op jika sudah dipakai handler
+            logger.debug("speculation %s", spec.summary())
+    return result["answer"] or ""
+
+
+
+
+async def stream_pidana_graph(
+    question: str, user, extra_context: Optional[str] = None, timeout: Optional[float] = None
+) -> AsyncIterator[str]:
     """
-    result = pidana_graph_app.invoke({
+    Versi streaming dari run_pidana_graph untuk endpoint SSE.
+    Jalur graph sama (classify_intent → route_from_intent → handler), tetapi
+    untuk PIDANA_QA jawaban LLM diteruskan token per token. Handler lain
+    (sapa, non-pidana, rekomendasi pengacara) tidak memanggil LLM generatif,
+    jadi jawabannya dikirim utuh sebagai satu potongan. Pada pesan campuran,
+    rekomendasi pengacara dihitung paralel selama token PIDANA_QA mengalir
+    dan dikirim setelahnya.
+    """
+    deadline = new_deadline(timeout)
+    spec = start_speculation(question, deadline)
+    state: AgentState = {
         "question": question,
         "intent": None,
+        "intents": [],
+        "answers": {},
         "answer": None,
         "user": user,
         "extra_context": extra_context,
-    })
-    return result["answer"] or ""
-
+        "speculation": spec,
+        "deadline": deadline,
+    }
+    others: Dict[str, asyncio.Future] = {}
+    try:
+        state = {**state, **await classify_intent(state)}
+        routes = route_from_intent(state)
+        # handler non-streaming mulai berjalan sekarang, paralel dengan PIDANA_QA
+        others = {
+            route: asyncio.ensure_future(HANDLERS[route](state))
+            for route in routes if route != "handle_pidana_qa"
+        }
+
+        first = True
+        if "handle_pidana_qa" in routes:
+            budget = answer_budget(state)
+            hits = await _speculative_hits(state, budget["rerank"])
+            payload, _sources = await run_in_threadpool(
+                build_payload, question, extra_context, None, budget["max_tokens"],
+                hits=hits, rerank=budget["rerank"],
+            )
+            async for delta in stream_vllm(payload, timeout=remaining(state)):
+                yield delta
+            first = False
+
+        for task in others.values():
+            answers = (await task).get("answers") or {}
+            for text in answers.values():
+                yield text if first else ANSWER_SEPARATOR + text
+                first = False
+    finally:
+        for task in others.values():
+            task.cancel()
+        if spec is not None:
+            spec.discard()
+            logger.debug("speculation %s", spec.summary())
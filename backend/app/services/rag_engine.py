@@ -1,14 +1,32 @@
 # app/services/rag_engine.py
-import os, json, faiss, requests
-from sentence_transformers import SentenceTransformer
+import os
 
-# Load FAISS index + metadata once at startup
-VLLM_BASE = os.getenv("VLLM_BASE")
+from starlette.concurrency import run_in_threadpool
+
+from app.services import context_packer, index_delta, index_versions, llm_client, model_registry
+from app.services.index_store import open_index, apply_search_params, search_parameters
+from app.services.meta_store import open_meta_store, open_parent_store
+from app.services.sparse_index import open_sparse_index, rrf_fuse
+from app.services.pasal_index import open_pasal_index
+from app.services.facets import FacetIndex
+from app.services import reranker
+
+# INDEX_DIR: satu direktori index, atau root berversi dengan file CURRENT
+# (lihat app/services/index_versions.py)
 INDEX_DIR = os.getenv("INDEX_DIR", "/app/app/db/index_uu")
 MODEL_NAME = os.getenv("MODEL_NAME", "Qwen/Qwen2.5-3B-Instruct")
 EMBED_MODEL = os.getenv("EMBED_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
 TOP_K = int(os.getenv("TOP_K", "2"))
 MAX_TOKENS = int(os.getenv("MAX_TOKENS", "2048"))
+# Hybrid retrieval: BM25 (sparse/) + FAISS digabung dengan reciprocal rank fusion
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "1") == "1"
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Rujukan pasal eksplisit ("Pasal 187 KUHP") dijawab dari pasal_index.json tanpa embedding
+PASAL_MAX_CHUNKS = int(os.getenv("PASAL_MAX_CHUNKS", "4"))
+# Index dengan chunker token: chunk pendek dipakai untuk retrieval, yang dikirim
+# ke LLM adalah window parent-nya (satu kali per parent)
+PARENT_CONTEXT = os.getenv("PARENT_CONTEXT", "1") == "1"
 
 
 SYSTEM_PROMPT = """
@@ -52,19 +70,189 @@ Untuk kasus konkret, konsultasikan kepada advokat atau konsultan hukum berizin.
 """
 
 
-index = faiss.read_index(os.path.join(INDEX_DIR, "index.faiss"))
-meta = [json.loads(l) for l in open(os.path.join(INDEX_DIR, "metadata.jsonl"), "r")]
-encoder = SentenceTransformer(EMBED_MODEL)
+# Kolom metadata yang dipakai build_context; kolom lain tidak dimaterialisasi
+HIT_FIELDS = ("text", "title", "doc_type", "url")
+
+
+class RagIndex:
+    """Satu versi index_uu: FAISS + metadata + BM25 + lookup pasal + facet."""
+
+    def __init__(self, index_dir, version, manifest):
+        self.dir = str(index_dir)
+        self.version = version
+        self.manifest = manifest
+        embed_model = manifest.get("embed_model")
+        if embed_model and embed_model != EMBED_MODEL:
+            raise ValueError(f"index {version} built with {embed_model}, server uses {EMBED_MODEL}")
+
+        self.index = open_index(os.path.join(self.dir, "index.faiss"), name="index_uu")
+        self.search_params = apply_search_params(self.index, self.dir)
+        self.meta = open_meta_store(self.dir, "metadata.jsonl")
+        if self.index.ntotal != len(self.meta):
+            raise ValueError(f"index {version}: {self.index.ntotal} vectors vs {len(self.meta)} metadata rows")
+        self.sparse = open_sparse_index(self.dir) if HYBRID_SEARCH else None
+        self.pasal_index = open_pasal_index(self.dir)
+        self.parents = open_parent_store(self.dir)
+        self.facets = FacetIndex(self.meta)
+        # dokumen yang ditambah/diganti/dihapus online (app/services/index_delta.py)
+        self.delta = index_delta.DeltaIndex(
+            os.path.join(index_delta.INDEX_DELTA_DIR, version), self.index.d, self.index.ntotal,
+            lambda: self.meta.column("id"), self.sparse, self.pasal_index, manifest.get("chunking"),
+        )
+
+    def get(self, delta, row, fields):
+        if row < self.index.ntotal:
+            return self.meta.get(row, fields)
+        return delta.record(row, fields)
+
+    def parent(self, delta, row):
+        """(kunci, teks) window parent chunk, atau None jika chunk tidak punya parent."""
+        if row < self.index.ntotal:
+            if self.parents is None:
+                return None
+            p = self.meta.value(row, "parent")
+            return None if p is None else (p, self.parents.value(p, "text"))
+        rec = delta.record(row, ("id", "parent", "parent_text"))
+        if rec is None or rec["parent_text"] is None:
+            return None
+        return (rec["id"], rec["parent"]), rec["parent_text"]
+
+    def stats(self):
+        return {"delta": self.delta.stats()}
+
+    def check_replace(self, old):
+        """Log delta per versi: tolak swap selama `old` punya update online yang belum dilebur ke versi ini."""
+        if old.version == self.version:
+            return
+        pending = old.delta.pending(self.manifest.get("delta_log"))
+        if pending:
+            raise ValueError(
+                f"{pending} online update(s) in {old.version} not merged into {self.version}; "
+                f"rebuild with --delta-log {old.delta.path}"
+            )
+
+    def warmup(self):
+        """Query pemanasan: cek dimensi vektor dan sentuh halaman mmap sebelum swap."""
+        qv = model_registry.get_encoder(EMBED_MODEL).encode("penahanan tersangka")
+        if qv.shape[1] != self.index.d:
+            raise ValueError(f"index {self.version}: dim {self.index.d} != encoder dim {qv.shape[1]}")
+        _retrieve(self, self.delta.snapshot(), "penahanan tersangka", TOP_K, None)
+
+
+store = index_versions.register(index_versions.VersionedIndex("index_uu", INDEX_DIR, RagIndex))
+
+def _merge_scored(a_ids, a_scores, b_ids, b_scores, n):
+    """Gabungkan dua daftar (id, skor) urut skor menurun, ambil n teratas."""
+    if not b_ids:
+        return list(a_ids)[:n]
+    pairs = sorted(zip(list(a_scores) + list(b_scores), list(a_ids) + list(b_ids)), reverse=True)
+    return [i for _, i in pairs[:n]]
+
+def _retrieve(state, delta, query, k, filters, candidates=None):
+    """
+    (row_ids, exact): exact=True jika hasil berasal dari lookup pasal langsung.
+    `candidates` > k dipakai untuk over-fetch sebelum rerank. Row id >= ntotal
+    berasal dari dokumen yang di-ingest online (delta).
+    """
+    candidates = max(k, candidates or k)
+    row_filter = delta.base_filter(state.facets.select(filters))
+    base_empty = row_filter is not None and row_filter.count == 0
+    if base_empty and not delta.rows:
+        return [], False
+
+    if state.pasal_index is not None:
+        cites = state.pasal_index.parse(query)
+        if cites:
+            cited = [] if base_empty else state.pasal_index.resolve(cites)
+            if row_filter is not None:
+                cited = [i for i in cited if row_filter.allows(i)]
+            cited += delta.pasal_lookup(cites, filters)
+            if cited:
+                return cited[:max(k, PASAL_MAX_CHUNKS)], True
 
-def search(query, k=TOP_K):
-    qv = encoder.encode([query], normalize_embeddings=True).astype("float32")
-    D, I = index.search(qv, k)
-    hits = [meta[i] for i in I[0] if i < len(meta)]
+    n = max(candidates, HYBRID_CANDIDATES) if state.sparse is not None else candidates
+    qv = model_registry.encode_query(EMBED_MODEL, query)
+    dense, dense_scores = [], []
+    if not base_empty:
+        if row_filter is None:
+            D, I = state.index.search(qv, n)
+        else:
+            params = search_parameters(state.index, row_filter.selector, state.search_params)
+            D, I = state.index.search(qv, n, params=params)
+        for i, d in zip(I[0], D[0]):
+            if 0 <= i < len(state.meta):
+                dense.append(int(i))
+                dense_scores.append(float(d))
+    dense = _merge_scored(dense, dense_scores, *delta.search(qv, n, filters), n)
+    if state.sparse is None:
+        return dense[:candidates], False
+
+    if base_empty:
+        lexical, lexical_scores = [], []
+    else:
+        lexical, lexical_scores = state.sparse.search(query, n, mask=row_filter.mask if row_filter is not None else None)
+    lexical = _merge_scored(lexical.tolist() if len(lexical) else [], lexical_scores,
+                            *delta.lexical(query, n, state.sparse, filters), n)
+    return rrf_fuse([dense, lexical], candidates, RRF_K), False
+
+def retrieve_ids(query, k=TOP_K, filters=None):
+    """
+    Row id chunk teratas. Jika pertanyaan menyebut pasal yang ada di index,
+    chunk pasal itu langsung dipakai (maks. PASAL_MAX_CHUNKS); selain itu
+    dense saja, atau dense + BM25 lewat RRF jika sparse/ tersedia.
+    `filters` (lihat app/services/facets.py) membatasi row di semua jalur.
+    """
+    state = store.current
+    return _retrieve(state, state.delta.snapshot(), query, k, filters)[0]
+
+def search(query, k=TOP_K, filters=None, rerank=reranker.RERANK_ENABLED):
+    # satu snapshot versi index untuk seluruh request (aman saat reload)
+    state = store.current
+    delta = state.delta.snapshot()
+    # dengan rerank: over-fetch kandidat lalu nilai ulang dengan cross-encoder
+    ids, exact = _retrieve(state, delta, query, k, filters, reranker.RERANK_CANDIDATES if rerank else None)
+    hits = {i: state.get(delta, i, HIT_FIELDS) for i in ids}
+    hits = {i: h for i, h in hits.items() if h is not None}
+    ids = [i for i in ids if i in hits]
+    if rerank and not exact:
+        ids = reranker.rerank(query, [(i, h["text"]) for i, h in hits.items()], k)
+    hits = [hits[i] for i in ids]
+    if PARENT_CONTEXT:
+        hits = _with_parents(state, delta, ids, hits)
     if not hits:
         return [{"text": "Tidak ditemukan konteks hukum yang relevan.", "title": "—", "doc_type": "—", "url": ""}]
     return hits
 
 
+def _with_parents(state, delta, ids, hits):
+    """Ganti teks chunk dengan window parent-nya; chunk dari parent yang sama hanya sekali."""
+    out, seen = [], set()
+    for i, h in zip(ids, hits):
+        parent = state.parent(delta, i)
+        if parent is None:
+            out.append(h)
+            continue
+        key, text = parent
+        if key not in seen:
+            seen.add(key)
+            out.append({**h, "text": text})
+    return out
+
+
+def _embed_documents(texts):
+    model = model_registry.get_model(EMBED_MODEL)
+    return model.encode(texts, batch_size=32, normalize_embeddings=True, convert_to_numpy=True)
+
+def ingest_document(doc: dict):
+    """Tambah/ganti dokumen (skema UU_docs.jsonl) di versi index aktif; langsung bisa dicari."""
+    state = store.current
+    return {**state.delta.upsert(doc, _embed_documents), "version": state.version}
+
+def delete_document(doc_id: str):
+    state = store.current
+    return {**state.delta.delete(doc_id), "version": state.version}
+
+
 def build_context(hits):
     blocks, sources = [], []
     for rank, h in enumerate(hits, 1):
@@ -72,33 +260,71 @@ def build_context(hits):
         sources.append(f"[S{rank}] {h.get('title','')} — {h.get('url','')}")
     return "\n\n".join(blocks), "\n".join(sources)
 
-def ask_vllm(question: str, extra_context: str | None = None):
-    hits = search(question)
+def _messages(question: str, context: str, sources: str):
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": USER_TEMPLATE.format(
+            question=question, context=context, sources=sources)}
+    ]
+
+def build_payload(question: str, extra_context: str | None = None, filters: dict | None = None,
+                  max_tokens: int = MAX_TOKENS, hits: list | None = None,
+                  rerank: bool = reranker.RERANK_ENABLED):
+    """
+    Payload vLLM dengan konteks yang dipadatkan sesuai budget token (lihat
+    app/services/context_packer.py); max_tokens = sisa context window,
+    maks. `max_tokens`. `hits` = hasil search() yang sudah dihitung lebih dulu
+    (retrieval spekulatif), selain itu search dijalankan di sini.
+    """
+    if hits is None:
+        hits = search(question, filters=filters, rerank=rerank)
+    budget = context_packer.prompt_budget() - context_packer.count_chat_tokens(_messages(question, "", ""))
+    hits, extra_context = context_packer.pack_context(hits, extra_context, budget)
     base_context, sources = build_context(hits)
 
     if extra_context:
-        extra_context = extra_context[:8000]
         full_context = (
             base_context
             + "\n\n[DOKUMEN PENGGUNA]\n"
             + extra_context
         )
-        max_tokens = 1200
     else:
         full_context = base_context
-        max_tokens = MAX_TOKENS
 
+    messages = _messages(question, full_context, sources)
+    prompt_tokens = context_packer.count_chat_tokens(messages)
     payload = {
         "model": MODEL_NAME,
-        "messages": [
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": USER_TEMPLATE.format(
-                question=question, context=full_context, sources=sources)}
-        ],
+        "messages": messages,
         "temperature": 0.1,
-        "max_tokens": max_tokens,
+        "max_tokens": context_packer.answer_tokens(prompt_tokens, max_tokens),
     }
-    r = requests.post(f"{VLLM_BASE}/v1/chat/completions", json=payload, timeout=300)
-    r.raise_for_status()
-    reply = r.json()["choices"][0]["message"]["content"]
+    return payload, sources
+
+def ask_vllm(question: str, extra_context: str | None = None, filters: dict | None = None,
+             hits: list | None = None):
+    payload, sources = build_payload(question, extra_context, filters, hits=hits)
+    resp = llm_client.chat_completion(payload, timeout=300)
+    reply = llm_client.message_content(resp)
     return reply, sources
+
+
+async def aask_vllm(question: str, extra_context: str | None = None, filters: dict | None = None,
+                    hits: list | None = None, max_tokens: int = MAX_TOKENS,
+                    rerank: bool = reranker.RERANK_ENABLED, timeout: float = 300):
+    """
+    Versi async ask_vllm: retrieval/packing di thread pool, menunggu vLLM tanpa
+    memegang thread. `max_tokens`, `rerank`, dan `timeout` diturunkan pemanggil
+    dari sisa deadline request.
+    """
+    payload, sources = await run_in_threadpool(
+        build_payload, question, extra_context, filters, max_tokens, hits=hits, rerank=rerank
+    )
+    resp = await llm_client.achat_completion(payload, timeout=timeout)
+    return llm_client.message_content(resp), sources
+
+
+async def stream_vllm(payload: dict, timeout: float = 300):
+    """Yield potongan teks (delta) jawaban satu per satu (vLLM stream=True)."""
+    async for delta in llm_client.astream_chat_completion(payload, timeout=timeout):
+        yield delta
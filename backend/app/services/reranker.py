@@ -0,0 +1,101 @@
+# app/services/reranker.py
+"""
+Tahap rerank opsional setelah retrieval.
+
+rag_engine mengambil RERANK_CANDIDATES kandidat (dense/hybrid), lalu
+cross-encoder multilingual kecil menilai ulang pasangan (query, chunk) per
+batch. Karena TOP_K kecil (default 2), presisi urutan teratas menentukan
+kualitas prompt.
+
+- Anggaran waktu inferensi per request (RERANK_BUDGET_MS, tidak termasuk
+  load model): jika habis sebelum batch berikutnya dimulai, urutan dense
+  dikembalikan apa adanya.
+- Skor (query, chunk) di-cache (LRU) sehingga pertanyaan berulang tidak
+  memanggil model lagi.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Sequence, Tuple
+
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "0") == "1"
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))
+RERANK_BATCH = int(os.getenv("RERANK_BATCH", "16"))
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "300"))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "4096"))
+
+_cache: "OrderedDict[Tuple[str, bytes], float]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _key(query: str, text: str) -> Tuple[str, bytes]:
+    return query, hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
+
+
+def _cache_get(key) -> Optional[float]:
+    with _cache_lock:
+        score = _cache.get(key)
+        if score is not None:
+            _cache.move_to_end(key)
+        return score
+
+
+def _cache_put(key, score: float) -> None:
+    with _cache_lock:
+        _cache[key] = score
+        _cache.move_to_end(key)
+        while len(_cache) > RERANK_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def _model():
+    from app.services import model_registry  # lazy: model hanya di-load jika rerank aktif
+    return model_registry.get_cross_encoder(RERANK_MODEL)
+
+
+def warmup() -> None:
+    """Load cross-encoder saat startup jika rerank aktif (request pertama tidak cold-start)."""
+    if RERANK_ENABLED:
+        _model()
+
+
+def rerank(
+    query: str,
+    candidates: Sequence[Tuple[int, str]],
+    k: int,
+    budget_ms: float = RERANK_BUDGET_MS,
+) -> List[int]:
+    """
+    `candidates` = [(row_id, text), ...] dalam urutan dense.
+    Mengembalikan k row_id teratas menurut cross-encoder, atau urutan dense
+    jika anggaran waktu terlampaui.
+    """
+    dense_order = [row for row, _ in candidates][:k]
+    if len(candidates) <= 1 or budget_ms <= 0:
+        return dense_order
+
+    keys = [_key(query, text) for _, text in candidates]
+    scores = [_cache_get(key) for key in keys]
+    pending = [i for i, s in enumerate(scores) if s is None]
+
+    if pending:
+        # load model (cold worker) di luar anggaran waktu; warmup() memuatnya saat startup
+        model = _model()
+        started = time.perf_counter()
+        for lo in range(0, len(pending), RERANK_BATCH):
+            # hanya berhenti sebelum batch baru; skor yang sudah lengkap tetap dipakai
+            if (time.perf_counter() - started) * 1000 > budget_ms:
+                return dense_order
+            batch = pending[lo:lo + RERANK_BATCH]
+            out = model.predict([(query, candidates[i][1]) for i in batch], batch_size=len(batch))
+            for i, score in zip(batch, out):
+                scores[i] = float(score)
+                _cache_put(keys[i], scores[i])
+
+    order = sorted(range(len(candidates)), key=lambda i: scores[i], reverse=True)
+    return [candidates[i][0] for i in order[:k]]
@@ -0,0 +1,108 @@
+# app/services/sparse_index.py
+"""
+Index leksikal BM25 (dibangun oleh rag_dev/build_faiss_index.py di `sparse/`).
+
+Melengkapi pencarian dense MiniLM untuk query yang bergantung pada kata persis,
+mis. "Pasal 187 KUHP", "penggelapan", "praperadilan". Postings disimpan dalam
+bentuk CSR (term_offsets / doc_ids / weights) dan di-mmap, sehingga satu query
+hanya menyentuh posting list term-term di query.
+
+Tokenizer (pola regex, stopword Indonesia, sufiks partikel) dibaca dari
+sparse/config.json agar identik dengan tokenisasi saat build.
+"""
+from __future__ import annotations
+
+import json
+import re
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+SPARSE_SUBDIR = "sparse"
+
+
+class SparseIndex:
+    def __init__(self, sparse_dir: str | Path):
+        d = Path(sparse_dir)
+        cfg = json.loads((d / "config.json").read_text(encoding="utf-8"))
+        if cfg.get("format") != 1:
+            raise RuntimeError(f"Unsupported sparse index format {cfg.get('format')} in {d}")
+        self.n_docs = int(cfg["n_docs"])
+        self.avgdl = float(cfg.get("avgdl") or 0.0)
+        self.k1 = float(cfg.get("k1", 1.2))
+        self.b = float(cfg.get("b", 0.75))
+        self._pattern = re.compile(cfg["token_pattern"])
+        self._suffixes = tuple(cfg.get("strip_suffixes") or ())
+        self._stopwords = frozenset(cfg.get("stopwords") or ())
+        self._vocab = json.loads((d / "vocab.json").read_text(encoding="utf-8"))
+
+        self._offsets = np.load(d / "term_offsets.npy", mmap_mode="r")
+        self._doc_ids = np.load(d / "doc_ids.npy", mmap_mode="r")
+        self._weights = np.load(d / "weights.npy", mmap_mode="r")
+        self._idf = np.load(d / "idf.npy", mmap_mode="r")
+
+    def tokenize(self, text: str) -> List[str]:
+        toks = []
+        for t in self._pattern.findall(text.lower()):
+            if len(t) > 5:
+                for suf in self._suffixes:
+                    if t.endswith(suf):
+                        t = t[:-len(suf)]
+                        break
+            if t not in self._stopwords:
+                toks.append(t)
+        return toks
+
+    def idf_of(self, term: str) -> float:
+        """IDF term di korpus index; term baru (df=0) mendapat IDF maksimum."""
+        tid = self._vocab.get(term)
+        if tid is not None:
+            return float(self._idf[tid])
+        return float(np.log(1 + (self.n_docs + 0.5) / 0.5))
+
+    def search(self, query: str, k: int, mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k BM25: (row_ids, scores), urut skor menurun. `mask` membatasi row yang boleh."""
+        term_ids = {self._vocab[t] for t in self.tokenize(query) if t in self._vocab}
+        if not term_ids:
+            return np.empty(0, dtype="int64"), np.empty(0, dtype="float32")
+
+        ids, vals = [], []
+        for tid in term_ids:
+            lo, hi = int(self._offsets[tid]), int(self._offsets[tid + 1])
+            ids.append(self._doc_ids[lo:hi])
+            vals.append(self._weights[lo:hi] * self._idf[tid])
+        ids = np.concatenate(ids)
+        vals = np.concatenate(vals)
+
+        if mask is not None:
+            keep = mask[ids]
+            ids, vals = ids[keep], vals[keep]
+            if not len(ids):
+                return np.empty(0, dtype="int64"), np.empty(0, dtype="float32")
+
+        docs, inv = np.unique(ids, return_inverse=True)
+        scores = np.bincount(inv, weights=vals).astype("float32")
+        if len(docs) > k:
+            top = np.argpartition(-scores, k)[:k]
+        else:
+            top = np.arange(len(docs))
+        top = top[np.argsort(-scores[top])]
+        return docs[top].astype("int64"), scores[top]
+
+
+def open_sparse_index(index_dir: str | Path) -> SparseIndex | None:
+    d = Path(index_dir) / SPARSE_SUBDIR
+    if not (d / "config.json").exists():
+        print(f"[sparse_index] {d} tidak ada, hybrid retrieval nonaktif (dense saja)")
+        return None
+    return SparseIndex(d)
+
+
+def rrf_fuse(rankings: List[List[int]], k: int, rrf_k: int = 60) -> List[int]:
+    """Reciprocal rank fusion: skor(d) = Σ 1 / (rrf_k + rank_d), rank mulai 1."""
+    scores: dict = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, 1):
+            scores[doc] = scores.get(doc, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(scores, key=scores.get, reverse=True)[:k]
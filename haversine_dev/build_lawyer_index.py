@@ -1,5 +1,9 @@
 import os
+import csv
 import json
+import hashlib
+import struct
+import time
 from pathlib import Path
 
 import faiss
@@ -22,11 +26,28 @@ LAWYER_META_PATH = Path(
     os.getenv("LAWYER_META_PATH", BASE_DIR / "lawyers/lawyers_meta.jsonl")
 )
 
+# output berversi: jika LAWYER_INDEX_ROOT di-set, hasil ditulis ke <root>/<versi>/
+# lalu <root>/CURRENT diarahkan ke versi itu (dibaca backend, app/services/index_versions.py)
+LAWYER_INDEX_ROOT = os.getenv("LAWYER_INDEX_ROOT", "")
+LAWYER_INDEX_VERSION = os.getenv("LAWYER_INDEX_VERSION", "") or time.strftime("%Y%m%d-%H%M%S")
+if LAWYER_INDEX_ROOT:
+    LAWYER_INDEX_PATH = Path(LAWYER_INDEX_ROOT) / LAWYER_INDEX_VERSION / "index_lawyers.faiss"
+    LAWYER_META_PATH = Path(LAWYER_INDEX_ROOT) / LAWYER_INDEX_VERSION / "lawyers_meta.jsonl"
+
 EMBED_MODEL = os.getenv(
     "EMBED_MODEL",
     "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
 )
 
+# penyimpanan vektor: float32 (IndexFlatIP), float16 / int8 (scalar quantizer);
+# LAWYER_INDEX_PCA > 0 mereduksi dimensi dulu (PCA lalu normalisasi ulang)
+LAWYER_INDEX_STORAGE = os.getenv("LAWYER_INDEX_STORAGE", "float32")
+LAWYER_INDEX_PCA = int(os.getenv("LAWYER_INDEX_PCA", "0"))
+# cek recall@k vs float32: pertanyaan benchmark (kolom "question"), atau sampel vektor pengacara
+LAWYER_EVAL_CSV = os.getenv("LAWYER_EVAL_CSV", str(BASE_DIR.parent / "benchmark" / "qwen_generations.csv"))
+LAWYER_EVAL_K = int(os.getenv("LAWYER_EVAL_K", "10"))
+STORAGE_CODES = {"float32": "Flat", "float16": "SQfp16", "int8": "SQ8"}
+
 
 def build_lawyer_text(rec: dict) -> str:
     """
@@ -58,6 +79,93 @@ def build_lawyer_text(rec: dict) -> str:
     return " | ".join(p for p in parts if p)
 
 
+def write_columnar_meta(records, meta_dir: Path):
+    """
+    Metadata kolom yang dibaca lazy oleh backend (app/services/meta_store.py):
+      meta/columns.json  {"format": 1, "rows": N, "columns": [...]}
+      meta/<col>.off     offset uint64 little-endian (N+1)
+      meta/<col>.heap    nilai JSON UTF-8 per baris, disambung
+    """
+    meta_dir.mkdir(parents=True, exist_ok=True)
+    columns = list(dict.fromkeys(k for rec in records for k in rec))
+    for col in columns:
+        pos = 0
+        with (meta_dir / f"{col}.heap").open("wb") as heap, (meta_dir / f"{col}.off").open("wb") as off:
+            off.write(struct.pack("<Q", 0))
+            for rec in records:
+                b = json.dumps(rec.get(col), ensure_ascii=False).encode("utf-8")
+                heap.write(b)
+                pos += len(b)
+                off.write(struct.pack("<Q", pos))
+    with (meta_dir / "columns.json").open("w", encoding="utf-8") as f:
+        json.dump({"format": 1, "rows": len(records), "columns": columns}, f)
+
+
+def build_index(emb: np.ndarray) -> faiss.Index:
+    """Index flat inner product sesuai LAWYER_INDEX_STORAGE / LAWYER_INDEX_PCA."""
+    if LAWYER_INDEX_STORAGE not in STORAGE_CODES:
+        raise ValueError(f"LAWYER_INDEX_STORAGE must be one of {list(STORAGE_CODES)}")
+    dim = emb.shape[1]
+    if LAWYER_INDEX_STORAGE == "float32" and not LAWYER_INDEX_PCA:
+        index = faiss.IndexFlatIP(dim)
+    else:
+        prefix = f"PCA{LAWYER_INDEX_PCA},L2norm," if LAWYER_INDEX_PCA else ""
+        index = faiss.index_factory(dim, prefix + STORAGE_CODES[LAWYER_INDEX_STORAGE], faiss.METRIC_INNER_PRODUCT)
+        index.train(emb)
+    index.add(emb)
+    return index
+
+
+def eval_queries(model, emb: np.ndarray) -> np.ndarray:
+    if LAWYER_EVAL_CSV and Path(LAWYER_EVAL_CSV).exists():
+        with open(LAWYER_EVAL_CSV, "r", encoding="utf-8") as f:
+            questions = [row["question"] for row in csv.DictReader(f) if row.get("question")]
+        q = model.encode(questions, batch_size=64, convert_to_numpy=True)
+        faiss.normalize_L2(q)
+        return q
+    rng = np.random.default_rng(1)
+    return emb[rng.choice(len(emb), size=min(200, len(emb)), replace=False)]
+
+
+def recall_vs_float32(index: faiss.Index, emb: np.ndarray, queries: np.ndarray, k: int) -> float:
+    """recall@k index terhadap exact search float32 (IndexFlatIP) atas vektor yang sama."""
+    k = min(k, len(emb))
+    exact = faiss.IndexFlatIP(emb.shape[1])
+    exact.add(emb)
+    _, gt = exact.search(queries, k)
+    _, got = index.search(queries, k)
+    return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(got, gt)]))
+
+
+def _sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def write_manifest(out_dir: Path, version: str, info: dict) -> Path:
+    """manifest.json: ukuran + sha256 setiap file, model embedding, jumlah row."""
+    files = {}
+    for p in sorted(out_dir.rglob("*")):
+        if p.is_file() and p.name != "manifest.json":
+            files[p.relative_to(out_dir).as_posix()] = {"size": p.stat().st_size, "sha256": _sha256(p)}
+    manifest = {"format": 1, "version": version,
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"), **info, "files": files}
+    path = out_dir / "manifest.json"
+    with path.open("w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return path
+
+
+def publish_version(index_root: Path, version: str):
+    """Arahkan <root>/CURRENT ke versi baru (rename atomik)."""
+    tmp = index_root / f".CURRENT.{os.getpid()}"
+    tmp.write_text(version + "\n", encoding="utf-8")
+    os.replace(tmp, index_root / "CURRENT")
+
+
 def main():
     if not LAWYER_JSONL.exists():
         raise FileNotFoundError(f"{LAWYER_JSONL} not found")
@@ -81,14 +189,19 @@ def main():
     texts = [build_lawyer_text(rec) for rec in lawyers]
 
     # simpan metadata apa adanya (supaya lawyer_rec.py bisa pakai field-field tersebut)
+    records_out = []
     with LAWYER_META_PATH.open("w", encoding="utf-8") as f:
         for rec, text in zip(lawyers, texts):
             # pastikan field "text" ada dan konsisten
             rec_out = dict(rec)
             rec_out["text"] = text
+            records_out.append(rec_out)
             f.write(json.dumps(rec_out, ensure_ascii=False) + "\n")
 
-    print("[*] Saved metadata to", LAWYER_META_PATH)
+    # versi kolom (meta/) di folder yang sama, dibaca lazy oleh backend
+    write_columnar_meta(records_out, LAWYER_META_PATH.parent / "meta")
+
+    print("[*] Saved metadata to", LAWYER_META_PATH, "+ meta/")
 
     # build embeddings
     print("[*] Encoding lawyers...")
@@ -103,11 +216,29 @@ def main():
 
     # build faiss index
     dim = emb.shape[1]
-    index = faiss.IndexFlatIP(dim)
-    index.add(emb)
+    index = build_index(emb)
 
     print("[*] Saving FAISS index...")
     faiss.write_index(index, str(LAWYER_INDEX_PATH))
+    quant = {"storage": LAWYER_INDEX_STORAGE, "pca": LAWYER_INDEX_PCA,
+             "bytes_per_vector": round(LAWYER_INDEX_PATH.stat().st_size / max(index.ntotal, 1), 1)}
+    if LAWYER_INDEX_STORAGE != "float32" or LAWYER_INDEX_PCA:
+        quant[f"recall@{LAWYER_EVAL_K}"] = round(recall_vs_float32(index, emb, eval_queries(model, emb), LAWYER_EVAL_K), 4)
+    print("[*] Storage:", quant)
+
+    # manifest hanya untuk output satu folder (index + meta di direktori yang sama)
+    if LAWYER_INDEX_PATH.parent == LAWYER_META_PATH.parent:
+        version = LAWYER_INDEX_VERSION if LAWYER_INDEX_ROOT else LAWYER_INDEX_PATH.parent.name
+        manifest_path = write_manifest(LAWYER_INDEX_PATH.parent, version, {
+            "embed_model": EMBED_MODEL,
+            "dim": int(dim),
+            "quantization": quant,
+            "counts": {"rows": len(records_out), "vectors": int(index.ntotal)},
+        })
+        print("[*] Manifest:", manifest_path)
+    if LAWYER_INDEX_ROOT:
+        publish_version(Path(LAWYER_INDEX_ROOT), LAWYER_INDEX_VERSION)
+        print(f"[*] Published: {LAWYER_INDEX_ROOT}/CURRENT -> {LAWYER_INDEX_VERSION}")
 
     print("Done.")
     print("Index:", LAWYER_INDEX_PATH)
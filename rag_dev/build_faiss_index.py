@@ -1,4 +1,7 @@
-import os, re, json, argparse, hashlib, sys
+import os, re, json, argparse, hashlib, sys, struct, time, csv, shutil, zlib
+import multiprocessing as mp
+from array import array
+from collections import Counter, deque
 from tqdm import tqdm
 
 try:
@@ -11,75 +14,14 @@ try:
 except Exception:
     print("Install faiss-cpu: pip install faiss-cpu", file=sys.stderr); raise
 
+# Chunking dipakai bersama backend (ingest online) supaya chunk identik
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+from app.services.legal_chunker import chunk_ayats, document_id, to_records
+
 def normalize_ws(s: str) -> str:
     s = re.sub(r"\s+", " ", s).strip()
     return s
 
-def clean_text(s: str) -> str:
-    s = s.replace("\x00", " ")
-    return normalize_ws(s)
-
-def chunk_text(text: str, max_tokens=450, overlap=80):
-    """Whitespace 'token' chunking with overlap. Disable by --no-chunk."""
-    words = text.split()
-    if not words: return []
-    step = max_tokens - overlap
-    chunks = []
-    for i in range(0, len(words), step):
-        chunk = words[i:i+max_tokens]
-        if len(chunk) < 50: break
-        chunks.append(" ".join(chunk))
-    return chunks
-
-def split_legal_blocks(text: str):
-    # Prefer split by "Pasal" for UU/PP/Perma etc.
-    parts = re.split(r"(?=Pasal\s+\d+[A-Za-z]?)", text, flags=re.I)
-    return parts if len(parts) > 1 else [text]
-
-def to_records(obj, do_chunk=True, max_tokens=450, overlap=80):
-    """
-    Accepts flexible schema. Expects at least:
-      - text   (string)  OR  content (string)
-    Optional metadata:
-      - title, url, doc_type, number, year, level, case_number, decision_date, court, subject, source
-    """
-    text = obj.get("text") or obj.get("content") or ""
-    if not isinstance(text, str): text = str(text)
-    text = clean_text(text)
-    if not text: return []
-
-    base_meta = {
-        "title": obj.get("title",""),
-        "url": obj.get("url",""),
-        "doc_type": obj.get("doc_type",""),
-        "number": obj.get("number",""),
-        "year": obj.get("year",""),
-        "level": obj.get("level",""),
-        "case_number": obj.get("case_number",""),
-        "decision_date": obj.get("decision_date",""),
-        "court": obj.get("court",""),
-        "subject": obj.get("subject",""),
-        "source": obj.get("source",""),
-    }
-
-    base_id = obj.get("id") or hashlib.sha1((base_meta["title"] + base_meta["url"] + text[:200]).encode()).hexdigest()
-
-    if not do_chunk:
-        return [{
-            "id": base_id, "chunk_id": "0001", "text": text, **base_meta
-        }]
-
-    # legal-aware split
-    blocks = split_legal_blocks(text)
-    chunks=[]
-    for b in blocks:
-        chunks.extend(chunk_text(b, max_tokens=max_tokens, overlap=overlap))
-
-    recs=[]
-    for i, ch in enumerate(chunks, 1):
-        recs.append({"id": base_id, "chunk_id": f"{i:04d}", "text": ch, **base_meta})
-    return recs
-
 def read_jsonl(jsonl_path, max_docs=0):
     with open(jsonl_path, "r", encoding="utf-8", errors="ignore") as f:
         for i, line in enumerate(f, 1):
@@ -89,69 +31,901 @@ def read_jsonl(jsonl_path, max_docs=0):
             except:
                 yield {"text": line.strip()}
 
-def dedup(records):
-    seen=set(); out=[]
+def apply_delta_log(docs, log_path, merged=None):
+    """
+    Lebur log update online backend (INDEX_DELTA_DIR/<versi>/log.jsonl) ke input:
+    dokumen yang di-upsert menggantikan versi lamanya, yang di-delete dibuang.
+    `merged` diisi {"version", "ts", "entries"} untuk manifest ("delta_log"):
+    backend menolak reload ke versi ini selama log punya entri lebih baru.
+    """
+    latest = {}
+    with open(log_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                latest[str(entry["id"])] = entry
+    if merged is not None:
+        merged.update({"version": os.path.basename(os.path.dirname(os.path.abspath(log_path))),
+                       "ts": max((e.get("ts", 0) for e in latest.values()), default=0),
+                       "entries": len(latest)})
+    for obj in docs:
+        if str(document_id(obj)) not in latest:
+            yield obj
+    for entry in latest.values():
+        if entry["op"] == "upsert":
+            yield entry["doc"]
+
+def iter_records(docs, chunking, tokenizer=None):
+    """Stream record per chunk dari iterator dokumen (tidak ada list korpus di memori)."""
+    for obj in docs:
+        yield from to_records(obj, chunking, tokenizer)
+
+def dedup(records, stats=None):
+    """
+    Buang chunk dengan teks (lowercase) identik, streaming. Yang diingat hanya
+    digest blake2b 8 byte sebagai int per chunk unik, bukan teksnya.
+    """
+    seen = set()
+    for r in records:
+        key = int.from_bytes(hashlib.blake2b(r["text"].lower().encode(), digest_size=8).digest(), "little")
+        if key in seen:
+            if stats is not None: stats["exact"] = stats.get("exact", 0) + 1
+            continue
+        seen.add(key)
+        yield r
+
+# ---------- Near-duplicate (MinHash/LSH) ----------
+_MINHASH_PRIME = (1 << 61) - 1
+
+def lsh_bands(num_perm, threshold):
+    """
+    (bands, rows) dengan bands*rows = num_perm. Dipilih threshold LSH
+    (1/bands)^(1/rows) tertinggi yang masih <= `threshold`, agar pasangan
+    di atas threshold hampir pasti jadi kandidat; kandidat lalu dicek dengan
+    estimasi Jaccard penuh.
+    """
+    best = (num_perm, 1)
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows == 0 and (rows / num_perm) ** (1 / rows) <= threshold:
+            best = (num_perm // rows, rows)
+    return best
+
+class NearDupFilter:
+    """
+    Deteksi chunk hampir identik (estimasi Jaccard shingle kata >= threshold)
+    dengan MinHash + LSH banding. Chunk pertama dari satu klaster dipakai
+    sebagai representatif; chunk berikutnya yang mirip dengannya dibuang.
+    Yang disimpan per chunk yang lolos: signature num_perm x uint32 dan
+    satu entri bucket per band.
+    """
+
+    def __init__(self, threshold=0.9, num_perm=64, shingle=3, seed=0):
+        self.threshold, self.num_perm, self.shingle = threshold, num_perm, shingle
+        self.bands, self.rows = lsh_bands(num_perm, threshold)
+        rng = np.random.default_rng(seed)
+        # a*h + b < 2^63 untuk h < 2^32, jadi tidak overflow di uint64
+        self.a = rng.integers(1, 1 << 31, size=num_perm, dtype="uint64")[:, None]
+        self.b = rng.integers(0, 1 << 31, size=num_perm, dtype="uint64")[:, None]
+        self.buckets = [{} for _ in range(self.bands)]
+        self.sigs = array("I")
+        self.kept = 0
+
+    def shingles(self, text):
+        """Hash 32-bit shingle `shingle` kata berurutan (unik)."""
+        words = re.findall(r"\w+", text.lower())
+        w = np.fromiter((zlib.crc32(x.encode()) for x in words), dtype="uint64", count=len(words))
+        if len(w) <= self.shingle:  # chunk pendek: satu shingle berisi seluruh kata
+            return np.array([zlib.crc32(" ".join(words).encode())] if words else [], dtype="uint64")
+        n = len(w) - self.shingle + 1
+        h = np.zeros(n, dtype="uint64")
+        for j in range(self.shingle):
+            h = (h * np.uint64(1000003) + w[j:j + n]) & np.uint64(0xFFFFFFFF)
+        return np.unique(h)
+
+    def signature(self, text):
+        h = self.shingles(text)
+        if not len(h):
+            return np.zeros(self.num_perm, dtype="uint32")
+        return ((self.a * h[None, :] + self.b) % np.uint64(_MINHASH_PRIME)).min(axis=1).astype("uint32")
+
+    def _signature_of(self, i):
+        lo = i * self.num_perm
+        return np.frombuffer(self.sigs, dtype="uint32")[lo:lo + self.num_perm]
+
+    def is_duplicate(self, text):
+        """True jika mirip chunk yang sudah lolos; jika tidak, chunk didaftarkan."""
+        sig = self.signature(text)
+        keys = [hash(sig[i * self.rows:(i + 1) * self.rows].tobytes()) for i in range(self.bands)]
+        for band, key in zip(self.buckets, keys):
+            cand = band.get(key)
+            if cand is not None and np.mean(self._signature_of(cand) == sig) >= self.threshold:
+                return True
+        for band, key in zip(self.buckets, keys):
+            band.setdefault(key, self.kept)
+        self.sigs.extend(sig.tolist())
+        self.kept += 1
+        return False
+
+def near_dedup(records, threshold, num_perm=64, stats=None):
+    """Filter streaming NearDupFilter; jumlah chunk yang dibuang dicatat di stats["near"]."""
+    f = NearDupFilter(threshold, num_perm)
+    if stats is not None:
+        stats.update({"near": 0, "threshold": threshold, "num_perm": num_perm,
+                      "bands": f.bands, "rows_per_band": f.rows})
+    for r in records:
+        if f.is_duplicate(r["text"]):
+            if stats is not None: stats["near"] += 1
+            continue
+        yield r
+
+META_COLUMNS = ["id", "chunk_id", "text", "pasal", "title", "url", "doc_type", "number", "year",
+                "level", "case_number", "decision_date", "court", "subject", "source"]
+
+class ColumnarMetaWriter:
+    """
+    Metadata kolom yang dibaca lazy oleh backend (app/services/meta_store.py):
+      meta/columns.json  {"format": 1, "rows": N, "columns": [...]}
+      meta/<col>.off     offset uint64 little-endian (N+1)
+      meta/<col>.heap    nilai JSON UTF-8 per baris, disambung
+    """
+    FORMAT = 1
+
+    def __init__(self, out_dir, columns, subdir="meta"):
+        self.dir = os.path.join(out_dir, subdir)
+        os.makedirs(self.dir, exist_ok=True)
+        self.columns = list(columns)
+        self.rows = 0
+        self.pos = {c: 0 for c in self.columns}
+        self.heap = {c: open(os.path.join(self.dir, f"{c}.heap"), "wb") for c in self.columns}
+        self.off = {c: open(os.path.join(self.dir, f"{c}.off"), "wb") for c in self.columns}
+        for c in self.columns:
+            self.off[c].write(struct.pack("<Q", 0))
+
+    def append(self, rec):
+        for c in self.columns:
+            b = json.dumps(rec.get(c), ensure_ascii=False).encode("utf-8")
+            self.heap[c].write(b)
+            self.pos[c] += len(b)
+            self.off[c].write(struct.pack("<Q", self.pos[c]))
+        self.rows += 1
+
+    def close(self):
+        for c in self.columns:
+            self.heap[c].close(); self.off[c].close()
+        with open(os.path.join(self.dir, "columns.json"), "w", encoding="utf-8") as f:
+            json.dump({"format": self.FORMAT, "rows": self.rows, "columns": self.columns}, f)
+
+class ColumnReader:
+    """Baca balik satu kolom meta/ (offset di-memmap, heap dibaca per rentang row)."""
+
+    def __init__(self, meta_dir, column):
+        self.off = np.memmap(os.path.join(meta_dir, f"{column}.off"), dtype="<u8", mode="r")
+        self.heap = open(os.path.join(meta_dir, f"{column}.heap"), "rb")
+
+    def __len__(self):
+        return len(self.off) - 1
+
+    def _value(self, start, end):
+        self.heap.seek(start)
+        return json.loads(self.heap.read(end - start))
+
+    def slice(self, lo, hi):
+        """Nilai row [lo, hi) dengan satu read heap."""
+        off = self.off[lo:hi + 1].astype("int64")
+        self.heap.seek(int(off[0]))
+        buf = self.heap.read(int(off[-1] - off[0]))
+        rel = off - off[0]
+        return [json.loads(buf[rel[i]:rel[i + 1]]) for i in range(hi - lo)]
+
+    def take(self, rows):
+        return [self._value(int(self.off[r]), int(self.off[r + 1])) for r in rows]
+
+    def close(self):
+        self.heap.close()
+
+def write_corpus(records, out_dir, also_jsonl=False, parents=False):
+    """
+    Satu pass streaming atas record (sudah di-dedup): metadata kolom, postings
+    BM25 dan pasal index ditulis bersamaan, row id = urutan record. Record tidak
+    disimpan; teks untuk embedding dibaca ulang dari meta/text.* (ColumnReader).
+    Dengan `parents`, teks parent (chunker token) ditulis sekali ke parents/
+    dan kolom meta "parent" berisi row parent (null jika chunk = seluruh parent).
+    """
+    writer = ColumnarMetaWriter(out_dir, META_COLUMNS + (["parent"] if parents else []))
+    parent_writer = ColumnarMetaWriter(out_dir, ["id", "text"], subdir="parents") if parents else None
+    sparse = SparseIndexBuilder()
+    pasal = PasalIndexBuilder()
+    jf = open(os.path.join(out_dir, "metadata.jsonl"), "w", encoding="utf-8") if also_jsonl else None
+    last_parent = None
     for r in records:
-        key = hashlib.sha1(r["text"].lower().encode()).hexdigest()
-        if key in seen: continue
-        seen.add(key); out.append(r)
-    return out
-
-def build_embeddings(records, model_name):
-    model = SentenceTransformer(model_name)
-    texts = [r["text"] for r in records]
-    embs = model.encode(texts, batch_size=64, show_progress_bar=True, normalize_embeddings=True)
-    return np.asarray(embs, dtype="float32")
-
-def build_faiss(embs, out_path):
-    dim = embs.shape[1]
-    index = faiss.IndexFlatIP(dim)  # cosine if embeddings normalized
-    index.add(embs)
+        parent_text = r.pop("parent_text", None)
+        if parent_writer is not None and parent_text is not None:
+            # chunk satu parent berurutan dan berbagi objek string yang sama
+            if parent_text is not last_parent:
+                parent_writer.append({"id": r["id"], "text": parent_text})
+                last_parent = parent_text
+            r["parent"] = parent_writer.rows - 1
+        row = writer.rows
+        writer.append(r)
+        sparse.add(r["text"])
+        pasal.add(row, r)
+        if jf: jf.write(json.dumps(r, ensure_ascii=False) + "\n")
+    writer.close()
+    if parent_writer is not None: parent_writer.close()
+    if jf: jf.close()
+    return {"rows": writer.rows, "meta": writer.dir, "parents": parent_writer.rows if parent_writer else 0,
+            "sparse": sparse.finish(out_dir), "pasal": pasal.finish(out_dir)}
+
+# ---------- Sparse (BM25) index ----------
+# Tokenizer disimpan di sparse/config.json supaya backend (app/services/sparse_index.py)
+# men-tokenisasi query persis sama dengan saat build.
+BM25_TOKEN_PATTERN = r"\d+[a-z]?|[a-z]+"
+BM25_STRIP_SUFFIXES = ["nya", "lah", "kah", "pun"]
+BM25_STOPWORDS = sorted(set("""
+ada adalah agar akan aku anda antara apa apabila atas atau bagaimana bagi bahwa
+banyak beberapa begitu belum berapa bisa boleh bukan dalam dan dapat dari demikian
+dengan di dia dilakukan ia ialah ini itu jadi jika juga kalau kami kamu karena ke
+kepada ketika kita lain lagi maka masih mereka mungkin namun oleh pada para saat
+saja sama sampai sang saya se sebagai sebuah secara sedang sehingga sejak selain
+seperti serta setiap sudah supaya tanpa telah tentang tersebut tetapi tidak untuk
+wajib yaitu yakni yang
+""".split()))
+
+def bm25_tokenize(text, stopwords):
+    toks = []
+    for t in re.findall(BM25_TOKEN_PATTERN, text.lower()):
+        if len(t) > 5:
+            for suf in BM25_STRIP_SUFFIXES:
+                if t.endswith(suf):
+                    t = t[:-len(suf)]
+                    break
+        if t not in stopwords:
+            toks.append(t)
+    return toks
+
+class SparseIndexBuilder:
+    """
+    Postings BM25 bentuk CSR, di-mmap oleh backend:
+      sparse/term_offsets.npy  int64 (V+1)   -> posting term t = [off[t], off[t+1])
+      sparse/doc_ids.npy       int32         -> row id chunk (sama dengan FAISS id)
+      sparse/weights.npy       float32       -> bobot tf BM25 (sudah termasuk norm. panjang dok.)
+      sparse/idf.npy           float32 (V)
+      sparse/vocab.json, sparse/config.json
+    add() dipanggil per chunk sesuai urutan row; postings disimpan di array int32.
+    """
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1, self.b = k1, b
+        self.stop = set(BM25_STOPWORDS)
+        self.vocab, self.post_docs, self.post_tfs, self.doc_len = {}, [], [], array("i")
+
+    def add(self, text):
+        doc_id = len(self.doc_len)
+        toks = bm25_tokenize(text, self.stop)
+        self.doc_len.append(len(toks))
+        for term, tf in Counter(toks).items():
+            tid = self.vocab.setdefault(term, len(self.vocab))
+            if tid == len(self.post_docs):
+                self.post_docs.append(array("i")); self.post_tfs.append(array("i"))
+            self.post_docs[tid].append(doc_id); self.post_tfs[tid].append(tf)
+
+    def finish(self, out_dir):
+        sparse_dir = os.path.join(out_dir, "sparse")
+        os.makedirs(sparse_dir, exist_ok=True)
+        k1, b, vocab = self.k1, self.b, self.vocab
+        n_docs = len(self.doc_len)
+        dl = np.frombuffer(self.doc_len, dtype=np.int32).astype("float32")
+        avgdl = float(dl.mean()) if n_docs else 0.0
+        df = np.array([len(p) for p in self.post_docs], dtype="int64")
+        offsets = np.zeros(len(vocab) + 1, dtype="int64")
+        np.cumsum(df, out=offsets[1:])
+
+        doc_ids = np.empty(int(offsets[-1]), dtype="int32")
+        weights = np.empty(int(offsets[-1]), dtype="float32")
+        for tid in range(len(vocab)):
+            lo, hi = offsets[tid], offsets[tid + 1]
+            d = np.frombuffer(self.post_docs[tid], dtype=np.int32)
+            tf = np.frombuffer(self.post_tfs[tid], dtype=np.int32).astype("float32")
+            doc_ids[lo:hi] = d
+            weights[lo:hi] = tf * (k1 + 1) / (tf + k1 * (1 - b + b * dl[d] / max(avgdl, 1e-9)))
+            self.post_docs[tid] = self.post_tfs[tid] = None  # lepas array per term setelah disalin
+        idf = np.log(1 + (n_docs - df + 0.5) / (df + 0.5)).astype("float32")
+
+        np.save(os.path.join(sparse_dir, "term_offsets.npy"), offsets)
+        np.save(os.path.join(sparse_dir, "doc_ids.npy"), doc_ids)
+        np.save(os.path.join(sparse_dir, "weights.npy"), weights)
+        np.save(os.path.join(sparse_dir, "idf.npy"), idf)
+        with open(os.path.join(sparse_dir, "vocab.json"), "w", encoding="utf-8") as f:
+            json.dump(vocab, f, ensure_ascii=False)
+        with open(os.path.join(sparse_dir, "config.json"), "w", encoding="utf-8") as f:
+            json.dump({"format": 1, "n_docs": n_docs, "avgdl": avgdl, "k1": k1, "b": b,
+                       "token_pattern": BM25_TOKEN_PATTERN, "strip_suffixes": BM25_STRIP_SUFFIXES,
+                       "stopwords": BM25_STOPWORDS}, f, ensure_ascii=False)
+        return sparse_dir, len(vocab), int(offsets[-1])
+
+# ---------- Pasal lookup index ----------
+# Singkatan undang-undang -> kunci statuta (hanya yang ada di korpus yang disimpan)
+STATUTE_ALIASES = {"kuhp": "kuhp", "kuhap": "kuhap", "tpks": "uu-12-2022",
+                   "tppu": "uu-8-2010", "sppa": "uu-11-2012"}
+STATUTE_PATTERN = (r"\b(uu|undang-undang|perppu|perpu|pp|perpres|perma)\s+"
+                   r"(?:nomor|no\.?)?\s*(\d+)\s*(?:tahun|thn\.?|/)\s*(\d{4})")
+
+def statute_key(title: str):
+    """'KUHP' -> 'kuhp', 'Salinan UU Nomor 8 Thn.2010' -> 'uu-8-2010'."""
+    t = (title or "").lower()
+    m = re.search(STATUTE_PATTERN, t)
+    if m:
+        kind = {"undang-undang": "uu", "perppu": "perpu"}.get(m.group(1), m.group(1))
+        return f"{kind}-{int(m.group(2))}-{m.group(3)}"
+    for word in re.findall(r"[a-z]+", t):
+        if word in STATUTE_ALIASES:
+            return STATUTE_ALIASES[word]
+    return None
+
+class PasalIndexBuilder:
+    """
+    pasal_index.json: "statuta|pasal" dan "statuta|pasal|ayat" -> row id chunk.
+    Dipakai rag_engine untuk menjawab rujukan eksplisit ("Pasal 187 KUHP")
+    tanpa pencarian vektor.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.statutes = set()
+
+    def add(self, row, r):
+        key = statute_key(r.get("title", ""))
+        if not key or not r.get("pasal"):
+            return
+        self.statutes.add(key)
+        base = f"{key}|{r['pasal'].lower()}"
+        self.entries.setdefault(base, []).append(row)
+        for ayat in chunk_ayats(r["text"]):
+            self.entries.setdefault(f"{base}|{ayat}", []).append(row)
+
+    def finish(self, out_dir):
+        path = os.path.join(out_dir, "pasal_index.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"format": 1, "statute_pattern": STATUTE_PATTERN,
+                       "aliases": {a: k for a, k in STATUTE_ALIASES.items() if k in self.statutes},
+                       "entries": self.entries}, f, ensure_ascii=False)
+        return path, len(self.statutes), len(self.entries)
+
+# ---------- Embedding cache ----------
+class EmbeddingCache:
+    """
+    Cache embedding persisten, dialamatkan dengan isi chunk (per model):
+      <cache>/<model>/vectors.f32  float32 (rows, dim), di-memmap saat dibaca
+      <cache>/<model>/keys.bin     blake2b-16 dari (model, teks chunk), sejajar vectors
+      <cache>/<model>/cache.json   {"format": 1, "model", "dim", "rows"}
+    Baris hanya ditambahkan (append); "rows" ditulis terakhir sehingga sisa
+    tulisan yang terputus diabaikan saat dibaca.
+    """
+    KEY_BYTES = 16
+
+    def __init__(self, cache_dir, model_name):
+        self.model_name = model_name
+        self.dir = os.path.join(cache_dir, re.sub(r"[^A-Za-z0-9_.-]+", "__", model_name))
+        os.makedirs(self.dir, exist_ok=True)
+        self.vec_path = os.path.join(self.dir, "vectors.f32")
+        self.key_path = os.path.join(self.dir, "keys.bin")
+        self.cfg_path = os.path.join(self.dir, "cache.json")
+        self.dim, self.rows = None, 0
+        if os.path.exists(self.cfg_path):
+            with open(self.cfg_path, "r", encoding="utf-8") as f:
+                cfg = json.load(f)
+            if cfg.get("format") != 1 or cfg.get("model") != model_name:
+                raise RuntimeError(f"embedding cache {self.dir} does not belong to {model_name}")
+            self.dim, self.rows = int(cfg["dim"]), int(cfg["rows"])
+        self.index = {}
+        if self.rows:
+            with open(self.key_path, "rb") as f:
+                keys = f.read(self.rows * self.KEY_BYTES)
+            for i in range(self.rows):
+                self.index[keys[i * self.KEY_BYTES:(i + 1) * self.KEY_BYTES]] = i
+
+    def key(self, text):
+        h = hashlib.blake2b(digest_size=self.KEY_BYTES)
+        h.update(self.model_name.encode("utf-8") + b"\0" + normalize_ws(text).encode("utf-8"))
+        return h.digest()
+
+    def vectors(self):
+        if not self.rows:
+            return np.empty((0, self.dim or 0), dtype="float32")
+        return np.memmap(self.vec_path, dtype="float32", mode="r", shape=(self.rows, self.dim))
+
+    def append(self, keys, embs):
+        if self.dim is None:
+            self.dim = int(embs.shape[1])
+        for path in (self.vec_path, self.key_path):
+            if os.path.exists(path):  # buang sisa tulisan yang terputus
+                size = self.rows * (self.dim * 4 if path == self.vec_path else self.KEY_BYTES)
+                with open(path, "r+b") as f:
+                    f.truncate(size)
+        with open(self.vec_path, "ab") as f:
+            f.write(np.ascontiguousarray(embs, dtype="float32").tobytes())
+        with open(self.key_path, "ab") as f:
+            f.write(b"".join(keys))
+        for k in keys:
+            self.index[k] = self.rows
+            self.rows += 1
+        tmp = self.cfg_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"format": 1, "model": self.model_name, "dim": self.dim, "rows": self.rows}, f)
+        os.replace(tmp, self.cfg_path)
+
+# ---------- Sharded encoding ----------
+_encoders = {}
+
+def load_encoder(model_name):
+    """Model encoder di proses utama (tokenizer chunker, encode tanpa shard, query eval), di-load sekali."""
+    if model_name not in _encoders:
+        _encoders[model_name] = SentenceTransformer(model_name)
+    return _encoders[model_name]
+
+def encoder_chunk_limit(model):
+    """Token isi maksimum per chunk: max_seq_length encoder dikurangi token spesial (CLS/SEP)."""
+    return int(model.max_seq_length) - model.tokenizer.num_special_tokens_to_add()
+
+_worker_model = None
+
+def _worker_encoder(model_name, threads):
+    """
+    Model encoder per proses, di-load saat task pertama (bukan di initializer
+    Pool: initializer yang gagal membuat Pool terus me-respawn worker dan build
+    menggantung). Error load ikut naik lewat task sehingga build berhenti.
+    """
+    global _worker_model
+    if _worker_model is None:
+        for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+            os.environ[var] = str(threads)
+        import torch
+        torch.set_num_threads(threads)
+        _worker_model = SentenceTransformer(model_name)
+    return _worker_model
+
+def _encode_shard(task):
+    shard, texts, path, model_name, threads = task
+    model = _worker_encoder(model_name, threads)
+    embs = model.encode(texts, batch_size=64, show_progress_bar=False, normalize_embeddings=True)
+    tmp = path + ".tmp.npy"
+    np.save(tmp, np.asarray(embs, dtype="float32"))
+    os.replace(tmp, path)  # shard dianggap selesai hanya jika file .npy utuh
+    return shard
+
+# Baris per blok saat menyalin / menambah vektor dari memmap (~100 MB untuk dim 384)
+VECTOR_BLOCK = 65536
+
+def _write_rows(f, embs):
+    f.write(np.ascontiguousarray(embs, dtype="float32").tobytes())
+
+def open_vectors(path, n):
+    """Memmap float32 (n, dim) dari file mentah; dim dihitung dari ukuran file."""
+    if not n:
+        return np.empty((0, 0), dtype="float32")
+    return np.memmap(path, dtype="float32", mode="r", shape=(n, os.path.getsize(path) // (4 * n)))
+
+def encode_texts(get_texts, n, model_name, out_path, workers=1, threads=0, shard_size=4096, shard_dir=""):
+    """
+    Encode n teks (`get_texts(lo, hi)` -> list teks row [lo, hi)) ke file float32
+    mentah out_path, dikembalikan sebagai memmap (n, dim). Per shard (`shard_size`
+    teks) dengan `workers` proses; setiap shard disimpan ke shard_dir/shard-NNNNN.npy
+    dan jika build terputus, shard yang sudah ada dipakai ulang selama daftar teks &
+    model sama (shards.json). Teks dibaca per shard, paling banyak 2*workers shard
+    yang sedang diproses sekaligus.
+    """
+    if n <= shard_size and workers <= 1:
+        model = load_encoder(model_name)
+        with open(out_path, "wb") as f:
+            if n:
+                _write_rows(f, model.encode(get_texts(0, n), batch_size=64, show_progress_bar=True,
+                                            normalize_embeddings=True))
+        return open_vectors(out_path, n)
+
+    n_shards = (n + shard_size - 1) // shard_size
+    h = hashlib.blake2b(digest_size=16)
+    h.update(model_name.encode("utf-8"))
+    for i in range(n_shards):
+        for t in get_texts(i * shard_size, min(n, (i + 1) * shard_size)):
+            h.update(b"\0" + t.encode("utf-8"))
+    spec = {"format": 1, "model": model_name, "texts": n, "shard_size": shard_size,
+            "digest": h.hexdigest()}
+    spec_path = os.path.join(shard_dir, "shards.json")
+    if os.path.exists(spec_path):
+        with open(spec_path, "r", encoding="utf-8") as f:
+            if json.load(f) != spec:
+                print(f"[shards] {shard_dir} berisi shard untuk input lain, dihapus")
+                shutil.rmtree(shard_dir)
+    os.makedirs(shard_dir, exist_ok=True)
+    with open(spec_path, "w", encoding="utf-8") as f:
+        json.dump(spec, f)
+
+    paths = [os.path.join(shard_dir, f"shard-{i:05d}.npy") for i in range(n_shards)]
+    pending = [i for i in range(n_shards) if not os.path.exists(paths[i])]
+    print(f"[shards] {n_shards - len(pending)}/{n_shards} shard sudah ada, {len(pending)} di-encode "
+          f"dengan {workers} proses")
+    threads = threads or max(1, (os.cpu_count() or 1) // max(workers, 1))
+    tasks = ((i, get_texts(i * shard_size, min(n, (i + 1) * shard_size)), paths[i], model_name, threads)
+             for i in pending)
+
+    if pending:
+        if workers <= 1:
+            for task in tqdm(tasks, total=len(pending), desc="Encoding shards"):
+                _encode_shard(task)
+        else:
+            # spawn: fork setelah torch di-load bisa deadlock pada thread pool OpenMP
+            ctx = mp.get_context("spawn")
+            # Pool.imap membaca seluruh iterator task sekaligus; apply_async + antrean
+            # terbatas menjaga teks shard yang menunggu tetap <= 2*workers
+            inflight = deque()
+            with ctx.Pool(workers) as pool, \
+                    tqdm(total=len(pending), desc="Encoding shards") as bar:
+                for task in tasks:
+                    inflight.append(pool.apply_async(_encode_shard, (task,)))
+                    if len(inflight) >= 2 * workers:
+                        inflight.popleft().get(); bar.update()
+                while inflight:
+                    inflight.popleft().get(); bar.update()
+
+    with open(out_path, "wb") as f:
+        for p in paths:
+            _write_rows(f, np.load(p))
+    shutil.rmtree(shard_dir)
+    return open_vectors(out_path, n)
+
+def build_embeddings(texts, model_name, out_path, cache_dir="", **encode_opts):
+    """
+    Embedding ter-normalisasi untuk setiap chunk di `texts` (ColumnReader kolom
+    text), ditulis ke out_path (float32 mentah) dan dikembalikan sebagai memmap.
+    Dengan cache_dir, hanya chunk yang belum ada di cache (cache miss) yang
+    di-encode. `encode_opts` diteruskan ke encode_texts (workers, threads,
+    shard_size, shard_dir). -> (embs, stats)
+    """
+    n = len(texts)
+    if not cache_dir:
+        return encode_texts(texts.slice, n, model_name, out_path, **encode_opts), {"hits": 0, "misses": n}
+
+    cache = EmbeddingCache(cache_dir, model_name)
+    # row cache per chunk; miss ke-j dicatat sebagai -(j+1) sampai vektornya masuk cache.
+    # Teks identik dalam satu run cukup di-encode sekali.
+    rows = np.empty(n, dtype="int64")
+    miss_of, miss_first = {}, array("q")
+    for lo in range(0, n, VECTOR_BLOCK):
+        for i, t in enumerate(texts.slice(lo, min(n, lo + VECTOR_BLOCK)), lo):
+            k = cache.key(t)
+            row = cache.index.get(k)
+            if row is None:
+                row = -1 - miss_of.setdefault(k, len(miss_of))
+                if -row > len(miss_first):
+                    miss_first.append(i)
+            rows[i] = row
+    miss = rows < 0
+    stats = {"hits": int(n - miss.sum()), "misses": int(miss.sum()), "encoded": len(miss_of)}
+
+    if miss_of:
+        tmp_path = out_path + ".miss"
+        first = np.frombuffer(miss_first, dtype="int64")
+        new = encode_texts(lambda lo, hi: texts.take(first[lo:hi]), len(first),
+                           model_name, tmp_path, **encode_opts)
+        miss_keys = list(miss_of)
+        for lo in range(0, len(miss_keys), VECTOR_BLOCK):
+            cache.append(miss_keys[lo:lo + VECTOR_BLOCK], new[lo:lo + VECTOR_BLOCK])
+        del new
+        os.remove(tmp_path)
+        cache_rows = np.fromiter((cache.index[k] for k in miss_keys), dtype="int64", count=len(miss_keys))
+        rows[miss] = cache_rows[-1 - rows[miss]]
+
+    vectors = cache.vectors()
+    with open(out_path, "wb") as f:
+        for lo in range(0, n, VECTOR_BLOCK):
+            _write_rows(f, vectors[rows[lo:lo + VECTOR_BLOCK]])
+    stats["cache_rows"] = cache.rows
+    return open_vectors(out_path, n), stats
+
+# Pertanyaan benchmark default untuk cek recall saat --storage/--pca dipakai tanpa --eval-csv
+BENCHMARK_QUESTIONS = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                   "..", "benchmark", "qwen_generations.csv"))
+
+# Kode penyimpanan vektor per --storage (SQ = scalar quantizer FAISS)
+STORAGE_CODES = {"float32": "Flat", "float16": "SQfp16", "int8": "SQ8"}
+
+def index_factory_string(args, n, dim):
+    """
+    Pilih tipe index FAISS. nlist default ~4*sqrt(N) (min 1, maks N/39 agar training cukup).
+    --storage float16/int8 menyimpan vektor sebagai scalar quantizer (2x/4x lebih kecil);
+    --pca D mereduksi dimensi dulu (PCA lalu normalisasi ulang, agar inner product tetap cosine).
+    """
+    storage, pca = args.storage, args.pca
+    if pca and not 0 < pca < dim:
+        raise SystemExit(f"--pca {pca} must be between 1 and embedding dim {dim}")
+    prefix = f"PCA{pca},L2norm," if pca else ""
+    dim = pca or dim
+    code = STORAGE_CODES[storage]
+    if args.index_type == "flat":
+        return prefix + code
+    nlist = args.nlist or max(1, min(int(4 * np.sqrt(n)), n // 39 or 1))
+    if args.index_type == "ivf-flat":
+        return f"{prefix}IVF{nlist},{code}"
+    if args.index_type == "ivf-pq":
+        if storage != "float32":
+            raise SystemExit("--storage applies to flat/ivf-flat/hnsw; ivf-pq is already compressed")
+        if dim % args.pq_m:
+            raise SystemExit(f"--pq-m {args.pq_m} must divide embedding dim {dim}")
+        return f"{prefix}IVF{nlist},PQ{args.pq_m}x{args.pq_nbits}"
+    if args.index_type == "hnsw":
+        return f"{prefix}HNSW{args.hnsw_m}" + ("" if storage == "float32" else f",{code}")
+    raise SystemExit(f"unknown --index-type {args.index_type}")
+
+def search_params(args):
+    """Parameter saat query; disimpan di index_params.json & dipakai rag_engine.search."""
+    if args.index_type in ("ivf-flat", "ivf-pq"):
+        return {"nprobe": args.nprobe}
+    if args.index_type == "hnsw":
+        return {"efSearch": args.ef_search}
+    return {}
+
+def apply_search_params(index, params):
+    ps = faiss.ParameterSpace()
+    for name, value in params.items():
+        ps.set_index_parameter(index, name, value)
+
+def build_faiss(embs, out_path, args=None):
+    n, dim = embs.shape
+    factory = index_factory_string(args, n, dim) if args else "Flat"
+    index = faiss.index_factory(dim, factory, faiss.METRIC_INNER_PRODUCT)  # cosine if embeddings normalized
+    # index di balik PCA (IndexPreTransform) untuk setelan HNSW/IVF
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexPreTransform) else index
+
+    if hasattr(inner, "hnsw"):
+        inner.hnsw.efConstruction = args.ef_construction
+    if not index.is_trained:
+        ivf = faiss.try_extract_index_ivf(index)
+        # PCA / scalar quantizer tanpa IVF cukup dilatih dengan sampel
+        sample = args.train_sample or min(n, 256 * ivf.nlist if ivf is not None else 65536)
+        rng = np.random.default_rng(0)
+        train = np.asarray(embs[np.sort(rng.choice(n, size=min(sample, n), replace=False))])
+        print(f"training {factory} on {len(train)} vectors")
+        index.train(train)
+        del train
+    for lo in tqdm(range(0, n, VECTOR_BLOCK), desc="Index add"):
+        index.add(np.ascontiguousarray(embs[lo:lo + VECTOR_BLOCK]))
     faiss.write_index(index, out_path)
+
+    params = search_params(args) if args else {}
+    apply_search_params(index, params)
+    with open(os.path.join(os.path.dirname(out_path), "index_params.json"), "w", encoding="utf-8") as f:
+        json.dump({"index_type": args.index_type if args else "flat", "factory": factory,
+                   "metric": "inner_product", "dim": dim, "ntotal": int(index.ntotal),
+                   "storage": getattr(args, "storage", "float32"), "pca": getattr(args, "pca", 0),
+                   "search": params}, f, indent=2)
     return index
 
+def load_eval_queries(args, embs, model_name):
+    """Query evaluasi: pertanyaan benchmark (--eval-csv) atau sampel vektor chunk."""
+    if args.eval_csv:
+        with open(args.eval_csv, "r", encoding="utf-8") as f:
+            questions = [row["question"] for row in csv.DictReader(f) if row.get("question")]
+        model = load_encoder(model_name)
+        return np.asarray(model.encode(questions, batch_size=64, normalize_embeddings=True), dtype="float32")
+    rng = np.random.default_rng(1)
+    return np.asarray(embs[rng.choice(len(embs), size=min(args.eval_sample, len(embs)), replace=False)])
+
+def _timed_search(index, queries, k):
+    lat, ids = [], []
+    for q in queries:
+        t = time.perf_counter()
+        _, I = index.search(q[None, :], k)
+        lat.append((time.perf_counter() - t) * 1000)
+        ids.append(I[0])
+    return np.array(ids), np.array(lat)
+
+def _exact_search(embs, queries, k):
+    """
+    Exact inner-product top-k per blok memmap (tanpa IndexFlat berisi seluruh
+    vektor). Latency per query = jumlah waktu brute-force query itu di semua blok.
+    """
+    heap = faiss.ResultHeap(len(queries), k, keep_max=True)
+    lat = np.zeros(len(queries))
+    for lo in range(0, len(embs), VECTOR_BLOCK):
+        block = np.ascontiguousarray(embs[lo:lo + VECTOR_BLOCK])
+        kb = min(k, len(block))
+        D = np.empty((len(queries), kb), dtype="float32")
+        I = np.empty((len(queries), kb), dtype="int64")
+        for qi in range(len(queries)):
+            t = time.perf_counter()
+            D[qi], I[qi] = faiss.knn(queries[qi:qi + 1], block, kb, metric=faiss.METRIC_INNER_PRODUCT)
+            lat[qi] += (time.perf_counter() - t) * 1000
+        heap.add_result(D, I + lo)
+    heap.finalize()
+    return heap.I, lat
+
+def evaluate_index(index, embs, queries, k):
+    """
+    recall@k terhadap exact flat search atas embedding float32 asli (baseline
+    untuk --storage/--pca/ANN) + latency p50/p99 per query (ms).
+    """
+    gt, flat_lat = _exact_search(embs, queries, k)
+    ann, ann_lat = _timed_search(index, queries, k)
+    recall = np.mean([len(set(a) & set(g)) / k for a, g in zip(ann, gt)])
+    return {
+        "queries": int(len(queries)), "k": k,
+        f"recall@{k}": round(float(recall), 4),
+        "flat_p50_ms": round(float(np.percentile(flat_lat, 50)), 3),
+        "flat_p99_ms": round(float(np.percentile(flat_lat, 99)), 3),
+        "index_p50_ms": round(float(np.percentile(ann_lat, 50)), 3),
+        "index_p99_ms": round(float(np.percentile(ann_lat, 99)), 3),
+    }
+
+MANIFEST_FORMAT = 1
+
+def _sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def write_manifest(out_dir, version, info):
+    """
+    manifest.json dibaca backend (app/services/index_versions.py) untuk validasi
+    sebelum hot reload: ukuran + sha256 setiap file, model embedding, dll.
+    """
+    files = {}
+    for dirpath, _, names in os.walk(out_dir):
+        for name in sorted(names):
+            path = os.path.join(dirpath, name)
+            rel = os.path.relpath(path, out_dir).replace(os.sep, "/")
+            if rel == "manifest.json":
+                continue
+            files[rel] = {"size": os.path.getsize(path), "sha256": _sha256(path)}
+    manifest = {"format": MANIFEST_FORMAT, "version": version,
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"), **info, "files": files}
+    path = os.path.join(out_dir, "manifest.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return path
+
+def publish_version(index_root, version):
+    """Arahkan <root>/CURRENT ke versi baru (rename atomik; backend me-reload via watcher/admin)."""
+    tmp = os.path.join(index_root, f".CURRENT.{os.getpid()}")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(version + "\n")
+    os.replace(tmp, os.path.join(index_root, "CURRENT"))
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--jsonl", required=True, help="Path to UU_docs.jsonl")
-    ap.add_argument("--out-dir", required=True, help="Where to save index & metadata")
+    ap.add_argument("--out-dir", default="", help="Where to save index & metadata")
+    ap.add_argument("--index-root", default="", help="versioned root: build into <root>/<version>, then update <root>/CURRENT")
+    ap.add_argument("--version", default="", help="version name under --index-root (default: timestamp)")
+    ap.add_argument("--no-publish", action="store_true", help="with --index-root: build the version but leave CURRENT as is")
     ap.add_argument("--embed-model", default="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
     ap.add_argument("--max-docs", type=int, default=0, help="limit for quick test")
     ap.add_argument("--no-chunk", action="store_true", help="store whole doc as one chunk")
-    ap.add_argument("--max-tokens", type=int, default=450)
-    ap.add_argument("--overlap", type=int, default=80)
+    ap.add_argument("--chunker", choices=["tokens", "words"], default="words",
+                    help="words (default): whitespace windows as before; "
+                         "tokens: chunks sized by the encoder tokenizer, with parent windows")
+    ap.add_argument("--max-tokens", type=int, default=450, help="words per chunk (words) / per parent window (tokens)")
+    ap.add_argument("--overlap", type=int, default=80, help="word overlap (words chunker)")
+    ap.add_argument("--chunk-tokens", type=int, default=0, help="encoder tokens per chunk (0 = max_seq_length minus special tokens)")
+    ap.add_argument("--chunk-overlap-tokens", type=int, default=16)
+    ap.add_argument("--no-parent-chunks", action="store_true", help="tokens chunker: do not store parent windows for the LLM context")
+    ap.add_argument("--near-dup", type=float, default=0.0,
+                    help="drop chunks whose MinHash Jaccard with an earlier chunk is >= this, e.g. 0.9 "
+                         "(default 0 = exact dedup only, same chunk set as before)")
+    ap.add_argument("--minhash-perm", type=int, default=64, help="MinHash permutations for --near-dup")
+    ap.add_argument("--delta-log", default="", help="merge a backend online-update log (index_delta/<version>/log.jsonl)")
+    ap.add_argument("--embed-cache", default=os.getenv("EMBED_CACHE_DIR", ""),
+                    help="persistent embedding cache dir; only uncached chunks are encoded")
+    ap.add_argument("--workers", type=int, default=1, help="encoder processes (sharded, resumable encoding)")
+    ap.add_argument("--threads-per-worker", type=int, default=0, help="torch/BLAS threads per encoder process (0 = cpus/workers)")
+    ap.add_argument("--shard-size", type=int, default=4096, help="chunks per encoding shard / checkpoint")
+    ap.add_argument("--shard-dir", default="", help="shard checkpoints (default: <embed-cache or out-dir>/.embed_shards)")
+    ap.add_argument("--jsonl-meta", action="store_true", help="also write metadata.jsonl (for notebooks/debug)")
+    ap.add_argument("--index-type", choices=["flat", "ivf-flat", "ivf-pq", "hnsw"], default="flat")
+    ap.add_argument("--storage", choices=list(STORAGE_CODES), default="float32",
+                    help="vector storage: float32, float16 or int8 scalar quantization")
+    ap.add_argument("--pca", type=int, default=0, help="reduce vectors to this many dims with PCA before storage (0 = off)")
+    ap.add_argument("--nlist", type=int, default=0, help="IVF lists (0 = ~4*sqrt(N))")
+    ap.add_argument("--pq-m", type=int, default=48, help="IVF-PQ sub-quantizers (must divide dim)")
+    ap.add_argument("--pq-nbits", type=int, default=8)
+    ap.add_argument("--hnsw-m", type=int, default=32)
+    ap.add_argument("--ef-construction", type=int, default=200)
+    ap.add_argument("--train-sample", type=int, default=0, help="training vectors (0 = min(N, 256*nlist) for IVF, 65536 for PCA/SQ)")
+    ap.add_argument("--nprobe", type=int, default=16, help="IVF lists probed per query (saved for serving)")
+    ap.add_argument("--ef-search", type=int, default=64, help="HNSW efSearch (saved for serving)")
+    ap.add_argument("--eval-k", type=int, default=10, help="k for the recall/latency report")
+    ap.add_argument("--eval-csv", default="", help="CSV with a 'question' column (e.g. benchmark/qwen_generations.csv)")
+    ap.add_argument("--eval-sample", type=int, default=200, help="chunk vectors used as queries without --eval-csv")
     args = ap.parse_args()
 
+    version = args.version or time.strftime("%Y%m%d-%H%M%S")
+    if args.index_root:
+        args.out_dir = os.path.join(args.index_root, version)
+        if os.path.exists(args.out_dir):
+            ap.error(f"{args.out_dir} already exists")
+    elif not args.out_dir:
+        ap.error("one of --out-dir or --index-root is required")
     os.makedirs(args.out_dir, exist_ok=True)
 
-    # 1) load + convert to per-chunk records
-    all_chunks=[]
-    for obj in tqdm(read_jsonl(args.jsonl, max_docs=args.max_docs), desc="Loading"):
-        all_chunks.extend(to_records(
-            obj,
-            do_chunk=not args.no_chunk,
-            max_tokens=args.max_tokens,
-            overlap=args.overlap
-        ))
-
-    # 2) dedup
-    all_chunks = dedup(all_chunks)
-
-    # 3) save metadata
-    meta_path = os.path.join(args.out_dir, "metadata.jsonl")
-    with open(meta_path, "w", encoding="utf-8") as f:
-        for r in all_chunks:
-            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+    # 1-3) read -> chunk -> dedup -> metadata/BM25/pasal, streaming satu dokumen per kali
+    docs = read_jsonl(args.jsonl, max_docs=args.max_docs)
+    delta_merged = {}
+    if args.delta_log:
+        docs = apply_delta_log(docs, args.delta_log, delta_merged)
+    chunking = {"chunker": args.chunker, "no_chunk": args.no_chunk, "max_tokens": args.max_tokens,
+                "overlap": args.overlap}
+    tokenizer = None
+    if args.chunker == "tokens" and not args.no_chunk:
+        encoder = load_encoder(args.embed_model)
+        chunking.update({"tokenizer": args.embed_model,
+                         "chunk_tokens": args.chunk_tokens or encoder_chunk_limit(encoder),
+                         "overlap_tokens": args.chunk_overlap_tokens, "parents": not args.no_parent_chunks})
+        tokenizer = encoder.tokenizer
+        print(f"chunker: <= {chunking['chunk_tokens']} {args.embed_model} tokens per chunk")
+    dedup_stats = {"exact": 0}
+    records = dedup(iter_records(tqdm(docs, desc="Loading"), chunking, tokenizer), dedup_stats)
+    if args.near_dup > 0:
+        records = near_dedup(records, args.near_dup, args.minhash_perm, dedup_stats)
+    corpus = write_corpus(records, args.out_dir, also_jsonl=args.jsonl_meta, parents=bool(chunking.get("parents")))
+    n_rows = corpus["rows"]
+    print(f"chunks: {n_rows} → {corpus['meta']} (removed: {dedup_stats}, parents: {corpus['parents']})")
+    sparse_dir, n_terms, n_postings = corpus["sparse"]
+    print(f"sparse: {n_terms} terms, {n_postings} postings → {sparse_dir}")
+    pasal_path, n_statutes, n_keys = corpus["pasal"]
+    print(f"pasal index: {n_statutes} statutes, {n_keys} keys → {pasal_path}")
 
-    print(f"chunks: {len(all_chunks)} → {meta_path}")
+    # 4) embeddings: teks dibaca ulang per shard dari meta/text.*, vektor ke memmap sementara
+    shard_dir = args.shard_dir or os.path.join(args.embed_cache or args.index_root or args.out_dir, ".embed_shards")
+    emb_path = os.path.join(args.out_dir, ".embeddings.f32")
+    texts = ColumnReader(corpus["meta"], "text")
+    embs, cache_stats = build_embeddings(
+        texts, args.embed_model, emb_path, args.embed_cache,
+        workers=args.workers, threads=args.threads_per_worker, shard_size=args.shard_size, shard_dir=shard_dir,
+    )
+    texts.close()
+    print(f"embedding cache: {cache_stats}")
 
-    # 4) embeddings
-    embs = build_embeddings(all_chunks, args.embed_model)
-
-    # 5) faiss
+    # 5) faiss (ditambah per blok dari memmap)
     index_path = os.path.join(args.out_dir, "index.faiss")
-    build_faiss(embs, index_path)
+    index = build_faiss(embs, index_path, args)
 
     print(f"index: {index_path}")
+
+    # 6) recall/latency report vs exact flat search (float32)
+    if (args.storage != "float32" or args.pca) and not args.eval_csv and os.path.exists(BENCHMARK_QUESTIONS):
+        args.eval_csv = BENCHMARK_QUESTIONS
+    report = evaluate_index(index, embs, load_eval_queries(args, embs, args.embed_model), args.eval_k)
+    report["index_type"] = args.index_type
+    report["storage"] = args.storage
+    report["pca"] = args.pca
+    report["eval_queries"] = args.eval_csv or "chunk-sample"
+    report["index_bytes"] = os.path.getsize(index_path)
+    report["bytes_per_vector"] = round(report["index_bytes"] / max(int(index.ntotal), 1), 1)
+    report["embed_cache"] = cache_stats
+    report["dedup"] = dedup_stats
+    with open(os.path.join(args.out_dir, "build_report.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print("report:", json.dumps(report))
+    dim = int(embs.shape[1])
+    del embs
+    os.remove(emb_path)
+
+    # 7) manifest (+ publish versi baru)
+    manifest_path = write_manifest(args.out_dir, version, {
+        "embed_model": args.embed_model,
+        "dim": dim,
+        "chunking": {**chunking, "near_dup": args.near_dup, "minhash_perm": args.minhash_perm},
+        "index_type": args.index_type,
+        "storage": args.storage,
+        "pca": args.pca,
+        "counts": {"rows": n_rows, "vectors": int(index.ntotal)},
+        **({"delta_log": delta_merged} if delta_merged else {}),
+    })
+    print(f"manifest: {manifest_path}")
+    if args.index_root and not args.no_publish:
+        publish_version(args.index_root, version)
+        print(f"published: {args.index_root}/CURRENT -> {version}")
     print(f"done.")
 
 if __name__ == "__main__":